@@ -3,6 +3,7 @@ from django.utils.safestring import mark_safe
 
 from .models import *
 from .forms import CategoryForm
+from .reports import streaming_response
 
 # Register your models here.
 # admin.site.register(Category)
@@ -17,8 +18,7 @@ admin.site.register(ProductCart)
 
 admin.site.register(Delivery)
 
-admin.site.register(Order)
-admin.site.register(ProductOrder)
+admin.site.register(Payment)
 
 
 @admin.register(Category)
@@ -52,7 +52,8 @@ class ProductCharacteristicInline(admin.TabularInline):
 
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
-    list_display = ('pk', 'title', 'price', 'quantity', 'discount', 'category', 'model', 'product_image')
+    list_display = ('pk', 'title', 'price', 'discount', 'final_price', 'quantity', 'category', 'model',
+                    'product_image')
     list_display_links = ('pk', 'title')
     prepopulated_fields = {'slug': ('title',)}
     inlines = [ProductCharacteristicInline]
@@ -66,3 +67,51 @@ class ProductAdmin(admin.ModelAdmin):
             except:
                 return 'No image'
         return 'No image'
+
+
+@admin.register(Task)
+class TaskAdmin(admin.ModelAdmin):
+    list_display = ('pk', 'name', 'status', 'attempts', 'created_at', 'finished_at')
+    list_display_links = ('pk', 'name')
+    list_filter = ('status', 'name')
+    readonly_fields = ('created_at', 'started_at', 'finished_at')
+
+
+class ProductOrderInline(admin.TabularInline):
+    model = ProductOrder
+    extra = 0
+
+
+@admin.register(Order)
+class OrderAdmin(admin.ModelAdmin):
+    list_display = ('pk', 'customer', 'price', 'completed', 'created_at')
+    list_display_links = ('pk', 'customer')
+    list_filter = ('completed', 'created_at')
+    list_select_related = ('customer__user',)
+    date_hierarchy = 'created_at'
+    inlines = [ProductOrderInline]
+    actions = ['export_orders_csv', 'export_orders_xlsx', 'export_daily_revenue', 'export_product_units']
+
+    @admin.action(description='Выгрузить заказы с товарами (CSV)')
+    def export_orders_csv(self, request, queryset):
+        return streaming_response('orders', 'csv', queryset)
+
+    @admin.action(description='Выгрузить заказы с товарами (XLSX)')
+    def export_orders_xlsx(self, request, queryset):
+        return streaming_response('orders', 'xlsx', queryset)
+
+    @admin.action(description='Выручка по дням (CSV)')
+    def export_daily_revenue(self, request, queryset):
+        return streaming_response('daily_revenue', 'csv', queryset)
+
+    @admin.action(description='Продажи по товарам (CSV)')
+    def export_product_units(self, request, queryset):
+        return streaming_response('product_units', 'csv', queryset)
+
+
+@admin.register(ProductOrder)
+class ProductOrderAdmin(admin.ModelAdmin):
+    list_display = ('pk', 'order', 'name', 'price', 'quantity', 'total_price')
+    list_display_links = ('pk', 'name')
+    list_select_related = ('order__customer__user',)
+    search_fields = ('name', 'slug')
@@ -0,0 +1,18 @@
+from django.urls import path
+
+from . import async_views
+from .urls import urlpatterns as sync_urlpatterns
+
+# Те же маршруты, что в digital/urls.py, но страницы каталога, корзины и оплаты — асинхронные (для ASGI)
+ASYNC_VIEWS = {
+    'main': async_views.main_page,
+    'detail': async_views.product_detail,
+    'category': async_views.product_by_category,
+    'favs': async_views.favorite_list,
+    'basket': async_views.my_cart_view,
+    'search': async_views.search_products,
+    'payment': async_views.create_checkout_session,
+}
+
+urlpatterns = [path(str(p.pattern), ASYNC_VIEWS[p.name], name=p.name) if p.name in ASYNC_VIEWS else p
+               for p in sync_urlpatterns]
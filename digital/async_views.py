@@ -0,0 +1,167 @@
+import stripe
+from asgiref.sync import sync_to_async
+from django.contrib.auth.decorators import login_required
+from django.core.paginator import Paginator
+from django.db.models import F, Prefetch
+from django.http import Http404
+from django.contrib import messages
+from django.shortcuts import redirect, render
+from django.template.response import TemplateResponse
+from django.urls import reverse
+
+from .catalog import aget_showcase, category_products, get_related_products
+from .facets import ProductFacets
+from .forms import DeliveryForm
+from .models import Category, FavoriteProduct, Payment, Product, ProductCharacteristic
+from .pagecache import category_page_cache, main_page_cache, product_page_cache
+from .pagination import CursorPaginator
+from .payments import checkout_params, create_payment, get_gateway
+from .search import SearchResults
+from .sorting import RELEVANCE_SORT, get_sort, sort_choices, sort_ordering
+from .utils import acart_info
+from .views import SAME_MODELS_LIMIT, SEARCH_PAGE_SIZE, FavoriteList, ProductByCategory
+
+# Асинхронные версии страниц каталога для ASGI (см. digital/async_urls.py).
+# Запросы контекста идут через async ORM по очереди: Django выполняет их в одном потоке
+# (thread_sensitive), так что asyncio.gather их не распараллелил бы. Выигрыш ASGI — поток не занят,
+# пока страница ждёт внешние сервисы (Stripe). Шаблоны рендерятся синхронно (теги обращаются к БД).
+
+arender = sync_to_async(render)
+
+
+# Страница списка: ?cursor= — пагинация по ключу, иначе по номеру страницы
+def paginate(request, queryset, per_page, cursor_ordering):
+    cursor = request.GET.get('cursor')
+    if cursor is not None:
+        paginator = CursorPaginator(queryset, per_page, cursor_ordering)
+        page_obj = paginator.page(cursor)
+    else:
+        paginator = Paginator(queryset, per_page)
+        page_obj = paginator.get_page(request.GET.get('page'))
+        page_obj.object_list = list(page_obj.object_list)
+    return {
+        'paginator': paginator,
+        'page_obj': page_obj,
+        'is_paginated': page_obj.has_other_pages(),
+        'products': page_obj.object_list,
+    }
+
+
+apaginate = sync_to_async(paginate)
+
+
+# Главная страница
+@main_page_cache
+async def main_page(request):
+    context = {'title': 'Digital Market', 'products': await aget_showcase()}
+    return TemplateResponse(request, 'digital/index.html', context)
+
+
+# Страница карточки товара
+@product_page_cache
+async def product_detail(request, slug):
+    characteristics = ProductCharacteristic.objects.select_related('characteristic')
+    try:
+        product = await Product.objects.select_related('category__parent', 'model') \
+            .prefetch_related(Prefetch('product_characteristics', queryset=characteristics)).aget(slug=slug)
+    except Product.DoesNotExist:
+        raise Http404('Товар не найден')
+
+    async def same_models():
+        return [p async for p in Product.objects.filter(model=product.model_id)
+                .only('slug', 'color_code').order_by('pk')[:SAME_MODELS_LIMIT]]
+
+    models = await same_models()
+    related = await sync_to_async(get_related_products)(product)
+    context = {'title': product.title, 'product': product, 'same_models': models, 'same_products': related}
+    return TemplateResponse(request, 'digital/product_detail.html', context)
+
+
+# Страница товаров в категории
+@category_page_cache
+async def product_by_category(request, slug):
+    try:
+        category = await Category.objects.aget(slug=slug)
+    except Category.DoesNotExist:
+        raise Http404('Категория не найдена')
+    facets = ProductFacets(request.GET, category_products(category))
+    sort = get_sort(request.GET)
+    ordering = sort_ordering(sort)
+
+    page = await apaginate(request, facets.queryset.order_by(*ordering), ProductByCategory.paginate_by, ordering)
+    sidebar = await sync_to_async(facets.sidebar_context)(category)
+    context = {'title': category.title, 'sort': sort, 'sort_choices': sort_choices(), **page, **sidebar}
+    return TemplateResponse(request, 'digital/category.html', context)
+
+
+# Список избранного
+@login_required(login_url='auth')
+async def favorite_list(request):
+    user = await request.auser()
+    products = Product.objects.filter(favoriteproduct__user=user) \
+        .annotate(favorited_at=F('favoriteproduct__created_at')).order_by('favorited_at', 'pk')
+
+    async def favorite_ids():
+        return {pk async for pk in FavoriteProduct.objects.filter(user=user).values_list('product_id', flat=True)}
+
+    request._favorite_ids = await favorite_ids()
+    page = await apaginate(request, products, FavoriteList.paginate_by, FavoriteList.cursor_ordering)
+    context = {'title': 'Избранные товары', **page}
+    return await arender(request, 'digital/product_list.html', context)
+
+
+# Страница корзины
+async def my_cart_view(request):
+    cart = await acart_info(request)
+    context = {
+        'title': 'Корзина',
+        'products_cart': cart['products_cart'],
+        'cart_price': cart['cart_price'],
+        'cart_quantity': cart['cart_quantity']
+    }
+    return await arender(request, 'digital/my_cart.html', context)
+
+
+# Страница поиска
+async def search_products(request):
+    query = request.GET.get('q', '')
+    sort = get_sort(request.GET, default=RELEVANCE_SORT)
+    paginator = Paginator(SearchResults(query, sort), SEARCH_PAGE_SIZE)
+    page_obj = await sync_to_async(paginator.get_page)(request.GET.get('page'))
+
+    context = {
+        'title': f'Поиск: {query}',
+        'products': page_obj.object_list,
+        'page_obj': page_obj,
+        'query': query,
+        'sort': sort,
+        'sort_choices': sort_choices([(RELEVANCE_SORT, 'По релевантности')])
+    }
+    return await arender(request, 'digital/search.html', context)
+
+
+# Страница оплаты: запрос в Stripe не занимает поток, пока ждёт ответа
+@login_required(login_url='auth')
+async def create_checkout_session(request):
+    if request.method != 'POST':
+        return redirect('checkout')
+    cart = await acart_info(request)
+    form = DeliveryForm(data=request.POST)
+    if not cart['products_cart'] or not await sync_to_async(form.is_valid)():
+        messages.error(request, 'Ошибка: корзина пуста или неверные данные доставки')
+        return redirect('basket')
+
+    payment = create_payment(cart, form)
+    await payment.asave()
+    params = checkout_params(cart, payment, request.build_absolute_uri(reverse('success')),
+                             request.build_absolute_uri(reverse('basket')))
+    try:
+        session = await get_gateway().acreate_checkout_session(params)
+    except stripe.StripeError:
+        await Payment.objects.filter(pk=payment.pk).aupdate(status=Payment.FAILED)
+        messages.error(request, 'Платёжный сервис недоступен, попробуйте позже')
+        return redirect('basket')
+
+    payment.session_id = session.id
+    await payment.asave(update_fields=['session_id', 'updated_at'])
+    return redirect(session.url)
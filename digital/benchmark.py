@@ -0,0 +1,318 @@
+import asyncio
+import json
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from dataclasses import dataclass
+
+import stripe
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import OperationalError, close_old_connections, connections, reset_queries
+from django.test import AsyncClient, Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from . import search, taskqueue
+from .catalog import category_products
+from .models import (Cart, Category, Characteristic, Customer, FavoriteProduct, ModelProduct, Payment, Product,
+                     ProductCart, ProductCharacteristic)
+from .pagination import encode_cursor
+from .sorting import SORT_MODES, sort_ordering
+from .utils import CartForAuthenticatedUser
+
+BENCHMARK_USERNAME = 'benchmark'
+BENCHMARK_PASSWORD = 'benchmark-password'
+# Замер идёт в одном процессе на тестовой БД: свой кэш в памяти, чтобы не смешивать ключи
+# с общим кэшем рабочей БД и не очищать его
+BENCHMARK_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+DELIVERY_DATA = {
+    'region': 'Ташкент', 'city': 'Ташкент', 'address': 'ул. Тестовая, 1', 'comment': '',
+    'phone': '+998900000000', 'first_name': 'Bench', 'last_name': 'Mark', 'email': 'bench@example.com'
+}
+
+
+@dataclass
+class Measurement:
+    name: str
+    status: int
+    queries: int
+    time_ms: float
+    memory_kb: float
+
+
+@dataclass
+class Throughput:
+    name: str
+    requests: int
+    errors: int
+    seconds: float
+
+    @property
+    def rps(self):
+        return round(self.requests / self.seconds, 1) if self.seconds else 0
+
+
+# Синтетический каталог: categories корневых категорий по subcategories подкатегорий,
+# products товаров поровну между подкатегориями, у каждого товара characteristics характеристик
+def seed_catalog(products=1000, categories=5, subcategories=4, models=50, characteristics=5,
+                 cart_lines=5, favorites=10, batch_size=1000):
+    roots = Category.objects.bulk_create(
+        [Category(title=f'Категория {i}', slug=f'bench-cat-{i}') for i in range(categories)])
+    subcats = Category.objects.bulk_create(
+        [Category(title=f'Бренд {i}-{j}', slug=f'bench-cat-{i}-{j}', parent=root)
+         for i, root in enumerate(roots) for j in range(subcategories)])
+    model_objs = ModelProduct.objects.bulk_create(
+        [ModelProduct(title=f'Model {i}', slug=f'bench-model-{i}') for i in range(models)])
+    chars = Characteristic.objects.bulk_create(
+        [Characteristic(name=f'Характеристика {i}') for i in range(characteristics)])
+
+    # Товары и их характеристики пачками: на миллионе товаров весь каталог в памяти не помещается
+    first_batch = last = None
+    for start in range(0, products, batch_size):
+        batch = [Product(title=f'Товар {subcats[i % len(subcats)].title} Model {i % models} №{i}',
+                         slug=f'bench-product-{i}',
+                         image=f'products/bench-product-{i}.jpg',
+                         price=500 + (i * 37) % 20000,
+                         discount=(i % 4) * 5,
+                         quantity=i % 20,
+                         sales_count=(i * 13) % 200,
+                         category=subcats[i % len(subcats)],
+                         root_category_id=subcats[i % len(subcats)].parent_id,
+                         model=model_objs[i % models]) for i in range(start, min(start + batch_size, products))]
+        for product in batch:
+            product.compute_prices()
+        batch = Product.objects.bulk_create(batch)
+        ProductCharacteristic.objects.bulk_create(
+            [ProductCharacteristic(product=p, characteristic=c, value=f'Значение {(p.pk + k) % 7}')
+             for p in batch for k, c in enumerate(chars)], batch_size=batch_size)
+        first_batch, last = first_batch or batch, batch[-1]
+
+    user = User.objects.create_user(BENCHMARK_USERNAME, password=BENCHMARK_PASSWORD)
+    customer = Customer.objects.create(user=user, phone_number='+998900000000')
+    cart = Cart.objects.create(customer=customer)
+    in_stock = [p for p in first_batch if p.quantity > 1]
+    ProductCart.objects.bulk_create([ProductCart(cart=cart, product=p, quantity=1) for p in in_stock[:cart_lines]])
+    FavoriteProduct.objects.bulk_create([FavoriteProduct(user=user, product=p) for p in first_batch[:favorites]])
+
+    search.rebuild_index()
+    return {'user': user, 'root': roots[0], 'subcategory': subcats[0], 'product': last,
+            'cart_products': in_stock[:cart_lines]}
+
+
+# Замер вызова: число SQL-запросов по всем БД, время и пик памяти; func возвращает код ответа
+def measure_call(name, func, clear_cache=True):
+    if clear_cache:
+        cache.clear()
+    # Журнал запросов ограничен 9000 записями: после заполнения каталога на миллион товаров
+    # CaptureQueriesContext без очистки насчитал бы ноль
+    reset_queries()
+    with ExitStack() as stack:
+        captured = [stack.enter_context(CaptureQueriesContext(connections[alias])) for alias in connections]
+        tracemalloc.start()
+        started = time.perf_counter()
+        status = func()
+        elapsed = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return Measurement(name=name, status=status, queries=sum(len(c) for c in captured),
+                       time_ms=round(elapsed * 1000, 2), memory_kb=round(peak / 1024, 1))
+
+
+# Один запрос через тестовый клиент
+def measure(name, client, method, url, data=None, **extra):
+    return measure_call(name, lambda: getattr(client, method)(url, data or {}, **extra).status_code)
+
+
+# Повторный запрос анонимного посетителя: страница отдаётся из кэша страниц
+def measure_cached(name, client, url):
+    cache.clear()
+    client.get(url)
+    return measure_call(name, lambda: client.get(url).status_code, clear_cache=False)
+
+
+# Курсор страницы из середины листинга категории в порядке sort
+def middle_cursor(category, sort):
+    ordering = sort_ordering(sort)
+    products = category_products(category).order_by(*ordering)
+    product = products[products.count() // 2]
+    return encode_cursor([getattr(product, field.lstrip('-')) for field in ordering], 'n')
+
+
+def run_scenarios(data):
+    anonymous = Client()
+    client = Client()
+    client.force_login(data['user'])
+    query = data['product'].title.split()[1]
+
+    results = [
+        measure('main', anonymous, 'get', reverse('main')),
+        measure('product_detail', anonymous, 'get', data['product'].get_absolute_url()),
+        measure('category', anonymous, 'get', data['root'].get_absolute_url()),
+        measure_cached('main_cached', anonymous, reverse('main')),
+        measure_cached('product_detail_cached', anonymous, data['product'].get_absolute_url()),
+        measure_cached('category_cached', anonymous, data['root'].get_absolute_url()),
+        measure('category_filtered', anonymous, 'get', data['root'].get_absolute_url(),
+                {'cat': data['subcategory'].slug, 'price_from': 1000, 'page': 2}),
+        measure('category_deep_page', anonymous, 'get', data['root'].get_absolute_url(), {'page': 'last'}),
+        measure('search', anonymous, 'get', reverse('search'), {'q': query}),
+        measure('favorites', client, 'get', reverse('favs')),
+        measure('basket', client, 'get', reverse('basket')),
+        measure('add_to_cart', client, 'get', reverse('action_cart', args=(data['cart_products'][0].slug, 'add'))),
+        measure('checkout', client, 'post', reverse('checkout')),
+    ]
+    # Сортировка + пагинация по ключу с середины листинга: стоимость не должна расти с размером каталога
+    for sort in SORT_MODES:
+        results.append(measure(f'sort_{sort}', anonymous, 'get', data['root'].get_absolute_url(),
+                               {'sort': sort, 'cursor': middle_cursor(data['root'], sort)}))
+    results.append(measure_webhook(data['user']))
+    results.append(measure_call('finalize_payment_task', lambda: 200 if taskqueue.run_pending() else 500))
+    return results
+
+
+# Вебхук об успешной оплате: ставит оформление заказа из корзины пользователя в очередь
+def measure_webhook(user, secret='whsec_benchmark'):
+    cart = CartForAuthenticatedUser(None, user=user).get_cart_info()
+    payment = Payment.objects.create(customer=cart['customer'], amount=cart['cart_price'],
+                                     delivery_data=DELIVERY_DATA, session_id='cs_test_benchmark',
+                                     lines=[{'product': line.product_id, 'quantity': line.quantity,
+                                             'price': line.unit_price} for line in cart['products_cart']])
+    payload = json.dumps({'id': 'evt_benchmark', 'object': 'event', 'type': 'checkout.session.completed',
+                          'data': {'object': {'id': payment.session_id, 'object': 'checkout.session',
+                                              'client_reference_id': str(payment.pk),
+                                              'payment_status': 'paid'}}})
+    with override_settings(STRIPE_WEBHOOK_SECRET=secret):
+        return measure('stripe_webhook', Client(), 'post', reverse('stripe_webhook'), payload,
+                       content_type='application/json',
+                       HTTP_STRIPE_SIGNATURE=stripe.WebhookSignature.generate_signature_header(payload, secret))
+
+
+def load_budget(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_budget(path, results, time_factor=3, memory_factor=2):
+    budget = {r.name: {'queries': r.queries,
+                       'time_ms': round(r.time_ms * time_factor, 1),
+                       'memory_kb': round(r.memory_kb * memory_factor, 1)} for r in results}
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(budget, f, indent=4, ensure_ascii=False)
+        f.write('\n')
+
+
+# Превышения бюджета: список строк вида "basket: queries 12 > 8"
+def check_budget(results, budget, metrics=('queries', 'time_ms', 'memory_kb')):
+    errors = []
+    for result in results:
+        limits = budget.get(result.name, {})
+        for metric in metrics:
+            if metric in limits and getattr(result, metric) > limits[metric]:
+                errors.append(f'{result.name}: {metric} {getattr(result, metric)} > {limits[metric]}')
+    return errors
+
+
+def catalog_urls(data):
+    return [reverse('main'), data['product'].get_absolute_url(), data['root'].get_absolute_url(),
+            f'{reverse("search")}?q={data["product"].title.split()[1]}']
+
+
+def _wsgi_run(urls, requests, concurrency):
+    def fetch(i):
+        return Client().get(urls[i % len(urls)]).status_code
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        return list(pool.map(fetch, range(requests)))
+
+
+async def _asgi_run(urls, requests, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def fetch(i):
+        async with semaphore:
+            response = await AsyncClient().get(urls[i % len(urls)])
+            return response.status_code
+
+    return await asyncio.gather(*(fetch(i) for i in range(requests)))
+
+
+# Пропускная способность страниц каталога: синхронные представления в потоках (WSGI)
+# против асинхронных представлений в одном цикле событий (ASGI)
+def compare_handlers(data, requests=200, concurrency=20):
+    results = []
+    for name, urlconf, run in (('wsgi', 'digital.urls', lambda urls: _wsgi_run(urls, requests, concurrency)),
+                               ('asgi', 'digital.async_urls',
+                                lambda urls: asyncio.run(_asgi_run(urls, requests, concurrency)))):
+        with override_settings(ROOT_URLCONF=urlconf):
+            urls = catalog_urls(data)
+            cache.clear()
+            started = time.perf_counter()
+            statuses = run(urls)
+            elapsed = time.perf_counter() - started
+        results.append(Throughput(name=name, requests=requests, errors=sum(s >= 400 for s in statuses),
+                                  seconds=round(elapsed, 3)))
+    return results
+
+
+# Профили соединения для нагрузочного замера корзины: настройки проекта против настроек Django
+# по умолчанию (соединение на каждый запрос, у SQLite — журнал DELETE без прагм)
+def _baseline_settings(settings_dict):
+    options = {'init_command': 'PRAGMA journal_mode = DELETE'} if settings_dict['ENGINE'].endswith('sqlite3') else {}
+    return {'CONN_MAX_AGE': 0, 'OPTIONS': options}
+
+
+def _load_users(count):
+    users = []
+    for i in range(count):
+        user, created = User.objects.get_or_create(username=f'load-{i}')
+        if created:
+            Cart.objects.create(customer=Customer.objects.create(user=user, phone_number=f'+99890{i:07d}'))
+        users.append(user)
+    return users
+
+
+def _cart_writer(user, slugs, operations):
+    writes = errors = 0
+    try:
+        for i in range(operations):
+            slug = slugs[i % len(slugs)]
+            cart = CartForAuthenticatedUser(None, user=user)
+            try:
+                cart.add_or_delete(slug, 'add')
+                cart.get_cart_info()
+                cart.add_or_delete(slug, 'delete')
+                writes += 2
+            except OperationalError:
+                errors += 1
+            # Конец «запроса»: как request_finished — соединение закрывается или остаётся по CONN_MAX_AGE
+            close_old_connections()
+    finally:
+        connections.close_all()
+    return writes, errors
+
+
+# Запись в корзины под конкурентной нагрузкой: threads потоков, у каждого свой покупатель,
+# operations итераций «добавить, прочитать корзину, убрать». Результат — записей в секунду
+def cart_write_load(threads=(1, 4, 16), operations=200):
+    slugs = [p.slug for p in Product.objects.filter(quantity__gt=1).order_by('pk')[:20]]
+    users = _load_users(max(threads))
+    settings_dict = connections['default'].settings_dict
+    configured = {key: settings_dict[key] for key in ('CONN_MAX_AGE', 'OPTIONS')}
+    results = []
+    for profile, overrides in (('baseline', _baseline_settings(settings_dict)), ('configured', configured)):
+        connections.close_all()
+        settings_dict.update(overrides)
+        try:
+            for count in threads:
+                started = time.perf_counter()
+                with ThreadPoolExecutor(count) as pool:
+                    done = list(pool.map(lambda user: _cart_writer(user, slugs, operations), users[:count]))
+                elapsed = time.perf_counter() - started
+                results.append(Throughput(name=f'{connections["default"].vendor} {profile} x{count}',
+                                          requests=sum(writes for writes, _ in done),
+                                          errors=sum(errors for _, errors in done), seconds=round(elapsed, 3)))
+        finally:
+            connections.close_all()
+            settings_dict.update(configured)
+    return results
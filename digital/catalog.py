@@ -0,0 +1,151 @@
+import time
+
+from django.core.cache import cache
+from django.db.models import Case, Count, F, FloatField, IntegerField, OuterRef, Q, Subquery, Value, When, Window
+from django.db.models.functions import Abs, Cast, Coalesce, RowNumber
+
+from .models import Category, Product, ProductCharacteristic
+
+CATEGORY_TREE_TIMEOUT = 60 * 60 * 24
+
+# Сколько последних товаров каждой подкатегории показывать на главной
+SHOWCASE_SIZE = 2
+# Остатки меняются без сигналов (оформление заказа), поэтому витрина живёт недолго
+SHOWCASE_TIMEOUT = 60 * 5
+
+# Похожие товары: сколько показывать и веса признаков
+RELATED_LIMIT = 8
+RELATED_TIMEOUT = 60 * 60
+RELATED_MODEL_WEIGHT = 3.0
+RELATED_CHARACTERISTIC_WEIGHT = 1.0
+RELATED_PRICE_WEIGHT = 2.0
+
+
+# Версия группы ключей кэша: смена версии делает старые ключи недоступными.
+# Версия — момент смены в наносекундах, а не счётчик: вытесненный из кэша ключ версии (файловый кэш
+# чистит записи сверх MAX_ENTRIES) получает новое значение, а не 1, при котором снова читались бы старые
+# записи. Смена — простая запись без чтения, поэтому одновременные сбросы из разных процессов не теряются
+def _cache_version(name):
+    return cache.get_or_set(f'{name}:version', time.time_ns, None)
+
+
+# Версии нескольких групп за одно обращение к кэшу; недостающие заводятся так же, как в _cache_version
+def _cache_versions(names):
+    keys = [f'{name}:version' for name in names]
+    versions = cache.get_many(keys)
+    missing = [key for key in keys if key not in versions]
+    if missing:
+        for key in missing:
+            cache.add(key, time.time_ns(), None)
+        versions.update(cache.get_many(missing))
+    return [versions[key] for key in keys]
+
+
+def _bump_cache_version(name):
+    cache.set(f'{name}:version', time.time_ns(), None)
+
+
+async def _acache_version(name):
+    return await cache.aget_or_set(f'{name}:version', time.time_ns, None)
+
+
+def _cached(name, build, timeout):
+    key = f'{name}:v{_cache_version(name)}'
+    value = cache.get(key)
+    if value is None:
+        value = build()
+        cache.set(key, value, timeout)
+    return value
+
+
+# Дерево категорий одним запросом: корневые категории с заполненным children
+def build_category_tree():
+    categories = list(Category.objects.order_by('pk'))
+    by_parent = {}
+    for category in categories:
+        by_parent.setdefault(category.parent_id, []).append(category)
+    for category in categories:
+        category.children = by_parent.get(category.pk, [])
+    return by_parent.get(None, [])
+
+
+def get_category_tree():
+    return _cached('category_tree', build_category_tree, CATEGORY_TREE_TIMEOUT)
+
+
+def invalidate_category_tree():
+    _bump_cache_version('category_tree')
+
+
+# Товары подкатегорий category для листинга — по копии родителя подкатегории в самом товаре (root_category).
+# БД читает только товары категории по индексу (root_category, поле сортировки, id) и останавливается,
+# набрав страницу: стоимость не зависит ни от размера каталога, ни от доли категории в нём
+def category_products(category):
+    return Product.objects.filter(root_category=category)
+
+
+# Витрина главной: последние SHOWCASE_SIZE товаров каждой подкатегории, одним запросом
+def showcase_queryset():
+    return Product.objects.filter(category__parent__isnull=False, category__parent__parent__isnull=True) \
+        .annotate(showcase_rank=Window(RowNumber(), partition_by=F('category'), order_by=F('pk').desc())) \
+        .filter(showcase_rank__lte=SHOWCASE_SIZE) \
+        .order_by('category__parent', 'category', '-pk')
+
+
+def build_showcase():
+    return list(showcase_queryset())
+
+
+def get_showcase():
+    return _cached('showcase', build_showcase, SHOWCASE_TIMEOUT)
+
+
+async def aget_showcase():
+    key = f'showcase:v{await _acache_version("showcase")}'
+    products = await cache.aget(key)
+    if products is None:
+        products = [product async for product in showcase_queryset()]
+        await cache.aset(key, products, SHOWCASE_TIMEOUT)
+    return products
+
+
+def invalidate_showcase():
+    _bump_cache_version('showcase')
+
+
+# Похожие товары из той же родительской категории, по убыванию оценки:
+# та же модель + совпавшие характеристики + близость цены. Один запрос, ограниченный RELATED_LIMIT
+def build_related_ids(product, limit=RELATED_LIMIT):
+    same_model = Case(When(model_id=product.model_id, then=Value(RELATED_MODEL_WEIGHT)), default=Value(0.0),
+                      output_field=FloatField())
+
+    pairs = Q()
+    for pc in product.product_characteristics.all():
+        pairs |= Q(characteristic_id=pc.characteristic_id, value=pc.value)
+    if pairs:
+        shared = ProductCharacteristic.objects.filter(pairs, product=OuterRef('pk')) \
+            .values('product').annotate(count=Count('pk')).values('count')
+        shared_characteristics = Cast(Coalesce(Subquery(shared, output_field=IntegerField()), 0), FloatField())
+    else:
+        shared_characteristics = Value(0.0)
+
+    price_distance = Cast(Abs(F('final_price') - product.final_price), FloatField()) / max(product.final_price, 1)
+    price_proximity = Value(1.0) / (Value(1.0) + price_distance)
+
+    score = same_model + shared_characteristics * RELATED_CHARACTERISTIC_WEIGHT + \
+        price_proximity * RELATED_PRICE_WEIGHT
+    return list(Product.objects.filter(category__parent_id=product.category.parent_id)
+                .exclude(pk=product.pk)
+                .annotate(related_score=score)
+                .order_by('-related_score', 'pk')
+                .values_list('pk', flat=True)[:limit])
+
+
+def get_related_products(product, limit=RELATED_LIMIT):
+    key = f'related_products:{product.pk}:{product.updated_at.timestamp()}:{limit}'
+    ids = cache.get(key)
+    if ids is None:
+        ids = build_related_ids(product, limit)
+        cache.set(key, ids, RELATED_TIMEOUT)
+    products = Product.objects.in_bulk(ids)
+    return [products[pk] for pk in ids if pk in products]
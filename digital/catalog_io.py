@@ -0,0 +1,290 @@
+import csv
+import json
+import time
+
+from django.db import transaction
+from django.utils import timezone
+
+from . import search
+from .catalog import invalidate_category_tree, invalidate_showcase
+from .images import schedule_product_images
+from .models import Category, Characteristic, ModelProduct, Product, ProductCharacteristic
+from .pagecache import invalidate_pages
+
+# Обмен каталогом построчно (CSV или JSONL). Каждая строка — одна запись с полем type;
+# связи задаются слагами (характеристика — по названию), в CSV у всех строк общий набор колонок
+ROW_FIELDS = {
+    'category': ('slug', 'title', 'parent', 'icon'),
+    'model': ('slug', 'title'),
+    'product': ('slug', 'title', 'category', 'model', 'price', 'discount', 'quantity', 'guarantee',
+                'color_name', 'color_code', 'image'),
+    'characteristic': ('product', 'characteristic', 'value'),
+}
+CSV_COLUMNS = ['type'] + list(dict.fromkeys(field for fields in ROW_FIELDS.values() for field in fields))
+PRODUCT_INT_FIELDS = ('price', 'discount', 'quantity', 'guarantee')
+PRODUCT_TEXT_FIELDS = ('color_name', 'color_code', 'image')
+# У уже заведённого товара обновляются эти поля и те из PRODUCT_INT_FIELDS/PRODUCT_TEXT_FIELDS, что есть в строке:
+# пропущенная колонка не затирает значение значением по умолчанию
+PRODUCT_UPDATE_FIELDS = ('title', 'category', 'root_category', 'model', 'final_price', 'monthly_price', 'updated_at')
+FORMATS = ('csv', 'jsonl')
+
+
+def detect_format(path, fmt=None):
+    if fmt:
+        return fmt
+    for name in FORMATS:
+        if path.endswith(f'.{name}'):
+            return name
+    raise ValueError(f'Не удалось определить формат файла {path}, укажите --format')
+
+
+# Строка, которую не удалось разобрать: импорт записывает её в ошибки, как и неверную запись
+class BadRow:
+    def __init__(self, message):
+        self.message = message
+
+
+def read_rows(f, fmt):
+    if fmt == 'jsonl':
+        for line in f:
+            if line.strip():
+                try:
+                    yield json.loads(line)
+                except ValueError as e:
+                    yield BadRow(f'неверный JSON: {e}')
+    else:
+        for row in csv.DictReader(f):
+            yield {key: value for key, value in row.items() if value not in ('', None)}
+
+
+class RowWriter:
+    def __init__(self, f, fmt):
+        self.f = f
+        self.fmt = fmt
+        if fmt == 'csv':
+            self.writer = csv.DictWriter(f, CSV_COLUMNS)
+            self.writer.writeheader()
+
+    def write(self, row):
+        if self.fmt == 'jsonl':
+            self.f.write(json.dumps(row, ensure_ascii=False) + '\n')
+        else:
+            self.writer.writerow(row)
+
+
+class CatalogImporter:
+    # Буферы записей по типам (ключ — слаг, последняя строка побеждает), сбрасываются пачками
+    # по batch_size. Уровни зависят друг от друга, поэтому перед сбросом товаров сбрасываются
+    # категории и модели, перед характеристиками — товары
+    def __init__(self, batch_size=1000):
+        self.batch_size = batch_size
+        self.categories = dict(Category.objects.values_list('slug', 'pk'))
+        self.category_parents = dict(Category.objects.values_list('pk', 'parent_id'))
+        self.models = dict(ModelProduct.objects.values_list('slug', 'pk'))
+        self.products = dict(Product.objects.values_list('slug', 'pk'))
+        self.characteristics = dict(Characteristic.objects.order_by('-pk').values_list('name', 'pk'))
+        # Новые и сменившиеся картинки товаров: копии для них нарежет очередь после импорта
+        self.images = set()
+        self.pending = {row_type: {} for row_type in ROW_FIELDS}
+        self.counts = {row_type: 0 for row_type in ROW_FIELDS}
+        self.errors = []
+        self.started = time.perf_counter()
+
+    @property
+    def total(self):
+        return sum(self.counts.values())
+
+    @property
+    def rate(self):
+        elapsed = time.perf_counter() - self.started
+        return round(self.total / elapsed) if elapsed else 0
+
+    def add(self, line, row):
+        if isinstance(row, BadRow):
+            return self._error(line, row.message)
+        if not isinstance(row, dict):
+            return self._error(line, 'запись должна быть объектом JSON')
+        row_type = row.get('type')
+        if row_type not in ROW_FIELDS:
+            return self._error(line, f'неизвестный тип записи {row_type!r}')
+        if row_type == 'characteristic':
+            key = (row.get('product'), row.get('characteristic'))
+            if None in key:
+                return self._error(line, 'нужны product и characteristic')
+        else:
+            key = row.get('slug')
+            if not key or not row.get('title'):
+                return self._error(line, 'нужны slug и title')
+        if row_type == 'category' and row.get('parent') in self.pending['category']:
+            self._flush('category')
+
+        pending = self.pending[row_type]
+        pending[key] = (line, row)
+        if len(pending) >= self.batch_size:
+            self.flush(row_type)
+
+    def _error(self, line, message):
+        self.errors.append(f'строка {line}: {message}')
+
+    def flush(self, row_type=None):
+        order = list(ROW_FIELDS)
+        for name in order[:order.index(row_type) + 1] if row_type else order:
+            self._flush(name)
+
+    def _flush(self, row_type):
+        rows = list(self.pending[row_type].values())
+        self.pending[row_type] = {}
+        if rows:
+            with transaction.atomic():
+                getattr(self, f'_save_{row_type}')(rows)
+
+    def _resolve(self, lookup, line, value, what):
+        if value is None:
+            return None
+        pk = lookup.get(value)
+        if pk is None:
+            self._error(line, f'{what} {value!r} не найден(а)')
+        return pk
+
+    def _save_category(self, rows):
+        objs = []
+        for line, row in rows:
+            parent_id = self._resolve(self.categories, line, row.get('parent'), 'родительская категория')
+            if row.get('parent') is not None and parent_id is None:
+                continue
+            objs.append(Category(slug=row['slug'], title=row['title'], parent_id=parent_id,
+                                 icon=row.get('icon') or None))
+        Category.objects.bulk_create(objs, update_conflicts=True, unique_fields=['slug'],
+                                     update_fields=['title', 'parent', 'icon'])
+        self.categories.update((obj.slug, obj.pk) for obj in objs)
+        # bulk_create не шлёт сигналы: товары перенесённой подкатегории переводятся в раздел нового родителя
+        for obj in objs:
+            if obj.pk in self.category_parents and self.category_parents[obj.pk] != obj.parent_id:
+                Product.objects.filter(category_id=obj.pk).update(root_category_id=obj.parent_id)
+            self.category_parents[obj.pk] = obj.parent_id
+        self.counts['category'] += len(objs)
+
+    def _save_model(self, rows):
+        objs = [ModelProduct(slug=row['slug'], title=row['title']) for _, row in rows]
+        ModelProduct.objects.bulk_create(objs, update_conflicts=True, unique_fields=['slug'], update_fields=['title'])
+        self.models.update((obj.slug, obj.pk) for obj in objs)
+        self.counts['model'] += len(objs)
+
+    # Цены считаются из price и discount: если в строке одного из них нет, берётся сохранённое значение
+    def _save_product(self, rows):
+        now = timezone.now()
+        stored = {slug: (price, discount, image) for slug, price, discount, image in Product.objects.filter(
+            slug__in=[row['slug'] for _, row in rows]).values_list('slug', 'price', 'discount', 'image')}
+        groups = {}
+        for line, row in rows:
+            category_id = self._resolve(self.categories, line, row.get('category'), 'категория')
+            model_id = self._resolve(self.models, line, row.get('model'), 'модель')
+            if category_id is None or model_id is None:
+                if row.get('category') is None or row.get('model') is None:
+                    self._error(line, 'нужны category и model')
+                continue
+            try:
+                values = {field: int(row[field]) for field in PRODUCT_INT_FIELDS if field in row}
+            except (TypeError, ValueError):
+                self._error(line, 'price, discount, quantity и guarantee должны быть целыми числами')
+                continue
+            for field in PRODUCT_TEXT_FIELDS:
+                if field in row:
+                    values[field] = row[field]
+            price, discount, image = stored.get(row['slug'], (None, None, None))
+            if row['slug'] in stored:
+                values.setdefault('price', price)
+                values.setdefault('discount', discount)
+            if values.get('image') and values['image'] != image:
+                self.images.add(values['image'])
+            product = Product(slug=row['slug'], title=row['title'], category_id=category_id, model_id=model_id,
+                              root_category_id=self.category_parents.get(category_id), created_at=now, updated_at=now,
+                              **values)
+            product.compute_prices()
+            groups.setdefault(tuple(sorted(values)), []).append(product)
+        # Одна вставка на каждый набор колонок, пришедших в строках
+        for fields, objs in groups.items():
+            Product.objects.bulk_create(objs, update_conflicts=True, unique_fields=['slug'],
+                                        update_fields=PRODUCT_UPDATE_FIELDS + fields)
+            self.products.update((obj.slug, obj.pk) for obj in objs)
+            self.counts['product'] += len(objs)
+
+    # Название характеристики в БД не уникально: значение обновляется у уже привязанной к товару
+    # характеристики с таким названием, новые привязки идут к первой по pk
+    def _save_characteristic(self, rows):
+        missing = {row['characteristic'] for _, row in rows} - self.characteristics.keys()
+        if missing:
+            created = Characteristic.objects.bulk_create([Characteristic(name=name) for name in sorted(missing)])
+            self.characteristics.update((obj.name, obj.pk) for obj in created)
+
+        resolved = []
+        for line, row in rows:
+            product_id = self._resolve(self.products, line, row['product'], 'товар')
+            if product_id is not None:
+                resolved.append((product_id, row['characteristic'], row.get('value', '')))
+        existing = {(product_id, name): pk for pk, product_id, name in ProductCharacteristic.objects.filter(
+            product_id__in={product_id for product_id, _, _ in resolved}).values_list('pk', 'product_id',
+                                                                                     'characteristic__name')}
+
+        to_update, to_create = [], []
+        for product_id, name, value in resolved:
+            pk = existing.get((product_id, name))
+            if pk is not None:
+                to_update.append(ProductCharacteristic(pk=pk, value=value))
+            else:
+                to_create.append(ProductCharacteristic(product_id=product_id, value=value,
+                                                       characteristic_id=self.characteristics[name]))
+        ProductCharacteristic.objects.bulk_update(to_update, ['value'])
+        ProductCharacteristic.objects.bulk_create(to_create)
+        self.counts['characteristic'] += len(resolved)
+
+    # bulk_create не шлёт сигналы: индекс поиска, кэши каталога и копии картинок обновляются один раз в конце
+    def finish(self, reindex=True):
+        self.flush()
+        if reindex:
+            search.rebuild_index()
+        schedule_product_images(sorted(self.images))
+        invalidate_category_tree()
+        invalidate_showcase()
+        invalidate_pages()
+
+
+def import_rows(rows, batch_size=1000, reindex=True, progress=None, progress_every=100000):
+    importer = CatalogImporter(batch_size)
+    for line, row in enumerate(rows, start=1):
+        importer.add(line, row)
+        if progress and line % progress_every == 0:
+            progress(importer)
+    importer.finish(reindex)
+    return importer
+
+
+# Категории родителями вперёд, чтобы файл можно было загрузить обратно одним проходом
+def _categories_in_order():
+    categories = list(Category.objects.values('pk', 'slug', 'title', 'parent_id', 'icon'))
+    slugs = {c['pk']: c['slug'] for c in categories}
+    children = {}
+    for c in categories:
+        children.setdefault(c['parent_id'], []).append(c)
+    queue = list(children.get(None, []))
+    while queue:
+        category = queue.pop(0)
+        yield {'type': 'category', 'slug': category['slug'], 'title': category['title'],
+               'parent': slugs.get(category['parent_id']), 'icon': category['icon'] or None}
+        queue += children.get(category['pk'], [])
+
+
+def export_rows(batch_size=1000):
+    yield from _categories_in_order()
+    for slug, title in ModelProduct.objects.order_by('pk').values_list('slug', 'title').iterator(batch_size):
+        yield {'type': 'model', 'slug': slug, 'title': title}
+
+    fields = ('slug', 'title', 'category__slug', 'model__slug') + PRODUCT_INT_FIELDS + PRODUCT_TEXT_FIELDS
+    for values in Product.objects.order_by('pk').values_list(*fields).iterator(batch_size):
+        row = dict(zip(('slug', 'title', 'category', 'model') + fields[4:], values))
+        row['image'] = row['image'] or None
+        yield {'type': 'product', **row}
+
+    for product, characteristic, value in ProductCharacteristic.objects.order_by('pk') \
+            .values_list('product__slug', 'characteristic__name', 'value').iterator(batch_size):
+        yield {'type': 'characteristic', 'product': product, 'characteristic': characteristic, 'value': value}
@@ -0,0 +1,8 @@
+from django.utils.functional import SimpleLazyObject
+
+from .utils import get_favorite_ids
+
+
+# Избранное текущего пользователя для карточек товаров
+def favorites(request):
+    return {'favorite_ids': SimpleLazyObject(lambda: get_favorite_ids(request))}
@@ -0,0 +1,118 @@
+from django.db.models import Count, F
+
+from .models import ProductCharacteristic
+
+PRICE_STEP = 500
+CHARACTERISTIC_PREFIX = 'ch'
+
+
+# Фильтры каталога и счётчики по ним (фасеты).
+# Счётчик каждого фасета считается с учётом всех фильтров, кроме его собственного,
+# чтобы в списке оставались доступные для переключения значения.
+class ProductFacets:
+    def __init__(self, params, products):
+        self.params = params
+        self.products = products
+        self.characteristics = {}
+        for key, value in params.items():
+            if key.startswith(CHARACTERISTIC_PREFIX) and key[len(CHARACTERISTIC_PREFIX):].isdigit() and value:
+                self.characteristics[int(key[len(CHARACTERISTIC_PREFIX):])] = value
+
+    def _int_param(self, name):
+        value = self.params.get(name)
+        try:
+            return int(value) if value else None
+        except ValueError:
+            return None
+
+    def filter(self, exclude=()):
+        products = self.products
+        cat = self.params.get('cat')
+        price_from = self._int_param('price_from')
+        price_to = self._int_param('price_to')
+        model = self.params.get('model')
+
+        if cat and 'cat' not in exclude:
+            products = products.filter(category__slug=cat)
+        if price_from is not None and 'price' not in exclude:
+            products = products.filter(final_price__gte=price_from)
+        if price_to is not None and 'price' not in exclude:
+            products = products.filter(final_price__lte=price_to)
+        if model and 'model' not in exclude:
+            products = products.filter(model__slug=model)
+        if self.params.get('in_stock') and 'in_stock' not in exclude:
+            products = products.filter(quantity__gt=0)
+        for characteristic_id, value in self.characteristics.items():
+            if characteristic_id not in exclude:
+                products = products.filter(pk__in=ProductCharacteristic.objects.filter(
+                    characteristic_id=characteristic_id, value=value).values('product_id'))
+        return products
+
+    @property
+    def queryset(self):
+        return self.filter()
+
+    def subcategory_counts(self):
+        rows = self.filter(exclude=('cat',)).values('category_id').annotate(count=Count('pk'))
+        return {row['category_id']: row['count'] for row in rows}
+
+    def model_counts(self):
+        rows = self.filter(exclude=('model',)).values('model__slug', 'model__title') \
+            .annotate(count=Count('pk')).order_by('model__title')
+        return [{'slug': row['model__slug'], 'title': row['model__title'], 'count': row['count']} for row in rows]
+
+    # Значения характеристик: [{'id', 'name', 'param', 'values': [{'value', 'count'}]}]
+    def characteristic_counts(self):
+        def grouped(characteristics):
+            return characteristics.values('characteristic_id', 'characteristic__name', 'value') \
+                .annotate(count=Count('product_id')).order_by('characteristic__name', 'value')
+
+        rows = list(grouped(ProductCharacteristic.objects.filter(product__in=self.filter())
+                            .exclude(characteristic_id__in=self.characteristics)))
+        for characteristic_id in self.characteristics:
+            rows += grouped(ProductCharacteristic.objects.filter(product__in=self.filter(exclude=(characteristic_id,)),
+                                                                 characteristic_id=characteristic_id))
+        rows.sort(key=lambda row: (row['characteristic__name'], row['value']))
+
+        facets = {}
+        for row in rows:
+            characteristic_id = row['characteristic_id']
+            facet = facets.setdefault(characteristic_id, {
+                'id': characteristic_id,
+                'name': row['characteristic__name'],
+                'param': f'{CHARACTERISTIC_PREFIX}{characteristic_id}',
+                'selected': self.characteristics.get(characteristic_id),
+                'values': []
+            })
+            facet['values'].append({'value': row['value'], 'count': row['count']})
+        return list(facets.values())
+
+    # Корзины цен шириной PRICE_STEP: [{'price_from', 'price_to', 'count'}]
+    def price_buckets(self):
+        rows = self.filter(exclude=('price',)).annotate(bucket=F('final_price') / PRICE_STEP) \
+            .values('bucket').annotate(count=Count('pk')).order_by('bucket')
+        return [{'price_from': row['bucket'] * PRICE_STEP,
+                 'price_to': (row['bucket'] + 1) * PRICE_STEP,
+                 'count': row['count']} for row in rows]
+
+    def in_stock_count(self):
+        return self.filter(exclude=('in_stock',)).filter(quantity__gt=0).count()
+
+    # Контекст боковой панели фильтров категории
+    def sidebar_context(self, category):
+        subcat_counts = self.subcategory_counts()
+        subcats = list(category.subcategories.all())
+        for subcat in subcats:
+            subcat.product_count = subcat_counts.get(subcat.pk, 0)
+        price_buckets = self.price_buckets()
+        context = {
+            'subcats': subcats,
+            'price_buckets': price_buckets,
+            'prices': list(range(price_buckets[0]['price_from'], price_buckets[-1]['price_to'] + 1, PRICE_STEP))
+            if price_buckets else [],
+            'in_stock_count': self.in_stock_count(),
+        }
+        if self.params.get('cat'):
+            context['models'] = self.model_counts()
+            context['characteristic_facets'] = self.characteristic_counts()
+        return context
@@ -0,0 +1,84 @@
+import json
+import secrets
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+import requests
+import stripe
+
+# Локальная замена API Stripe для разработки и проверок: создание и чтение сессий оплаты,
+# страница /pay/<id> «оплачивает» сессию, отправляет подписанный вебхук и возвращает на success_url
+
+
+class FakeStripeHandler(BaseHTTPRequestHandler):
+    def _json(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Request-Id', f'req_{secrets.token_hex(8)}')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        if self.path != '/v1/checkout/sessions':
+            return self._json(404, {'error': {'type': 'invalid_request_error', 'message': 'Unknown path'}})
+        length = int(self.headers.get('Content-Length', 0))
+        params = dict(parse_qsl(self.rfile.read(length).decode()))
+        session_id = f'cs_test_{secrets.token_hex(12)}'
+        host, port = self.server.server_address[:2]
+        session = {
+            'id': session_id,
+            'object': 'checkout.session',
+            'status': 'open',
+            'payment_status': 'unpaid',
+            'client_reference_id': params.get('client_reference_id'),
+            'amount_total': int(params.get('line_items[0][price_data][unit_amount]', 0)),
+            'currency': params.get('line_items[0][price_data][currency]'),
+            'success_url': params.get('success_url', '').replace('{CHECKOUT_SESSION_ID}', session_id),
+            'cancel_url': params.get('cancel_url'),
+            'url': f'http://{host}:{port}/pay/{session_id}',
+        }
+        self.server.sessions[session_id] = session
+        self._json(200, session)
+
+    def do_GET(self):
+        if self.path.startswith('/v1/checkout/sessions/'):
+            session = self.server.sessions.get(self.path.rsplit('/', 1)[-1])
+            if session is None:
+                return self._json(404, {'error': {'type': 'invalid_request_error', 'message': 'No such session'}})
+            return self._json(200, session)
+
+        if self.path.startswith('/pay/'):
+            session = self.server.sessions.get(self.path.rsplit('/', 1)[-1])
+            if session is None:
+                return self._json(404, {'error': {'type': 'invalid_request_error', 'message': 'No such session'}})
+            session.update(status='complete', payment_status='paid')
+            self.server.send_event('checkout.session.completed', session)
+            self.send_response(302)
+            self.send_header('Location', session['success_url'])
+            self.end_headers()
+            return
+
+        self._json(404, {'error': {'type': 'invalid_request_error', 'message': 'Unknown path'}})
+
+
+class FakeStripeServer(ThreadingHTTPServer):
+    def __init__(self, address, webhook_url, webhook_secret):
+        super().__init__(address, FakeStripeHandler)
+        self.webhook_url = webhook_url
+        self.webhook_secret = webhook_secret
+        self.sessions = {}
+
+    def send_event(self, event_type, obj):
+        payload = json.dumps({
+            'id': f'evt_{secrets.token_hex(12)}',
+            'object': 'event',
+            'type': event_type,
+            'created': int(time.time()),
+            'data': {'object': obj},
+        })
+        signature = stripe.WebhookSignature.generate_signature_header(payload, self.webhook_secret)
+        return requests.post(self.webhook_url, data=payload, timeout=10,
+                             headers={'Content-Type': 'application/json', 'Stripe-Signature': signature})
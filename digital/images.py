@@ -0,0 +1,155 @@
+import logging
+import os
+from io import BytesIO
+
+from django.apps import apps
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db.models.functions import Now
+from PIL import Image, ImageOps, UnidentifiedImageError, features
+
+from .taskqueue import enqueue, task
+
+logger = logging.getLogger(__name__)
+
+# Уменьшенные копии загруженных картинок: DERIVATIVES_DIR/<путь без расширения>/<ширина>.<формат>
+DERIVATIVES_DIR = 'derivatives'
+DERIVATIVE_WIDTHS = (200, 400, 800)
+# Последний формат — запасной для <img src>, остальные идут в <source> по порядку предпочтения
+DERIVATIVE_FORMATS = (('avif',) if features.check('avif') else ()) + ('webp', 'jpeg')
+FORMAT_OPTIONS = {
+    'avif': {'format': 'AVIF', 'quality': 60},
+    'webp': {'format': 'WEBP', 'quality': 80, 'method': 4},
+    'jpeg': {'format': 'JPEG', 'quality': 82, 'optimize': True, 'progressive': True},
+}
+MIME_TYPES = {'avif': 'image/avif', 'webp': 'image/webp', 'jpeg': 'image/jpeg'}
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.gif', '.bmp', '.tiff')
+WIDTHS_TIMEOUT = 60 * 60 * 24
+MISSING_WIDTHS_TIMEOUT = 60
+REFRESH_BATCH = 500
+
+
+def derivative_dir(name):
+    return f'{DERIVATIVES_DIR}/{os.path.splitext(name)[0]}'
+
+
+def derivative_name(name, width, fmt):
+    return f'{derivative_dir(name)}/{width}.{fmt}'
+
+
+def _widths_key(name):
+    return f'image_widths:{name}'
+
+
+def _convert(image, fmt):
+    if fmt != 'jpeg':
+        return image if image.mode in ('RGB', 'RGBA') else image.convert('RGBA')
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+# Нарезка копий одной картинки. Ширины больше оригинала пропускаются (без растягивания),
+# уже существующие копии не пересоздаются без force. Возвращает список ширин
+def generate_derivatives(name, force=False):
+    if not name or not name.lower().endswith(IMAGE_EXTENSIONS) or not default_storage.exists(name):
+        return []
+    try:
+        with default_storage.open(name) as f, Image.open(f) as original:
+            image = ImageOps.exif_transpose(original)
+            image.load()
+    except (UnidentifiedImageError, OSError) as e:
+        logger.warning('Не удалось открыть картинку %s: %s', name, e)
+        return []
+
+    widths = [width for width in DERIVATIVE_WIDTHS if width <= image.width] or [image.width]
+    for width in widths:
+        resized = image if width == image.width else \
+            image.resize((width, max(1, round(image.height * width / image.width))), Image.LANCZOS)
+        for fmt in DERIVATIVE_FORMATS:
+            target = derivative_name(name, width, fmt)
+            if default_storage.exists(target):
+                if not force:
+                    continue
+                default_storage.delete(target)
+            buffer = BytesIO()
+            _convert(resized, fmt).save(buffer, **FORMAT_OPTIONS[fmt])
+            default_storage.save(target, ContentFile(buffer.getvalue()))
+    remember_widths(name, widths)
+    return widths
+
+
+# Ширины готовых копий для srcset (по файлам запасного формата), кэшируются
+def available_widths(name):
+    widths = cache.get(_widths_key(name))
+    if widths is None:
+        try:
+            _, files = default_storage.listdir(derivative_dir(name))
+        except (FileNotFoundError, NotADirectoryError):
+            files = []
+        fallback = f'.{DERIVATIVE_FORMATS[-1]}'
+        widths = sorted(int(f[:-len(fallback)]) for f in files
+                        if f.endswith(fallback) and f[:-len(fallback)].isdigit())
+        remember_widths(name, widths)
+    return widths
+
+
+def remember_widths(name, widths):
+    cache.set(_widths_key(name), widths, WIDTHS_TIMEOUT if widths else MISSING_WIDTHS_TIMEOUT)
+
+
+# Карточки и страницы товаров с этими картинками нужно перерисовать со srcset. Карточка в кэше
+# ищется по updated_at (digital_tags.product_card_key), поэтому он обновляется в БД: новые ключи видят
+# все процессы, а не только тот, где прошла нарезка. Страницы товаров, их листинги и витрина сбрасываются
+def refresh_product_images(names):
+    from .catalog import invalidate_showcase
+    from .pagecache import category_page_tag, invalidate_pages, product_page_tag
+
+    products = apps.get_model('digital', 'Product').objects
+    tags = set()
+    for start in range(0, len(names), REFRESH_BATCH):
+        batch = products.filter(image__in=names[start:start + REFRESH_BATCH])
+        for slug, root_slug in batch.values_list('slug', 'root_category__slug'):
+            tags.update((product_page_tag(slug), category_page_tag(root_slug)))
+        batch.update(updated_at=Now())
+    if tags:
+        invalidate_showcase()
+        # После массовой нарезки (build_image_derivatives) дешевле сбросить все страницы сразу
+        if len(tags) <= REFRESH_BATCH:
+            invalidate_pages(*tags)
+        else:
+            invalidate_pages()
+
+
+@task()
+def process_image(model_label, pk, field_name):
+    instance = apps.get_model(model_label).objects.filter(pk=pk).first()
+    name = getattr(instance, field_name).name if instance else None
+    if generate_derivatives(name) and model_label == 'digital.Product':
+        refresh_product_images([name])
+
+
+# Картинка товара, записанная в обход save() (импорт каталога): сигнала нет, известно только имя файла
+@task()
+def process_product_image(name):
+    if generate_derivatives(name):
+        refresh_product_images([name])
+
+
+def schedule_product_images(names):
+    for name in names:
+        enqueue(process_product_image, name, key=f'image:{name}')
+
+
+# Нарезка в фоновой очереди, чтобы сохранение модели не ждало обработку картинок.
+# Ключ — имя файла: пересохранение модели без новой картинки задачу не добавляет,
+# если только прошлая нарезка не упала окончательно (тогда enqueue ставит её заново)
+def schedule_derivatives(instance, field_name):
+    image = getattr(instance, field_name)
+    if not image:
+        return
+    enqueue(process_image, instance._meta.label, instance.pk, field_name, key=f'image:{image.name}')
@@ -0,0 +1,81 @@
+import tempfile
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import setup_databases, setup_test_environment, teardown_databases, \
+    teardown_test_environment
+
+from digital import benchmark
+
+DEFAULT_BUDGET = Path(__file__).resolve().parents[2] / 'benchmark_budget.json'
+
+
+class Command(BaseCommand):
+    help = 'Замер SQL-запросов, времени и памяти основных страниц на синтетическом каталоге (в тестовой БД)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=1000, help='Количество товаров в каталоге')
+        parser.add_argument('--categories', type=int, default=5, help='Количество корневых категорий')
+        parser.add_argument('--budget', default=str(DEFAULT_BUDGET), help='Файл бюджета (JSON)')
+        parser.add_argument('--update-budget', action='store_true', help='Записать замеры в файл бюджета')
+        parser.add_argument('--queries-only', action='store_true',
+                            help='Проверять только число запросов (время и память зависят от машины)')
+        parser.add_argument('--compare-asgi', action='store_true',
+                            help='Сравнить пропускную способность синхронных (WSGI) и асинхронных (ASGI) страниц')
+        parser.add_argument('--requests', type=int, default=200, help='Запросов для --compare-asgi')
+        parser.add_argument('--concurrency', type=int, default=20, help='Одновременных запросов для --compare-asgi')
+        parser.add_argument('--cart-load', action='store_true',
+                            help='Нагрузочный замер записи в корзину: профиль БД проекта против настроек по умолчанию')
+        parser.add_argument('--threads', default='1,4,16', help='Число потоков для --cart-load через запятую')
+        parser.add_argument('--operations', type=int, default=200, help='Итераций на поток для --cart-load')
+        parser.add_argument('--on-disk', action='store_true',
+                            help='Тестовая БД SQLite в файле, а не в памяти (большие каталоги, --products 1000000)')
+
+    def handle(self, *args, **options):
+        threads = [int(count) for count in options['threads'].split(',')]
+        if (options['cart_load'] or options['on_disk']) and connection.vendor == 'sqlite':
+            # SQLite в памяти с общим кэшем блокирует таблицы целиком, а миллион товаров не помещается в память
+            connection.settings_dict['TEST']['NAME'] = str(Path(tempfile.gettempdir()) / 'benchmark_cart.sqlite3')
+        caches_override = override_settings(CACHES=benchmark.BENCHMARK_CACHES)
+        caches_override.enable()
+        setup_test_environment()
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            data = benchmark.seed_catalog(products=options['products'], categories=options['categories'])
+            results = benchmark.run_scenarios(data)
+            throughput = benchmark.compare_handlers(data, options['requests'], options['concurrency']) \
+                if options['compare_asgi'] else []
+            cart_load = benchmark.cart_write_load(threads, options['operations']) \
+                if options['cart_load'] else []
+        finally:
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+            caches_override.disable()
+
+        self.stdout.write(f'{"view":<22}{"status":>8}{"queries":>9}{"time, ms":>11}{"peak, KB":>11}')
+        for r in results:
+            self.stdout.write(f'{r.name:<22}{r.status:>8}{r.queries:>9}{r.time_ms:>11}{r.memory_kb:>11}')
+
+        for t in throughput:
+            self.stdout.write(f'{t.name}: {t.requests} запросов, ошибок {t.errors}, {t.seconds} с, {t.rps} запросов/с')
+
+        # Ошибки блокировки в профиле baseline — ожидаемый результат сравнения, команду они не валят
+        for t in cart_load:
+            self.stdout.write(f'{t.name}: {t.requests} записей, ошибок {t.errors}, {t.seconds} с, {t.rps} записей/с')
+
+        failed = [r.name for r in results if r.status >= 400] + [t.name for t in throughput if t.errors]
+        if failed:
+            raise CommandError(f'Ошибка ответа: {", ".join(failed)}')
+
+        if options['update_budget']:
+            benchmark.save_budget(options['budget'], results)
+            self.stdout.write(self.style.SUCCESS(f'Бюджет записан в {options["budget"]}'))
+            return
+
+        metrics = ('queries',) if options['queries_only'] else ('queries', 'time_ms', 'memory_kb')
+        errors = benchmark.check_budget(results, benchmark.load_budget(options['budget']), metrics)
+        if errors:
+            raise CommandError('Превышен бюджет:\n' + '\n'.join(errors))
+        self.stdout.write(self.style.SUCCESS('Бюджет соблюдён'))
@@ -0,0 +1,39 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from digital import images
+
+
+def _generate(args):
+    name, force = args
+    return name, images.generate_derivatives(name, force)
+
+
+class Command(BaseCommand):
+    help = 'Нарезать уменьшенные копии всех картинок из MEDIA_ROOT (в несколько процессов)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Количество процессов')
+        parser.add_argument('--force', action='store_true', help='Пересоздать уже существующие копии')
+
+    def handle(self, *args, **options):
+        root = str(settings.MEDIA_ROOT)
+        names = []
+        for dirpath, dirnames, filenames in os.walk(root):
+            if os.path.relpath(dirpath, root) == '.':
+                dirnames[:] = [d for d in dirnames if d != images.DERIVATIVES_DIR]
+            names += [os.path.relpath(os.path.join(dirpath, f), root).replace(os.sep, '/') for f in filenames
+                      if f.lower().endswith(images.IMAGE_EXTENSIONS)]
+
+        done = []
+        with ProcessPoolExecutor(max_workers=options['workers'], initializer=django.setup) as pool:
+            for name, widths in pool.map(_generate, [(name, options['force']) for name in names]):
+                images.remember_widths(name, widths)
+                if widths:
+                    done.append(name)
+        images.refresh_product_images(done)
+        self.stdout.write(self.style.SUCCESS(f'Обработано картинок: {len(done)} из {len(names)}'))
@@ -0,0 +1,93 @@
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.http import QueryDict
+
+from digital.catalog import category_products, showcase_queryset
+from digital.facets import ProductFacets
+from digital.models import Cart, Category, FavoriteProduct, Product, ProductCart
+from digital.sorting import SORT_MODES, sort_ordering
+
+# Полный просмотр таблицы: SQLite "SCAN table" — и без индекса, и по индексу или rowid целиком
+# ("SCAN table USING [COVERING] INDEX idx", "... USING INTEGER PRIMARY KEY": например, ради порядка сортировки).
+# Поиск по индексу — "SEARCH table USING INDEX idx (a=?)". PostgreSQL — "Seq Scan on table"
+FULL_SCAN_RE = re.compile(r'(?:^|\W)SCAN (\w+)(?: USING (?:(?:COVERING )?INDEX \w+|INTEGER PRIMARY KEY))?\s*$'
+                          r'|Seq Scan on (\w+)')
+
+
+# QuerySet.explain() не поддерживает фильтр по оконной функции (витрина), поэтому план снимаем по готовому SQL
+def explain(queryset):
+    connection = connections[queryset.db]
+    sql, params = queryset.query.get_compiler(using=queryset.db).as_sql()
+    with connection.cursor() as cursor:
+        cursor.execute(f'{connection.ops.explain_query_prefix()} {sql}', params)
+        return [' '.join(str(column) for column in row) for row in cursor.fetchall()]
+
+
+def first_pk(model):
+    return model.objects.order_by('pk').values_list('pk', flat=True).first() or 1
+
+
+# Горячие запросы витрины, корзины и избранного в том виде, в каком их строят views.py и utils.py
+def hot_queries():
+    product = Product.objects.order_by('pk').first() or Product(pk=1, slug='-', category_id=1, model_id=1)
+    category_id = first_pk(Category)
+    cart_id = first_pk(Cart)
+    user_id = FavoriteProduct.objects.values_list('user_id', flat=True).first() or 1
+    base = category_products(Category(pk=category_id))
+
+    return {
+        'product_by_slug': Product.objects.filter(slug=product.slug),
+        'category_listing': category_products(Category(pk=category_id)).order_by('-created_at', '-pk')[:3],
+        'filter_subcategory': ProductFacets(QueryDict(f'cat={product.category.slug}'), base).queryset,
+        'filter_price': Product.objects.filter(category_id=product.category_id, final_price__gte=1000,
+                                                final_price__lte=5000),
+        'filter_model': ProductFacets(QueryDict(f'model={product.model.slug}'), base).queryset,
+        'showcase': showcase_queryset(),
+        'favorite_ids': FavoriteProduct.objects.filter(user_id=user_id).values_list('product_id', flat=True),
+        'favorite_toggle': FavoriteProduct.objects.filter(user_id=user_id, product_id=product.pk),
+        'cart_lines': ProductCart.objects.filter(cart_id=cart_id).with_prices().select_related('product'),
+        'cart_line_lookup': ProductCart.objects.filter(cart_id=cart_id, product_id=product.pk),
+        'stock_decrement': Product.objects.filter(pk=product.pk, quantity__gte=1),
+        **{f'sort_{sort}': category_products(Category(pk=category_id)).order_by(*sort_ordering(sort))[:3]
+           for sort in SORT_MODES},
+        **{f'subcategory_sort_{sort}': Product.objects.filter(category_id=product.category_id)
+           .order_by(*sort_ordering(sort))[:3] for sort in SORT_MODES},
+    }
+
+
+class Command(BaseCommand):
+    help = 'Показать планы выполнения (EXPLAIN QUERY PLAN) горячих запросов и найти полные сканы таблиц'
+
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='*', help='Имена запросов (по умолчанию все)')
+        parser.add_argument('--fail-on-scan', action='store_true',
+                            help='Завершиться с ошибкой, если таблица магазина читается полным сканом')
+
+    def handle(self, *args, **options):
+        queries = hot_queries()
+        names = options['names'] or list(queries)
+        unknown = set(names) - set(queries)
+        if unknown:
+            raise CommandError(f'Неизвестные запросы: {", ".join(sorted(unknown))}')
+
+        scans = []
+        for name in names:
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            for line in explain(queries[name]):
+                match = FULL_SCAN_RE.search(line)
+                table = match and (match.group(1) or match.group(2))
+                if table and table.startswith('digital_'):
+                    scans.append(f'{name}: {table}')
+                    self.stdout.write(self.style.WARNING(f'  {line}'))
+                else:
+                    self.stdout.write(f'  {line}')
+
+        if scans:
+            message = 'Полный скан таблицы:\n' + '\n'.join(scans)
+            if options['fail_on_scan']:
+                raise CommandError(message)
+            self.stdout.write(self.style.WARNING(message))
+        else:
+            self.stdout.write(self.style.SUCCESS('Все запросы используют индексы'))
@@ -0,0 +1,39 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from digital import catalog_io
+
+
+class Command(BaseCommand):
+    help = 'Выгрузить каталог (категории, модели, товары, характеристики) в CSV или JSONL'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Файл .csv / .jsonl или - для stdout')
+        parser.add_argument('--format', choices=catalog_io.FORMATS, help='Формат, если не следует из расширения')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Записей в одной выборке из БД')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        try:
+            fmt = catalog_io.detect_format(path, options['format'])
+        except ValueError as e:
+            raise CommandError(e)
+
+        started = time.perf_counter()
+        f = sys.stdout if path == '-' else open(path, 'w', encoding='utf-8', newline='')
+        try:
+            writer = catalog_io.RowWriter(f, fmt)
+            total = 0
+            for row in catalog_io.export_rows(options['batch_size']):
+                writer.write(row)
+                total += 1
+        finally:
+            if f is not sys.stdout:
+                f.close()
+
+        if path != '-':
+            elapsed = time.perf_counter() - started
+            self.stdout.write(self.style.SUCCESS(f'Выгружено {total} записей, '
+                                                 f'{round(total / elapsed) if elapsed else 0} записей/с'))
@@ -0,0 +1,43 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from digital import reports
+from digital.models import Order
+
+
+class Command(BaseCommand):
+    help = 'Выгрузить отчёт по заказам (заказы с товарами, выручка по дням, продажи по товарам) в CSV или XLSX'
+
+    def add_arguments(self, parser):
+        parser.add_argument('report', choices=list(reports.REPORTS))
+        parser.add_argument('path', help='Файл или - для stdout')
+        parser.add_argument('--format', choices=reports.FORMATS, default='csv')
+        parser.add_argument('--since', help='С даты (ГГГГ-ММ-ДД)')
+        parser.add_argument('--until', help='По дату включительно (ГГГГ-ММ-ДД)')
+        parser.add_argument('--completed', action='store_true', help='Только оплаченные заказы')
+
+    def handle(self, *args, **options):
+        orders = Order.objects.all()
+        for option, lookup in (('since', 'created_at__date__gte'), ('until', 'created_at__date__lte')):
+            if options[option]:
+                day = parse_date(options[option])
+                if day is None:
+                    raise CommandError(f'Неверная дата: {options[option]}')
+                orders = orders.filter(**{lookup: day})
+        if options['completed']:
+            orders = orders.filter(completed=True)
+
+        header, rows = reports.REPORTS[options['report']](orders)
+        chunks = reports.report_chunks(header, rows, options['format'])
+        binary = options['format'] == 'xlsx'
+        if options['path'] == '-':
+            out = sys.stdout.buffer if binary else sys.stdout
+            for chunk in chunks:
+                out.write(chunk)
+            return
+        with open(options['path'], 'wb' if binary else 'w', **({} if binary else {'encoding': 'utf-8', 'newline': ''})) as f:
+            for chunk in chunks:
+                f.write(chunk)
+        self.stdout.write(self.style.SUCCESS(f'Отчёт записан в {options["path"]}'))
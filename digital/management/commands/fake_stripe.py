@@ -0,0 +1,24 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from digital.fake_stripe import FakeStripeServer
+
+
+class Command(BaseCommand):
+    help = 'Локальный сервер-заглушка API Stripe (STRIPE_API_BASE=http://127.0.0.1:12111)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--port', type=int, default=12111)
+        parser.add_argument('--webhook-url', default='http://127.0.0.1:8000/stripe/webhook/',
+                            help='Куда отправлять события после оплаты')
+
+    def handle(self, *args, **options):
+        server = FakeStripeServer(('127.0.0.1', options['port']), options['webhook_url'],
+                                  settings.STRIPE_WEBHOOK_SECRET)
+        self.stdout.write(f'Fake Stripe: http://127.0.0.1:{options["port"]}, вебхуки: {options["webhook_url"]}')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,45 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from digital import catalog_io
+
+
+class Command(BaseCommand):
+    help = 'Загрузить каталог (категории, модели, товары, характеристики) из CSV или JSONL'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Файл .csv / .jsonl или - для stdin')
+        parser.add_argument('--format', choices=catalog_io.FORMATS, help='Формат, если не следует из расширения')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Записей в одной пачке bulk_create')
+        parser.add_argument('--no-reindex', action='store_true', help='Не пересобирать поисковый индекс')
+        parser.add_argument('--strict', action='store_true', help='Завершиться с ошибкой при пропущенных строках')
+
+    def progress(self, importer):
+        self.stdout.write(f'{importer.total} записей, {importer.rate} записей/с')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        try:
+            fmt = catalog_io.detect_format(path, options['format'])
+        except ValueError as e:
+            raise CommandError(e)
+
+        f = sys.stdin if path == '-' else open(path, encoding='utf-8', newline='')
+        try:
+            importer = catalog_io.import_rows(catalog_io.read_rows(f, fmt), options['batch_size'],
+                                              reindex=not options['no_reindex'], progress=self.progress)
+        finally:
+            if f is not sys.stdin:
+                f.close()
+
+        counts = ', '.join(f'{row_type}: {count}' for row_type, count in importer.counts.items())
+        self.stdout.write(self.style.SUCCESS(f'Загружено {importer.total} записей ({counts}), '
+                                             f'{importer.rate} записей/с'))
+        if importer.errors:
+            for error in importer.errors[:20]:
+                self.stderr.write(error)
+            message = f'Пропущено строк: {len(importer.errors)}'
+            if options['strict']:
+                raise CommandError(message)
+            self.stderr.write(message)
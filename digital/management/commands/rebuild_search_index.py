@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from digital import search
+
+
+class Command(BaseCommand):
+    help = 'Пересобрать полнотекстовый индекс товаров'
+
+    def handle(self, *args, **options):
+        if not search.fts_enabled():
+            self.stdout.write(self.style.WARNING('Полнотекстовый индекс доступен только для SQLite'))
+            return
+        count = search.rebuild_index()
+        self.stdout.write(self.style.SUCCESS(f'Проиндексировано товаров: {count}'))
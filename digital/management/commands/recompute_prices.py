@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from digital.catalog import invalidate_showcase
+from digital.models import Product
+from digital.pagecache import invalidate_pages
+
+
+class Command(BaseCommand):
+    help = 'Пересчитать хранимые цены товаров (со скидкой и в месяц) после изменений в обход save()'
+
+    def handle(self, *args, **options):
+        count = Product.objects.recompute_prices()
+        if count:
+            invalidate_showcase()
+            invalidate_pages()
+        self.stdout.write(self.style.SUCCESS(f'Исправлено товаров: {count}'))
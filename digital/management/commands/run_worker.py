@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from digital import taskqueue
+
+
+class Command(BaseCommand):
+    help = 'Воркер фоновых задач: выполняет задачи из очереди в БД'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Выполнить готовые задачи и выйти')
+        parser.add_argument('--batch', type=int, default=10, help='Задач за один проход')
+        parser.add_argument('--sleep', type=float, default=1.0, help='Пауза, когда очередь пуста (с)')
+
+    def handle(self, *args, **options):
+        total = 0
+        try:
+            while True:
+                close_old_connections()
+                requeued = taskqueue.requeue_stale()
+                if requeued:
+                    self.stdout.write(self.style.WARNING(f'Возвращено в очередь зависших задач: {requeued}'))
+                processed = taskqueue.run_pending(options['batch'])
+                total += processed
+                if not processed:
+                    if options['once']:
+                        break
+                    time.sleep(options['sleep'])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS(f'Выполнено задач: {total}'))
@@ -0,0 +1,37 @@
+import sqlite3
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = 'Локальные реплики SQLite: копирует основную БД в файлы из DB_REPLICAS (online backup)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=0,
+                            help='Повторять копирование каждые N секунд (0 — один раз)')
+
+    def handle(self, *args, **options):
+        if not settings.DATABASE_REPLICAS:
+            raise CommandError('Реплики не заданы: укажите DB_REPLICAS')
+        primary = settings.DATABASES['default']
+        if not primary['ENGINE'].endswith('sqlite3'):
+            raise CommandError('Реплики PostgreSQL обновляет сам сервер (потоковая репликация)')
+
+        try:
+            while True:
+                started = time.perf_counter()
+                with sqlite3.connect(primary['NAME']) as source:
+                    for alias in settings.DATABASE_REPLICAS:
+                        with sqlite3.connect(settings.DATABASES[alias]['NAME'], timeout=20) as target:
+                            source.backup(target)
+                        target.close()
+                source.close()
+                elapsed = round((time.perf_counter() - started) * 1000)
+                self.stdout.write(f'Реплики обновлены: {", ".join(settings.DATABASE_REPLICAS)} ({elapsed} мс)')
+                if not options['interval']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
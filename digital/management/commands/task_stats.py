@@ -0,0 +1,30 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from digital import taskqueue
+
+
+class Command(BaseCommand):
+    help = 'Метрики очереди фоновых задач: глубина, возраст очереди, задержка выполнения'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--json', action='store_true', help='Вывести метрики в JSON')
+        parser.add_argument('--purge', type=int, metavar='DAYS', help='Удалить выполненные задачи старше DAYS дней')
+
+    def handle(self, *args, **options):
+        if options['purge'] is not None:
+            deleted = taskqueue.purge_finished(options['purge'])
+            self.stdout.write(f'Удалено выполненных задач: {deleted}')
+
+        stats = taskqueue.queue_stats()
+        if options['json']:
+            self.stdout.write(json.dumps(stats, indent=4, ensure_ascii=False))
+            return
+
+        self.stdout.write(' '.join(f'{status}={count}' for status, count in stats['depth'].items()))
+        self.stdout.write(f'Старейшая задача в очереди: {stats["oldest_queued_seconds"] or 0} с')
+        self.stdout.write(f'{"task":<45}{"done":>6}{"p50, ms":>11}{"p95, ms":>11}{"run p95, ms":>13}')
+        for name, t in stats['tasks'].items():
+            self.stdout.write(f'{name:<45}{t["done"]:>6}{t["latency_p50_ms"]:>11}{t["latency_p95_ms"]:>11}'
+                              f'{t["runtime_p95_ms"]:>13}')
@@ -0,0 +1,34 @@
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.utils.decorators import sync_and_async_middleware
+
+from .routers import PIN_COOKIE, finish_request, start_request
+
+
+def _pin_after_write(state, response):
+    if state.wrote:
+        response.set_cookie(PIN_COOKIE, '1', max_age=settings.REPLICA_STICKY_SECONDS, httponly=True, samesite='Lax')
+    return response
+
+
+# Чтение каталога с реплик на время запроса. Пользователь, который только что что-то записал,
+# REPLICA_STICKY_SECONDS читает с основной БД и видит свои изменения
+@sync_and_async_middleware
+def replica_middleware(get_response):
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            state, token = start_request(pinned=PIN_COOKIE in request.COOKIES)
+            try:
+                response = await get_response(request)
+            finally:
+                finish_request(token)
+            return _pin_after_write(state, response)
+    else:
+        def middleware(request):
+            state, token = start_request(pinned=PIN_COOKIE in request.COOKIES)
+            try:
+                response = get_response(request)
+            finally:
+                finish_request(token)
+            return _pin_after_write(state, response)
+    return middleware
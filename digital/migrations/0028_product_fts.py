@@ -0,0 +1,46 @@
+from django.db import migrations
+
+# SQL зафиксирован в миграции: изменения digital/search.py не должны менять уже применённую схему
+FTS_TABLE = 'digital_product_fts'
+
+CREATE_FTS_SQL = f'''
+    CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        title, model, characteristics,
+        tokenize = 'unicode61 remove_diacritics 2',
+        prefix = '2 3'
+    )
+'''
+DROP_FTS_SQL = f'DROP TABLE IF EXISTS {FTS_TABLE}'
+
+
+def create_fts(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute(CREATE_FTS_SQL)
+        Product = apps.get_model('digital', 'Product')
+        ProductCharacteristic = apps.get_model('digital', 'ProductCharacteristic')
+        characteristics = {}
+        for product_id, value in ProductCharacteristic.objects.values_list('product_id', 'value'):
+            characteristics.setdefault(product_id, []).append(value)
+        rows = [(pk, title, model, ' '.join(characteristics.get(pk, [])))
+                for pk, title, model in Product.objects.values_list('pk', 'title', 'model__title')]
+        with schema_editor.connection.cursor() as cursor:
+            cursor.executemany(
+                f'INSERT INTO {FTS_TABLE} (rowid, title, model, characteristics) VALUES (%s, %s, %s, %s)',
+                rows
+            )
+
+
+def drop_fts(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute(DROP_FTS_SQL)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('digital', '0027_alter_productorder_order'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts, drop_fts),
+    ]
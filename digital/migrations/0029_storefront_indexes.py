@@ -0,0 +1,65 @@
+# Generated by Django 5.2.9 on 2026-10-18 01:22
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+# Перед уникальными ограничениями убираем дубли: избранное — оставляем первую запись,
+# корзина — складываем количество в первую строку (не больше остатка, товара нет — строки удаляются)
+def remove_duplicates(apps, schema_editor):
+    FavoriteProduct = apps.get_model('digital', 'FavoriteProduct')
+    ProductCart = apps.get_model('digital', 'ProductCart')
+
+    duplicates = FavoriteProduct.objects.values('user', 'product').annotate(first=Min('pk'), count=Count('pk')) \
+        .filter(count__gt=1)
+    for row in duplicates:
+        FavoriteProduct.objects.filter(user=row['user'], product=row['product']).exclude(pk=row['first']).delete()
+
+    duplicates = ProductCart.objects.values('cart', 'product') \
+        .annotate(first=Min('pk'), count=Count('pk'), quantity=Sum('quantity'), stock=Min('product__quantity')) \
+        .filter(count__gt=1)
+    for row in duplicates:
+        lines = ProductCart.objects.filter(cart=row['cart'], product=row['product'])
+        # Сумма не больше остатка на складе, как при переносе корзины гостя (merge_anonymous_cart)
+        quantity = min(row['quantity'], row['stock'])
+        if quantity > 0:
+            ProductCart.objects.filter(pk=row['first']).update(quantity=quantity)
+            lines = lines.exclude(pk=row['first'])
+        lines.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('digital', '0028_product_fts'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicates, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['price'], name='product_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['created_at'], name='product_created_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['discount'], name='product_discount_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category', 'price'], name='product_category_price_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='favoriteproduct',
+            constraint=models.UniqueConstraint(fields=('user', 'product'), name='unique_favorite_per_user'),
+        ),
+        migrations.AddConstraint(
+            model_name='productcart',
+            constraint=models.UniqueConstraint(fields=('cart', 'product'), name='unique_product_per_cart'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.9 on 2026-10-18 01:29
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('digital', '0029_storefront_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Payment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('session_id', models.CharField(blank=True, max_length=255, null=True, unique=True, verbose_name='Сессия Stripe')),
+                ('amount', models.IntegerField(default=0, verbose_name='Сумма')),
+                ('delivery_data', models.JSONField(default=dict, verbose_name='Данные доставки')),
+                ('status', models.CharField(choices=[('pending', 'Ожидает оплаты'), ('paid', 'Оплачен'), ('failed', 'Ошибка')], default='pending', max_length=10, verbose_name='Статус')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Дата изменения')),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='digital.customer', verbose_name='Покупатель')),
+                ('order', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='digital.order', verbose_name='Заказ')),
+            ],
+            options={
+                'verbose_name': 'Оплата',
+                'verbose_name_plural': 'Оплаты',
+            },
+        ),
+    ]
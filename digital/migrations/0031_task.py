@@ -0,0 +1,35 @@
+# Generated by Django 5.2.9 on 2026-10-18 01:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('digital', '0030_payment'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Task',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=200, verbose_name='Функция')),
+                ('args', models.JSONField(default=list, verbose_name='Аргументы')),
+                ('idempotency_key', models.CharField(blank=True, max_length=255, null=True, unique=True, verbose_name='Ключ идемпотентности')),
+                ('status', models.CharField(choices=[('queued', 'В очереди'), ('running', 'Выполняется'), ('done', 'Выполнена'), ('failed', 'Ошибка')], default='queued', max_length=10, verbose_name='Статус')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='Попыток')),
+                ('max_attempts', models.PositiveSmallIntegerField(default=3, verbose_name='Максимум попыток')),
+                ('last_error', models.TextField(blank=True, verbose_name='Последняя ошибка')),
+                ('run_after', models.DateTimeField(verbose_name='Запустить после')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата постановки')),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='Дата запуска')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Дата завершения')),
+            ],
+            options={
+                'verbose_name': 'Фоновая задача',
+                'verbose_name_plural': 'Фоновые задачи',
+                'indexes': [models.Index(fields=['status', 'run_after'], name='task_status_run_after_idx'), models.Index(fields=['finished_at'], name='task_finished_at_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.9 on 2026-10-18 01:50
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+# Хранимые цены для уже существующих товаров — одним UPDATE, как ProductQuerySet.recompute_prices
+def fill_prices(apps, schema_editor):
+    Product = apps.get_model('digital', 'Product')
+    final_price = F('price') - F('price') * F('discount') / 100
+    Product.objects.update(final_price=final_price, monthly_price=final_price / 12)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('digital', '0031_task'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='product',
+            name='product_category_price_idx',
+        ),
+        # Сортировка и фильтр по цене идут по final_price, индекс по исходной цене больше не читается
+        migrations.RemoveIndex(
+            model_name='product',
+            name='product_price_idx',
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='final_price',
+            field=models.IntegerField(default=100, editable=False, verbose_name='Цена со скидкой'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='monthly_price',
+            field=models.IntegerField(default=8, editable=False, verbose_name='Цена в месяц'),
+        ),
+        migrations.RunPython(fill_prices, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['final_price'], name='product_final_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category', 'final_price'], name='product_category_final_idx'),
+        ),
+    ]
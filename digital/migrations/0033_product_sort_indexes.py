@@ -0,0 +1,97 @@
+# Generated by Django 5.2.9 on 2026-10-18 01:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+# Продажи уже оформленных заказов: строки заказа связаны с товаром по слагу
+def fill_sales_count(apps, schema_editor):
+    Product = apps.get_model('digital', 'Product')
+    ProductOrder = apps.get_model('digital', 'ProductOrder')
+    sold = ProductOrder.objects.filter(slug=OuterRef('slug')).values('slug') \
+        .annotate(total=Sum('quantity')).values('total')
+    Product.objects.update(sales_count=Coalesce(Subquery(sold), 0))
+
+
+# Раздел каталога уже заведённых товаров — родитель их подкатегории
+def fill_root_category(apps, schema_editor):
+    Product = apps.get_model('digital', 'Product')
+    Category = apps.get_model('digital', 'Category')
+    Product.objects.update(root_category=Subquery(Category.objects.filter(pk=OuterRef('category_id'))
+                                                  .values('parent_id')))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('digital', '0032_product_final_price'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='product',
+            name='product_created_at_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='product',
+            name='product_discount_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='product',
+            name='product_final_price_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='product',
+            name='product_category_final_idx',
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='sales_count',
+            field=models.IntegerField(default=0, editable=False, verbose_name='Продано'),
+        ),
+        migrations.RunPython(fill_sales_count, migrations.RunPython.noop),
+        migrations.AddField(
+            model_name='product',
+            name='root_category',
+            field=models.ForeignKey(blank=True, db_index=False, editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='root_products', to='digital.category', verbose_name='Раздел каталога'),
+        ),
+        migrations.RunPython(fill_root_category, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['created_at', 'id'], name='product_created_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['final_price', 'id'], name='product_final_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['discount', 'id'], name='product_discount_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['sales_count', 'id'], name='product_sales_count_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category', 'created_at', 'id'], name='product_cat_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['root_category', 'created_at', 'id'], name='product_root_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['root_category', 'final_price', 'id'], name='product_root_final_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['root_category', 'discount', 'id'], name='product_root_discount_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['root_category', 'sales_count', 'id'], name='product_root_sales_count_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.9 on 2026-10-18 07:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('digital', '0033_product_sort_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payment',
+            name='lines',
+            field=models.JSONField(default=list, verbose_name='Оплаченные товары'),
+        ),
+    ]
@@ -1,5 +1,7 @@
 from django.contrib.auth.models import User
 from django.db import models
+from django.db.models import ExpressionWrapper, F, Sum
+from django.db.models.functions import Now
 from django.urls import reverse
 
 # Create your models here.
@@ -30,6 +32,18 @@ class Category(models.Model):
         verbose_name_plural = 'Категории'
 
 
+# Цена со скидкой в SQL — та же формула, что в Product.compute_prices (целочисленное деление)
+FINAL_PRICE = F('price') - F('price') * F('discount') / 100
+
+
+class ProductQuerySet(models.QuerySet):
+    # Пересчёт хранимых цен одним UPDATE — после изменений в обход save() (update, bulk_create, loaddata).
+    # Возвращает число исправленных товаров
+    def recompute_prices(self):
+        return self.exclude(final_price=FINAL_PRICE, monthly_price=FINAL_PRICE / 12) \
+            .update(final_price=FINAL_PRICE, monthly_price=FINAL_PRICE / 12, updated_at=Now())
+
+
 # Товары
 class Product(models.Model):
     title = models.CharField(max_length=250, verbose_name='Название')
@@ -40,33 +54,71 @@ class Product(models.Model):
     color_code = models.CharField(max_length=70, default='#ffffff', verbose_name='Код света')
     guarantee = models.IntegerField(default=0, verbose_name='Гарантия товара')
     discount = models.IntegerField(default=0, verbose_name='Скидка на товар')
+    # Хранимые цены со скидкой: по ним фильтруется и сортируется каталог, считается корзина
+    final_price = models.IntegerField(default=100, editable=False, verbose_name='Цена со скидкой')
+    monthly_price = models.IntegerField(default=8, editable=False, verbose_name='Цена в месяц')
+    # Продано единиц (сортировка «Популярные»), растёт при оформлении заказа вместе со списанием остатка
+    sales_count = models.IntegerField(default=0, editable=False, verbose_name='Продано')
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата добавления')
     updated_at = models.DateTimeField(auto_now=True, verbose_name='Дата изменения')
     image = models.ImageField(upload_to='products/', verbose_name='Фото товара', null=True, blank=True)
     category = models.ForeignKey(Category, on_delete=models.CASCADE, verbose_name='Категория', related_name='products')
+    # Родитель подкатегории товара — категория, в листинге которой он выводится (catalog.category_products).
+    # Копия category.parent: листинг идёт по индексу (root_category, поле сортировки, id), а не по всему каталогу.
+    # Обновляется в save(), при смене родителя подкатегории (signals.py) и при импорте каталога.
+    # Отдельный индекс не нужен: root_category — первое поле индексов product_root_*
+    root_category = models.ForeignKey(Category, on_delete=models.CASCADE, null=True, blank=True, editable=False,
+                                      db_index=False, verbose_name='Раздел каталога', related_name='root_products')
     model = models.ForeignKey('ModelProduct', on_delete=models.CASCADE, verbose_name='Модель',
                               related_name='model_products')
 
+    objects = ProductQuerySet.as_manager()
+
     def __str__(self):
         return self.title
 
     def get_absolute_url(self):
         return reverse('detail', kwargs={'slug': self.slug})
 
+    # Цена со скидкой и цена в месяц (рассрочка на 12 месяцев) из price и discount
+    def compute_prices(self):
+        self.final_price = self.price - self.price * self.discount // 100
+        self.monthly_price = self.final_price // 12
+
+    def save(self, *args, **kwargs):
+        self.compute_prices()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or 'category' in update_fields:
+            self.root_category_id = self.category.parent_id
+        if update_fields is not None and {'price', 'discount'} & set(update_fields):
+            kwargs['update_fields'] = {*update_fields, 'final_price', 'monthly_price'}
+        if update_fields is not None and 'category' in update_fields:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'root_category'}
+        super().save(*args, **kwargs)
+
     def get_price(self):
-        if self.discount:
-            p = self.price - self.price * self.discount // 100
-            return p
-        else:
-            return self.price
+        return self.final_price
 
     def get_price_month(self):
-        p = self.get_price() // 12
-        return p
+        return self.monthly_price
 
     class Meta:
         verbose_name = 'Товар'
         verbose_name_plural = 'Товары'
+        # Под каждый режим сортировки (digital/sorting.py): (root_category, поле, id) — листинг родительской
+        # категории, (поле, id) — поиск. Листинг, отфильтрованный по подкатегории (?cat=), мал: его читает
+        # (category, created_at, id) в порядке по умолчанию, остальные режимы досортировываются в памяти
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='product_created_at_idx'),
+            models.Index(fields=['final_price', 'id'], name='product_final_price_idx'),
+            models.Index(fields=['discount', 'id'], name='product_discount_idx'),
+            models.Index(fields=['sales_count', 'id'], name='product_sales_count_idx'),
+            models.Index(fields=['category', 'created_at', 'id'], name='product_cat_created_idx'),
+            models.Index(fields=['root_category', 'created_at', 'id'], name='product_root_created_idx'),
+            models.Index(fields=['root_category', 'final_price', 'id'], name='product_root_final_price_idx'),
+            models.Index(fields=['root_category', 'discount', 'id'], name='product_root_discount_idx'),
+            models.Index(fields=['root_category', 'sales_count', 'id'], name='product_root_sales_count_idx'),
+        ]
 
 
 # Модели товаров
@@ -144,6 +196,7 @@ class FavoriteProduct(models.Model):
     class Meta:
         verbose_name = 'Избранное'
         verbose_name_plural = 'Избранное'
+        constraints = [models.UniqueConstraint(fields=('user', 'product'), name='unique_favorite_per_user')]
 
 
 # Корзина
@@ -160,15 +213,20 @@ class Cart(models.Model):
 
     @property
     def cart_total_price(self):
-        products = self.productcart_set.all()
-        price = sum([i.get_total_price for i in products])
-        return price
+        total = self.productcart_set.with_prices().aggregate(total=Sum('total_price'))
+        return total['total'] or 0
 
     @property
     def cart_total_quantity(self):
-        products = self.productcart_set.all()
-        quantity = sum([i.quantity for i in products])
-        return quantity
+        total = self.productcart_set.aggregate(total=Sum('quantity'))
+        return total['total'] or 0
+
+
+class ProductCartQuerySet(models.QuerySet):
+    # Цена строки — хранимая цена товара со скидкой
+    def with_prices(self):
+        return self.annotate(unit_price=F('product__final_price')).annotate(
+            total_price=ExpressionWrapper(F('quantity') * F('unit_price'), output_field=models.IntegerField()))
 
 
 # Товары в корзине
@@ -179,9 +237,11 @@ class ProductCart(models.Model):
     added_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата добавления')
     updated_at = models.DateTimeField(auto_now=True, verbose_name='Дата изменения')
 
+    objects = ProductCartQuerySet.as_manager()
+
     @property
     def get_total_price(self):
-        return self.quantity * self.product.get_price()
+        return self.quantity * self.product.final_price
 
     def __str__(self):
         return f'Товар {self.product.title} корзины №: {self.cart.pk} покупателя {self.cart.customer.user}'
@@ -189,6 +249,7 @@ class ProductCart(models.Model):
     class Meta:
         verbose_name = 'Товар в корзине'
         verbose_name_plural = 'Товар корзин'
+        constraints = [models.UniqueConstraint(fields=('cart', 'product'), name='unique_product_per_cart')]
 
 
 # Доставка
@@ -231,6 +292,38 @@ class Order(models.Model):
         verbose_name_plural = 'Заказы покупателей'
 
 
+# Оплата заказа через Stripe: создаётся до перехода на страницу оплаты,
+# заказ оформляется по вебхуку (один раз, см. digital/payments.py)
+class Payment(models.Model):
+    PENDING = 'pending'
+    PAID = 'paid'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, 'Ожидает оплаты'),
+        (PAID, 'Оплачен'),
+        (FAILED, 'Ошибка'),
+    )
+
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, verbose_name='Покупатель')
+    session_id = models.CharField(max_length=255, unique=True, null=True, blank=True, verbose_name='Сессия Stripe')
+    amount = models.IntegerField(default=0, verbose_name='Сумма')
+    delivery_data = models.JSONField(default=dict, verbose_name='Данные доставки')
+    # Оплаченные строки корзины на момент оплаты: [{'product': id, 'quantity': ..., 'price': цена со скидкой}].
+    # Заказ собирается из них, а не из корзины, которую покупатель мог изменить до прихода вебхука
+    lines = models.JSONField(default=list, verbose_name='Оплаченные товары')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING, verbose_name='Статус')
+    order = models.OneToOneField(Order, on_delete=models.SET_NULL, null=True, blank=True, verbose_name='Заказ')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Дата изменения')
+
+    def __str__(self):
+        return f'Оплата № {self.pk} покупателя {self.customer.user.username}'
+
+    class Meta:
+        verbose_name = 'Оплата'
+        verbose_name_plural = 'Оплаты'
+
+
 # Товары заказа
 class ProductOrder(models.Model):
     order = models.ForeignKey(Order, on_delete=models.CASCADE, verbose_name='Заказ', related_name='products')
@@ -248,3 +341,41 @@ class ProductOrder(models.Model):
     class Meta:
         verbose_name = 'Товар заказа'
         verbose_name_plural = 'Товары заказов'
+
+
+# Фоновая задача (очередь в БД, см. digital/taskqueue.py)
+class Task(models.Model):
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (QUEUED, 'В очереди'),
+        (RUNNING, 'Выполняется'),
+        (DONE, 'Выполнена'),
+        (FAILED, 'Ошибка'),
+    )
+
+    name = models.CharField(max_length=200, verbose_name='Функция')
+    args = models.JSONField(default=list, verbose_name='Аргументы')
+    idempotency_key = models.CharField(max_length=255, unique=True, null=True, blank=True,
+                                       verbose_name='Ключ идемпотентности')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED, verbose_name='Статус')
+    attempts = models.PositiveSmallIntegerField(default=0, verbose_name='Попыток')
+    max_attempts = models.PositiveSmallIntegerField(default=3, verbose_name='Максимум попыток')
+    last_error = models.TextField(blank=True, verbose_name='Последняя ошибка')
+    run_after = models.DateTimeField(verbose_name='Запустить после')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата постановки')
+    started_at = models.DateTimeField(null=True, blank=True, verbose_name='Дата запуска')
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name='Дата завершения')
+
+    def __str__(self):
+        return f'Задача {self.name} ({self.get_status_display()})'
+
+    class Meta:
+        verbose_name = 'Фоновая задача'
+        verbose_name_plural = 'Фоновые задачи'
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='task_status_run_after_idx'),
+            models.Index(fields=['finished_at'], name='task_finished_at_idx'),
+        ]
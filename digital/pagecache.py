@@ -0,0 +1,159 @@
+import functools
+import hashlib
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, quote_etag, urlencode
+
+from .catalog import _bump_cache_version, _cache_versions, invalidate_showcase
+from .models import Product
+
+# Кэш целых страниц каталога для анонимных посетителей: у них страница одна на всех.
+# Ключ — путь, отсортированные параметры запроса и версии меток страницы. Изменение товара или
+# категории меняет версию метки (signals.py), и старые страницы больше не находятся. Версии хранятся
+# в общем кэше (settings.CACHES): сброс из админки, воркера или импорта виден всем процессам сайта,
+# вместе с ключом меняются и ETag/Last-Modified. Остатки при оформлении заказа меняются без сигналов —
+# страницы проданных товаров сбрасывает invalidate_stock_pages; на всякий случай страницы живут недолго
+PAGE_CACHE_TIMEOUT = 60 * 5
+# Метки каждой страницы: меню категорий в шапке и 'pages' — сброс всех страниц после импорта и пересчёта цен
+PAGE_TAGS = ('pages', 'category_tree')
+
+
+def product_page_tag(slug):
+    return f'page_product:{slug}'
+
+
+def category_page_tag(slug):
+    return f'page_category:{slug}'
+
+
+def invalidate_pages(*tags):
+    for tag in tags or ('pages',):
+        _bump_cache_version(tag)
+
+
+# Заказ списал остатки (utils.save_order): страницы товаров, листинги их разделов и главная с витриной
+def invalidate_stock_pages(product_ids):
+    tags = set()
+    for slug, root_slug in Product.objects.filter(pk__in=product_ids).values_list('slug', 'root_category__slug'):
+        tags.update((product_page_tag(slug), category_page_tag(root_slug)))
+    if tags:
+        invalidate_showcase()
+        invalidate_pages(*tags)
+
+
+def _page_key(request, tags):
+    query = urlencode(sorted((key, value) for key, values in request.GET.lists() for value in values))
+    versions = _cache_versions((*PAGE_TAGS, *tags))
+    raw = f'{request.path}?{query}#' + ','.join(map(str, versions))
+    return 'page:' + hashlib.md5(raw.encode()).hexdigest()
+
+
+# Мимо кэша: вошедшие пользователи (корзина, избранное, профиль) и сообщения, ждущие вывода в шапке
+def _cacheable(request):
+    return request.method in ('GET', 'HEAD') and not request.user.is_authenticated and not get_messages(request)
+
+
+# Ключ и сохранённая страница; ключ None — запрос обслуживается без кэша
+def _lookup(request, tags):
+    if not _cacheable(request):
+        return None, None
+    key = _page_key(request, tags)
+    page = cache.get(key)
+    if page is not None and not _dependencies_fresh(page):
+        page = None
+    return key, page
+
+
+# Метки, которые стали известны только после отрисовки (похожие товары на странице товара), хранятся
+# в самой странице вместе с версиями: сменилась или вытеснена хоть одна — страница рисуется заново
+def _dependencies_fresh(page):
+    dependencies = page.get('dependencies')
+    return not dependencies or _cache_versions(list(dependencies)) == list(dependencies.values())
+
+
+# Ответ с куками или CSRF-токеном в разметке принадлежит одному посетителю
+def _storable(request, response):
+    return response.status_code == 200 and not response.cookies and not request.META.get('CSRF_COOKIE_NEEDS_UPDATE')
+
+
+# Last-Modified — самое позднее updated_at товаров страницы, ETag — от ключа (версий меток) и этой даты
+def _page(key, response, dependencies):
+    context = response.context_data
+    products = [*context.get('products', ()), *context.get('same_products', ())]
+    if context.get('product'):
+        products.append(context['product'])
+    last_modified = max((int(product.updated_at.timestamp()) for product in products), default=None)
+    dependency_tags = sorted(set(dependencies(context)))
+    return {
+        'content': response.content,
+        'content_type': response['Content-Type'],
+        'etag': quote_etag(hashlib.md5(f'{key}:{last_modified}'.encode()).hexdigest()),
+        'last_modified': last_modified,
+        'dependencies': dict(zip(dependency_tags, _cache_versions(dependency_tags))),
+    }
+
+
+def _page_response(request, page):
+    response = HttpResponse(page['content'], content_type=page['content_type'])
+    response['ETag'] = page['etag']
+    if page['last_modified'] is not None:
+        response['Last-Modified'] = http_date(page['last_modified'])
+    # Браузер перепроверяет страницу при каждом показе: после входа он получит свою, а не анонимную
+    patch_cache_control(response, no_cache=True)
+    patch_vary_headers(response, ('Cookie',))
+    return get_conditional_response(request, etag=page['etag'], last_modified=page['last_modified'],
+                                    response=response)
+
+
+# Кэш страницы для анонимных посетителей, для синхронных и асинхронных представлений.
+# tags(kwargs) — метки страницы по аргументам URL, dependencies(context) — метки по отрисованному контексту.
+# Представление возвращает TemplateResponse: дата изменения берётся из товаров контекста
+# (products, product, same_products)
+def anonymous_page_cache(tags=lambda kwargs: (), dependencies=lambda context: (), timeout=PAGE_CACHE_TIMEOUT):
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @functools.wraps(view)
+            async def wrapper(request, *args, **kwargs):
+                key, page = await sync_to_async(_lookup)(request, tags(kwargs))
+                if page is None:
+                    response = await view(request, *args, **kwargs)
+                    if key is None:
+                        return response
+                    await sync_to_async(response.render)()
+                    if not _storable(request, response):
+                        return response
+                    page = await sync_to_async(_page)(key, response, dependencies)
+                    await cache.aset(key, page, timeout)
+                return _page_response(request, page)
+        else:
+            @functools.wraps(view)
+            def wrapper(request, *args, **kwargs):
+                key, page = _lookup(request, tags(kwargs))
+                if page is None:
+                    response = view(request, *args, **kwargs)
+                    if key is None:
+                        return response
+                    response.render()
+                    if not _storable(request, response):
+                        return response
+                    page = _page(key, response, dependencies)
+                    cache.set(key, page, timeout)
+                return _page_response(request, page)
+        return wrapper
+    return decorator
+
+
+# Товары, которые показаны на странице товара рядом с ним: похожие и другие цвета той же модели
+def related_page_tags(context):
+    return [product_page_tag(product.slug) for product in (*context['same_products'], *context['same_models'])]
+
+
+# Страницы каталога: главная зависит от витрины, карточка — от товара и показанных рядом товаров,
+# листинг — от товаров категории
+main_page_cache = anonymous_page_cache(lambda kwargs: ('showcase',))
+product_page_cache = anonymous_page_cache(lambda kwargs: (product_page_tag(kwargs['slug']),), related_page_tags)
+category_page_cache = anonymous_page_cache(lambda kwargs: (category_page_tag(kwargs['slug']),))
@@ -0,0 +1,137 @@
+import base64
+import json
+from datetime import datetime
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.http import Http404
+from django.utils.dateparse import parse_datetime
+
+
+# Курсор = значения полей сортировки крайнего объекта страницы + направление
+def encode_cursor(values, direction):
+    data = [direction, [['dt', v.isoformat()] if isinstance(v, datetime) else ['v', v] for v in values]]
+    return base64.urlsafe_b64encode(json.dumps(data).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        direction, values = json.loads(raw)
+        values = [parse_datetime(v) if kind == 'dt' else v for kind, v in values]
+    except (ValueError, TypeError):
+        raise Http404('Неверный курсор страницы')
+    if direction not in ('n', 'p') or any(v is None for v in values):
+        raise Http404('Неверный курсор страницы')
+    return direction, values
+
+
+class CursorPage:
+    is_cursor = True
+
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+
+# Пагинация по ключу (keyset): без COUNT(*) и OFFSET, глубина страницы не влияет на стоимость запроса.
+# ordering — поля сортировки, последнее должно быть уникальным (обычно pk)
+class CursorPaginator:
+    def __init__(self, queryset, per_page, ordering=('-created_at', '-pk')):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.ordering = list(ordering)
+        self.fields = [f.lstrip('-') for f in self.ordering]
+
+    def _values(self, obj):
+        return [getattr(obj, f) for f in self.fields]
+
+    # Поле модели или аннотации, по которому идёт сортировка
+    def _field(self, name):
+        annotations = self.queryset.query.annotations
+        if name in annotations:
+            return annotations[name].output_field
+        return self.queryset.model._meta.pk if name == 'pk' else self.queryset.model._meta.get_field(name)
+
+    # Значения курсора приводятся к типам полей сортировки: подделанный курсор (строка вместо числа
+    # или даты) — 404, а не ошибка при построении запроса
+    def _clean(self, values):
+        if len(values) != len(self.fields):
+            raise Http404('Неверный курсор страницы')
+        try:
+            return [self._field(name).to_python(value) for name, value in zip(self.fields, values)]
+        except (ValidationError, TypeError, ValueError):
+            raise Http404('Неверный курсор страницы')
+
+    # Условие «после курсора». Лишнее на вид ограничение первого поля (<= / >=) даёт БД диапазон
+    # по индексу сортировки: без него OR раскладывается на несколько индексов и требует сортировки
+    def _after(self, values, reverse=False):
+        q = Q()
+        for i, field in enumerate(self.fields):
+            descending = self.ordering[i].startswith('-') != reverse
+            condition = Q(**{f'{field}__{"lt" if descending else "gt"}': values[i]})
+            for prev_field, prev_value in zip(self.fields[:i], values[:i]):
+                condition &= Q(**{prev_field: prev_value})
+            q |= condition
+        descending = self.ordering[0].startswith('-') != reverse
+        return Q(**{f'{self.fields[0]}__{"lte" if descending else "gte"}': values[0]}) & q
+
+    def page(self, cursor=None):
+        if not cursor:
+            direction, values = 'n', None
+        else:
+            direction, values = decode_cursor(cursor)
+            values = self._clean(values)
+
+        if direction == 'n':
+            queryset = self.queryset.order_by(*self.ordering)
+            if values:
+                queryset = queryset.filter(self._after(values))
+            objects = list(queryset[:self.per_page + 1])
+            has_more, objects = len(objects) > self.per_page, objects[:self.per_page]
+            has_next, has_previous = has_more, values is not None
+        else:
+            reverse_ordering = [f[1:] if f.startswith('-') else f'-{f}' for f in self.ordering]
+            queryset = self.queryset.order_by(*reverse_ordering).filter(self._after(values, reverse=True))
+            objects = list(queryset[:self.per_page + 1])
+            has_more, objects = len(objects) > self.per_page, objects[:self.per_page][::-1]
+            has_next, has_previous = True, has_more
+
+        next_cursor = encode_cursor(self._values(objects[-1]), 'n') if objects and has_next else None
+        previous_cursor = encode_cursor(self._values(objects[0]), 'p') if objects and has_previous else None
+        return CursorPage(objects, next_cursor, previous_cursor)
+
+
+# Включается параметром ?cursor= (пустое значение — первая страница)
+class CursorPaginationMixin:
+    cursor_ordering = ('-created_at', '-pk')
+
+    def get_cursor_ordering(self):
+        return self.cursor_ordering
+
+    def paginate_queryset(self, queryset, page_size):
+        cursor = self.request.GET.get('cursor')
+        if cursor is None:
+            return super().paginate_queryset(queryset, page_size)
+        paginator = CursorPaginator(queryset, page_size, self.get_cursor_ordering())
+        page = paginator.page(cursor)
+        return paginator, page, page.object_list, page.has_other_pages()
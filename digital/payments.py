@@ -0,0 +1,143 @@
+import functools
+import logging
+
+import stripe
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+
+from .forms import DeliveryForm
+from .models import Payment
+from .taskqueue import enqueue, task
+from .utils import CartForAuthenticatedUser, OutOfStockError
+
+logger = logging.getLogger(__name__)
+
+PAID_EVENTS = ('checkout.session.completed', 'checkout.session.async_payment_succeeded')
+FAILED_EVENTS = ('checkout.session.expired', 'checkout.session.async_payment_failed')
+
+
+# Обёртка над Stripe: один клиент на процесс — HTTP-соединения переиспользуются (keep-alive),
+# у запросов есть таймаут и повторы при сетевых ошибках
+class StripeGateway:
+    def __init__(self, api_key, api_base, timeout, max_retries):
+        try:
+            async_client = stripe.HTTPXClient(timeout=timeout)
+        except ImportError:
+            async_client = None
+        self.has_async = async_client is not None
+        self.client = stripe.StripeClient(
+            api_key,
+            base_addresses={'api': api_base},
+            max_network_retries=max_retries,
+            http_client=stripe.RequestsClient(timeout=timeout, async_fallback_client=async_client)
+        )
+
+    def create_checkout_session(self, params):
+        return self.client.v1.checkout.sessions.create(params=params)
+
+    # Без httpx асинхронного HTTP-клиента у Stripe нет, запрос уходит в отдельный поток
+    async def acreate_checkout_session(self, params):
+        if not self.has_async:
+            return await sync_to_async(self.create_checkout_session, thread_sensitive=False)(params)
+        return await self.client.v1.checkout.sessions.create_async(params=params)
+
+    def construct_event(self, payload, signature):
+        return self.client.construct_event(payload, signature, settings.STRIPE_WEBHOOK_SECRET)
+
+
+@functools.cache
+def get_gateway():
+    return StripeGateway(settings.STRIPE_SECRET_KEY, settings.STRIPE_API_BASE,
+                         settings.STRIPE_TIMEOUT, settings.STRIPE_MAX_RETRIES)
+
+
+# Оплата со снимком строк корзины: по нему, а не по текущей корзине оформляется заказ (finalize_payment)
+def create_payment(cart, form):
+    return Payment(customer=cart['customer'], amount=cart['cart_price'],
+                   delivery_data={name: form.cleaned_data[name] for name in form.Meta.fields},
+                   lines=[{'product': line.product_id, 'quantity': line.quantity, 'price': line.unit_price}
+                          for line in cart['products_cart']])
+
+
+def checkout_params(cart, payment, success_url, cancel_url):
+    return {
+        'payment_method_types': ['card'],
+        'line_items': [{
+            'price_data': {
+                'currency': 'usd',
+                'product_data': {'name': ',\n'.join(i.product.title for i in cart['products_cart'])},
+                'unit_amount': int(payment.amount) * 100
+            },
+            'quantity': 1
+        }],
+        'mode': 'payment',
+        'client_reference_id': str(payment.pk),
+        'success_url': f'{success_url}?session_id={{CHECKOUT_SESSION_ID}}',
+        'cancel_url': cancel_url
+    }
+
+
+# Оплата ещё в ожидании, но забрать её нельзя: вебхук обогнал сохранение сессии в create_checkout_session
+# или транзакцию с самой оплатой. Исключение возвращает задачу в очередь на повтор
+class PaymentNotReady(Exception):
+    pass
+
+
+def _fail(payment_id, reason):
+    logger.warning('Оплата %s не оформлена: %s', payment_id, reason)
+    Payment.objects.filter(pk=payment_id).update(status=Payment.FAILED)
+
+
+# Оформление оплаченного заказа (фоновая задача) из строк, сохранённых при оплате: корзину покупатель
+# мог изменить, пока шла оплата, поэтому перепроверяется только остаток.
+# Повторная доставка события ничего не меняет: задача ставится с ключом по сессии, а оплату «забирает»
+# условный UPDATE по статусу pending.
+# Задача завершается без ошибки, только когда оплата уже не в ожидании — иначе ключ задачи
+# не дал бы оформить заказ ни повтору, ни новой доставке события
+@task(max_attempts=5)
+def finalize_payment(payment_id, session_id):
+    with transaction.atomic():
+        claimed = Payment.objects.filter(pk=payment_id, session_id=session_id, status=Payment.PENDING) \
+            .update(status=Payment.PAID)
+        if not claimed:
+            status = Payment.objects.filter(pk=payment_id).values_list('status', flat=True).first()
+            if status in (None, Payment.PENDING):
+                raise PaymentNotReady(f'Оплата {payment_id} (сессия {session_id}) ещё не готова к оформлению')
+            return None
+        payment = Payment.objects.select_related('customer__user').get(pk=payment_id)
+
+        if not payment.lines:
+            _fail(payment_id, 'нет оплаченных строк')
+            return payment
+
+        form = DeliveryForm(data=payment.delivery_data)
+        if not form.is_valid():
+            _fail(payment_id, 'неверные данные доставки')
+            return payment
+        delivery = form.save(commit=False)
+        delivery.customer = payment.customer
+
+        cart = CartForAuthenticatedUser(None, user=payment.customer.user)
+        try:
+            payment.order = cart.place_order(delivery, completed=True, data=cart.paid_cart_info(payment.lines))
+        except OutOfStockError as e:
+            _fail(payment_id, str(e))
+            return payment
+        payment.save(update_fields=['order', 'updated_at'])
+    return payment
+
+
+# Обработка события вебхука Stripe: оформление заказа уходит в очередь, ответ Stripe — сразу
+def handle_event(event):
+    if event.type not in PAID_EVENTS + FAILED_EVENTS:
+        return
+    session = event.data.object.to_dict()
+    payment_id = session.get('client_reference_id')
+    if not payment_id:
+        return
+    if event.type in PAID_EVENTS and session.get('payment_status') == 'paid':
+        enqueue(finalize_payment, payment_id, session['id'], key=f'finalize_payment:{session["id"]}')
+    elif event.type in FAILED_EVENTS:
+        Payment.objects.filter(pk=payment_id, session_id=session['id'], status=Payment.PENDING) \
+            .update(status=Payment.FAILED)
@@ -0,0 +1,205 @@
+import csv
+import zipfile
+from datetime import date, datetime
+from xml.sax.saxutils import escape
+
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+
+from .models import Order, ProductOrder
+
+# Отчёты по заказам: строки читаются из БД пачками (iterator) и сразу отдаются в поток,
+# поэтому выгрузка любого размера не держит всё в памяти
+CHUNK_SIZE = 2000
+FORMATS = ('csv', 'xlsx')
+CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+ORDER_LINE_FIELDS = (
+    ('order_id', 'Заказ'),
+    ('order__created_at', 'Дата заказа'),
+    ('order__customer__user__username', 'Покупатель'),
+    ('order__completed', 'Оплачен'),
+    ('order__price', 'Сумма заказа'),
+    ('order__delivery__city', 'Город'),
+    ('order__delivery__address', 'Адрес'),
+    ('name', 'Товар'),
+    ('slug', 'Слаг товара'),
+    ('color_name', 'Цвет'),
+    ('price', 'Цена'),
+    ('quantity', 'Количество'),
+    ('total_price', 'Сумма'),
+)
+
+
+def _cell(value):
+    if isinstance(value, datetime):
+        return timezone.localtime(value).strftime('%Y-%m-%d %H:%M:%S')
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, bool):
+        return int(value)
+    return value
+
+
+# Текст, начинающийся с этих символов, Excel и LibreOffice считают формулой. Данные покупателей (адрес,
+# имя) и названия товаров выводятся как текст: в начало добавляется апостроф
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+def _text(value):
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+# Строки заказов с товарами: (заголовок, генератор строк)
+def order_lines(orders=None, chunk_size=CHUNK_SIZE):
+    lines = ProductOrder.objects.all()
+    if orders is not None:
+        lines = lines.filter(order__in=orders.values('pk'))
+    rows = lines.order_by('order_id', 'pk').values_list(*(field for field, _ in ORDER_LINE_FIELDS)) \
+        .iterator(chunk_size=chunk_size)
+    return [title for _, title in ORDER_LINE_FIELDS], ([_cell(v) for v in row] for row in rows)
+
+
+# Выручка по дням, группировка в SQL
+def daily_revenue(orders=None):
+    orders = Order.objects.all() if orders is None else orders
+    rows = orders.annotate(day=TruncDate('created_at')).values('day') \
+        .annotate(orders=Count('pk'), revenue=Sum('price')).order_by('day') \
+        .values_list('day', 'orders', 'revenue')
+    return ['День', 'Заказов', 'Выручка'], ([_cell(v) for v in row] for row in rows.iterator())
+
+
+# Продажи по товарам, группировка в SQL
+def product_units(orders=None):
+    lines = ProductOrder.objects.all()
+    if orders is not None:
+        lines = lines.filter(order__in=orders.values('pk'))
+    rows = lines.values('slug', 'name').annotate(orders=Count('order_id', distinct=True), units=Sum('quantity'),
+                                                 revenue=Sum('total_price')) \
+        .order_by('-units', 'slug').values_list('slug', 'name', 'orders', 'units', 'revenue')
+    return ['Слаг товара', 'Товар', 'Заказов', 'Продано, шт.', 'Выручка'], rows.iterator()
+
+
+REPORTS = {
+    'orders': order_lines,
+    'daily_revenue': daily_revenue,
+    'product_units': product_units,
+}
+
+
+class _Echo:
+    def write(self, value):
+        return value
+
+
+# CSV с BOM (чтобы Excel узнал UTF-8), строки отдаются пачками по flush_every
+def csv_chunks(header, rows, flush_every=500):
+    writer = csv.writer(_Echo())
+    lines = ['\ufeff' + writer.writerow(header)]
+    for row in rows:
+        lines.append(writer.writerow([_text(value) for value in row]))
+        if len(lines) >= flush_every:
+            yield ''.join(lines)
+            lines = []
+    yield ''.join(lines)
+
+
+class _ChunkBuffer:
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+XLSX_STATIC_PARTS = {
+    '[Content_Types].xml':
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>',
+    '_rels/.rels':
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Target="xl/workbook.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"/>'
+        '</Relationships>',
+    'xl/workbook.xml':
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Report" sheetId="1" r:id="rId1"/></sheets></workbook>',
+    'xl/_rels/workbook.xml.rels':
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Target="worksheets/sheet1.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet"/>'
+        '</Relationships>',
+}
+
+
+def _xlsx_row(values):
+    cells = []
+    for value in values:
+        if value is None:
+            cells.append('<c/>')
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            cells.append(f'<c><v>{value}</v></c>')
+        else:
+            text = ''.join(ch for ch in str(_text(value)) if ch in '\t\n\r' or ch >= ' ')
+            cells.append(f'<c t="inlineStr"><is><t xml:space="preserve">{escape(text)}</t></is></c>')
+    return f'<row>{"".join(cells)}</row>'.encode()
+
+
+# XLSX без сторонних библиотек: zip пишется в поток (без seek), лист — строками inlineStr.
+# Каждые flush_every строк накопленные байты отдаются клиенту
+def xlsx_chunks(header, rows, flush_every=500):
+    buffer = _ChunkBuffer()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, content in XLSX_STATIC_PARTS.items():
+            archive.writestr(name, content)
+        yield buffer.drain()
+
+        with archive.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as sheet:
+            sheet.write(b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                        b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>')
+            sheet.write(_xlsx_row(header))
+            for i, row in enumerate(rows, start=1):
+                sheet.write(_xlsx_row(row))
+                if i % flush_every == 0:
+                    yield buffer.drain()
+            sheet.write(b'</sheetData></worksheet>')
+    yield buffer.drain()
+
+
+def report_chunks(header, rows, fmt):
+    return csv_chunks(header, rows) if fmt == 'csv' else xlsx_chunks(header, rows)
+
+
+def streaming_response(report, fmt, orders=None):
+    header, rows = REPORTS[report](orders)
+    response = StreamingHttpResponse(report_chunks(header, rows, fmt), content_type=CONTENT_TYPES[fmt])
+    filename = f'{report}_{timezone.localdate():%Y%m%d}.{fmt}'
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
@@ -0,0 +1,60 @@
+import itertools
+from contextvars import ContextVar
+from types import SimpleNamespace
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+# Модели каталога, которые читаются с реплик. Корзина, заказы, оплаты и пользователи — всегда с основной БД
+CATALOG_MODELS = {'digital.Category', 'digital.Product', 'digital.ModelProduct', 'digital.Characteristic',
+                  'digital.ProductCharacteristic'}
+# Метка «недавно писал»: пока кука жива, запросы пользователя читают каталог с основной БД
+PIN_COOKIE = 'db_primary'
+
+_request_state = ContextVar('replica_request_state', default=None)
+
+
+# Состояние текущего запроса: реплики используются только внутри запроса (middleware),
+# фоновые задачи и команды читают основную БД — сразу после записи реплика может отставать
+def start_request(pinned=False):
+    state = SimpleNamespace(pinned=pinned, wrote=False, replica=None)
+    return state, _request_state.set(state)
+
+
+def finish_request(token):
+    _request_state.reset(token)
+
+
+class ReplicaRouter:
+    def __init__(self):
+        self.replicas = itertools.cycle(settings.DATABASE_REPLICAS)
+
+    # Каталог — с реплики, если запрос не закреплён за основной БД и нет открытой транзакции.
+    # Реплики чередуются по запросам, внутри одного запроса все чтения идут на одну и ту же
+    def db_for_read(self, model, **hints):
+        if model._meta.label not in CATALOG_MODELS:
+            return None
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            return instance._state.db
+        state = _request_state.get()
+        if state is None or state.pinned or state.wrote or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return None
+        if state.replica is None:
+            state.replica = next(self.replicas)
+        return state.replica
+
+    # Запись — только в основную БД; после неё запрос дочитывает с основной (read-your-writes)
+    def db_for_write(self, model, **hints):
+        state = _request_state.get()
+        if state is not None:
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    # На всех алиасах одни и те же данные
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    # Реплики получают схему вместе с данными от основной БД
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return None if db not in settings.DATABASE_REPLICAS else False
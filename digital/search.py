@@ -0,0 +1,150 @@
+import re
+
+from django.db import connection, transaction
+from django.db.models.expressions import RawSQL
+
+from .models import Product, ProductCharacteristic
+from .sorting import RELEVANCE_SORT, sort_ordering
+from .taskqueue import task
+
+# Полнотекстовый индекс товаров (SQLite FTS5), rowid = pk товара
+FTS_TABLE = 'digital_product_fts'
+
+CREATE_FTS_SQL = f'''
+    CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        title, model, characteristics,
+        tokenize = 'unicode61 remove_diacritics 2',
+        prefix = '2 3'
+    )
+'''
+DROP_FTS_SQL = f'DROP TABLE IF EXISTS {FTS_TABLE}'
+
+# Веса колонок для bm25: название важнее модели, модель важнее характеристик
+BM25_WEIGHTS = (10.0, 5.0, 1.0)
+
+INDEX_BATCH_SIZE = 500
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def fts_enabled(conn=None):
+    return (conn or connection).vendor == 'sqlite'
+
+
+# Запрос пользователя -> выражение MATCH: каждое слово как префикс, все слова обязательны
+def build_match_query(query):
+    tokens = TOKEN_RE.findall(query.lower())
+    return ' '.join(f'"{token}"*' for token in tokens)
+
+
+def _documents(product_ids):
+    products = Product.objects.filter(pk__in=product_ids).select_related('model').only('pk', 'title', 'model__title')
+    characteristics = {}
+    for product_id, value in ProductCharacteristic.objects.filter(product_id__in=product_ids) \
+            .values_list('product_id', 'value'):
+        characteristics.setdefault(product_id, []).append(value)
+    for product in products:
+        yield product.pk, product.title, product.model.title, ' '.join(characteristics.get(product.pk, []))
+
+
+@task()
+def index_products(product_ids, conn=None):
+    conn = conn or connection
+    if not fts_enabled(conn):
+        return
+    product_ids = list(product_ids)
+    # Одна транзакция: в режиме autocommit каждая строка executemany фиксировалась бы отдельно
+    with transaction.atomic(using=conn.alias), conn.cursor() as cursor:
+        for start in range(0, len(product_ids), INDEX_BATCH_SIZE):
+            batch = product_ids[start:start + INDEX_BATCH_SIZE]
+            placeholders = ', '.join(['%s'] * len(batch))
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})', batch)
+            cursor.executemany(
+                f'INSERT INTO {FTS_TABLE} (rowid, title, model, characteristics) VALUES (%s, %s, %s, %s)',
+                list(_documents(batch))
+            )
+
+
+@task()
+def remove_products(product_ids, conn=None):
+    conn = conn or connection
+    if not fts_enabled(conn):
+        return
+    product_ids = list(product_ids)
+    if not product_ids:
+        return
+    placeholders = ', '.join(['%s'] * len(product_ids))
+    with conn.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})', product_ids)
+
+
+def rebuild_index(conn=None):
+    conn = conn or connection
+    if not fts_enabled(conn):
+        return 0
+    with conn.cursor() as cursor:
+        cursor.execute(DROP_FTS_SQL)
+        cursor.execute(CREATE_FTS_SQL)
+    product_ids = list(Product.objects.order_by('pk').values_list('pk', flat=True))
+    index_products(product_ids, conn)
+    with conn.cursor() as cursor:
+        cursor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')")
+    return len(product_ids)
+
+
+# Результаты поиска, совместимые с Paginator: count() и срезы выполняются в БД.
+# sort — режим из digital/sorting.py или RELEVANCE_SORT (bm25)
+class SearchResults:
+    def __init__(self, query, sort=RELEVANCE_SORT):
+        self.query = query
+        self.sort = sort
+        self.match = build_match_query(query)
+        self._count = None
+
+    def _ordering(self):
+        return ('pk',) if self.sort == RELEVANCE_SORT else sort_ordering(self.sort)
+
+    def _fallback(self):
+        return Product.objects.filter(title__icontains=self.query).order_by(*self._ordering())
+
+    # Найденные товары, упорядоченные по полям товара (для режимов, отличных от релевантности)
+    def _sorted(self):
+        matched = RawSQL(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [self.match])
+        return Product.objects.filter(pk__in=matched).order_by(*self._ordering())
+
+    def count(self):
+        if self._count is None:
+            if not self.match:
+                self._count = 0
+            elif fts_enabled():
+                with connection.cursor() as cursor:
+                    cursor.execute(f'SELECT count(*) FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [self.match])
+                    self._count = cursor.fetchone()[0]
+            else:
+                self._count = self._fallback().count()
+        return self._count
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, item):
+        if not isinstance(item, slice):
+            return self[item:item + 1][0]
+        start, stop = item.start or 0, item.stop
+        if not self.match or (stop is not None and stop <= start):
+            return []
+        if not fts_enabled():
+            return list(self._fallback()[start:stop])
+        if self.sort != RELEVANCE_SORT:
+            return list(self._sorted()[start:stop])
+
+        weights = ', '.join(str(w) for w in BM25_WEIGHTS)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s '
+                f'ORDER BY bm25({FTS_TABLE}, {weights}) LIMIT %s OFFSET %s',
+                [self.match, -1 if stop is None else stop - start, start]
+            )
+            ids = [row[0] for row in cursor.fetchall()]
+        products = Product.objects.in_bulk(ids)
+        return [products[pk] for pk in ids if pk in products]
@@ -0,0 +1,87 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import search
+from .catalog import invalidate_category_tree, invalidate_showcase
+from .images import schedule_derivatives
+from .pagecache import category_page_tag, invalidate_pages, product_page_tag
+from .taskqueue import enqueue
+from .models import Category, Customer, ModelProduct, Product, ProductCharacteristic
+
+
+# Синхронизация поискового индекса (в фоновой очереди)
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, **kwargs):
+    enqueue(search.index_products, [instance.pk])
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    enqueue(search.remove_products, [instance.pk])
+
+
+@receiver(post_save, sender=ModelProduct)
+def index_model_products(sender, instance, created, **kwargs):
+    if not created:
+        enqueue(search.index_products, list(instance.model_products.values_list('pk', flat=True)))
+
+
+@receiver([post_save, post_delete], sender=ProductCharacteristic)
+def index_product_characteristics(sender, instance, **kwargs):
+    enqueue(search.index_products, [instance.product_id])
+
+
+# Сброс кэша меню категорий
+@receiver([post_save, post_delete], sender=Category)
+def reset_category_tree(sender, **kwargs):
+    invalidate_category_tree()
+    invalidate_showcase()
+
+
+# Подкатегорию перенесли в другой раздел: её товары переезжают в листинг нового родителя
+@receiver(post_save, sender=Category)
+def move_category_products(sender, instance, created, **kwargs):
+    if not created:
+        Product.objects.filter(category=instance).exclude(root_category_id=instance.parent_id) \
+            .update(root_category_id=instance.parent_id)
+
+
+# Сброс кэша витрины главной страницы
+@receiver([post_save, post_delete], sender=Product)
+def reset_showcase(sender, **kwargs):
+    invalidate_showcase()
+
+
+# Сброс кэша страниц товара и листинга его родительской категории (у анонимных посетителей)
+def invalidate_product_pages(product):
+    parent_slug = Category.objects.filter(pk=product.category_id).values_list('parent__slug', flat=True).first()
+    invalidate_pages(product_page_tag(product.slug), category_page_tag(parent_slug))
+
+
+@receiver([post_save, post_delete], sender=Product)
+def reset_product_pages(sender, instance, **kwargs):
+    invalidate_product_pages(instance)
+
+
+@receiver([post_save, post_delete], sender=ProductCharacteristic)
+def reset_product_characteristic_pages(sender, instance, **kwargs):
+    invalidate_product_pages(instance.product)
+
+
+# Название модели выводится на всех страницах её товаров
+@receiver(post_save, sender=ModelProduct)
+def reset_model_pages(sender, **kwargs):
+    invalidate_pages()
+
+
+# Уменьшенные копии загруженных картинок
+IMAGE_FIELDS = {Product: 'image', Category: 'icon', Customer: 'photo'}
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Customer)
+def build_image_derivatives(sender, instance, update_fields=None, **kwargs):
+    field_name = IMAGE_FIELDS[sender]
+    if update_fields is None or field_name in update_fields:
+        schedule_derivatives(instance, field_name)
@@ -0,0 +1,27 @@
+# Режимы сортировки каталога (?sort=): ключ -> (название, поля order_by).
+# Последнее поле — pk: порядок однозначный, страницы и курсоры стабильны. Под каждый режим
+# есть индексы (root_category, поле, id) и (поле, id), см. Product.Meta.indexes
+SORT_MODES = {
+    'new': ('Сначала новые', ('-created_at', '-pk')),
+    'price_asc': ('Сначала дешёвые', ('final_price', 'pk')),
+    'price_desc': ('Сначала дорогие', ('-final_price', '-pk')),
+    'discount': ('По размеру скидки', ('-discount', '-pk')),
+    'popular': ('Популярные', ('-sales_count', '-pk')),
+}
+DEFAULT_SORT = 'new'
+# В поиске по умолчанию — по релевантности (bm25), остальные режимы те же
+RELEVANCE_SORT = 'relevance'
+
+
+def get_sort(params, default=DEFAULT_SORT):
+    sort = params.get('sort')
+    return sort if sort in SORT_MODES or sort == default else default
+
+
+def sort_ordering(sort):
+    return SORT_MODES[sort][1]
+
+
+# Пункты меню сортировки для шаблона: [(ключ, название)]
+def sort_choices(extra=()):
+    return list(extra) + [(key, title) for key, (title, _) in SORT_MODES.items()]
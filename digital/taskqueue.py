@@ -0,0 +1,139 @@
+import logging
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Min
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Task
+
+logger = logging.getLogger(__name__)
+
+# Очередь фоновых задач в БД: без брокера, воркер — manage.py run_worker.
+# Задача — функция с декоратором @task, аргументы хранятся в JSON
+RETRY_DELAY = 10
+STALE_AFTER = timedelta(minutes=15)
+STATS_WINDOW = timedelta(hours=1)
+
+
+def task(max_attempts=3):
+    def decorator(func):
+        func.is_task = True
+        func.max_attempts = max_attempts
+        return func
+    return decorator
+
+
+def task_name(func):
+    return f'{func.__module__}.{func.__qualname__}'
+
+
+# Постановка задачи вместе с текущей транзакцией. Повторная постановка с тем же ключом
+# возвращает уже существующую задачу и ничего не добавляет. Исключение — задача с ключом,
+# исчерпавшая попытки (failed): она ставится заново с новыми аргументами и счётчиком попыток
+def enqueue(func, *args, key=None, delay=0):
+    if not getattr(func, 'is_task', False):
+        raise ValueError(f'{task_name(func)} не помечена декоратором @task')
+    fields = dict(name=task_name(func), args=list(args), max_attempts=func.max_attempts,
+                  run_after=timezone.now() + timedelta(seconds=delay))
+    if key is None:
+        queued = Task.objects.create(**fields)
+    else:
+        try:
+            with transaction.atomic():
+                queued = Task.objects.create(idempotency_key=key, **fields)
+        except IntegrityError:
+            requeued = Task.objects.filter(idempotency_key=key, status=Task.FAILED) \
+                .update(status=Task.QUEUED, attempts=0, last_error='', started_at=None, finished_at=None, **fields)
+            queued = Task.objects.get(idempotency_key=key)
+            if not requeued:
+                return queued
+
+    if settings.TASKS_EAGER:
+        transaction.on_commit(lambda: run_task(queued.pk))
+    return queued
+
+
+# Захват задачи условным UPDATE: при нескольких воркерах задачу выполнит только один
+def _claim(task_id):
+    return Task.objects.filter(pk=task_id, status=Task.QUEUED) \
+        .update(status=Task.RUNNING, started_at=timezone.now(), attempts=F('attempts') + 1)
+
+
+def run_task(task_id):
+    if not _claim(task_id):
+        return False
+    queued = Task.objects.get(pk=task_id)
+    try:
+        func = import_string(queued.name)
+        if not getattr(func, 'is_task', False):
+            raise ValueError(f'{queued.name} не помечена декоратором @task')
+        func(*queued.args)
+    except Exception:
+        error = traceback.format_exc()
+        logger.warning('Задача %s (%s) завершилась ошибкой, попытка %s из %s',
+                       queued.pk, queued.name, queued.attempts, queued.max_attempts)
+        if queued.attempts < queued.max_attempts:
+            delay = timedelta(seconds=RETRY_DELAY * 2 ** (queued.attempts - 1))
+            Task.objects.filter(pk=task_id).update(status=Task.QUEUED, last_error=error,
+                                                   run_after=timezone.now() + delay)
+        else:
+            Task.objects.filter(pk=task_id).update(status=Task.FAILED, last_error=error,
+                                                   finished_at=timezone.now())
+    else:
+        Task.objects.filter(pk=task_id).update(status=Task.DONE, finished_at=timezone.now())
+    return True
+
+
+# Выполнить до limit готовых к запуску задач, вернуть число выполненных
+def run_pending(limit=10):
+    ids = Task.objects.filter(status=Task.QUEUED, run_after__lte=timezone.now()) \
+        .order_by('run_after', 'pk').values_list('pk', flat=True)[:limit]
+    return sum(run_task(task_id) for task_id in ids)
+
+
+# Задачи упавшего воркера (running дольше STALE_AFTER) возвращаются в очередь
+def requeue_stale():
+    return Task.objects.filter(status=Task.RUNNING, started_at__lt=timezone.now() - STALE_AFTER) \
+        .update(status=Task.QUEUED, run_after=timezone.now())
+
+
+def purge_finished(days):
+    deleted, _ = Task.objects.filter(status=Task.DONE, finished_at__lt=timezone.now() - timedelta(days=days)).delete()
+    return deleted
+
+
+def _percentile(values, percent):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+# Метрики очереди: глубина по статусам, возраст старейшей задачи в очереди,
+# задержка (постановка → завершение) и время выполнения за последние STATS_WINDOW
+def queue_stats():
+    now = timezone.now()
+    depth = dict(Task.objects.values_list('status').annotate(count=Count('pk')).order_by())
+    oldest = Task.objects.filter(status=Task.QUEUED).aggregate(oldest=Min('created_at'))['oldest']
+    finished = Task.objects.filter(status=Task.DONE, finished_at__gte=now - STATS_WINDOW) \
+        .values_list('name', 'created_at', 'started_at', 'finished_at')
+
+    by_name = {}
+    for name, created_at, started_at, finished_at in finished:
+        timings = by_name.setdefault(name, {'latency': [], 'runtime': []})
+        timings['latency'].append((finished_at - created_at).total_seconds() * 1000)
+        timings['runtime'].append((finished_at - started_at).total_seconds() * 1000)
+
+    return {
+        'depth': {status: depth.get(status, 0) for status, _ in Task.STATUS_CHOICES},
+        'oldest_queued_seconds': round((now - oldest).total_seconds(), 1) if oldest else None,
+        'tasks': {name: {'done': len(timings['latency']),
+                         'latency_p50_ms': round(_percentile(timings['latency'], 50), 1),
+                         'latency_p95_ms': round(_percentile(timings['latency'], 95), 1),
+                         'runtime_p95_ms': round(_percentile(timings['runtime'], 95), 1)}
+                  for name, timings in sorted(by_name.items())}
+    }
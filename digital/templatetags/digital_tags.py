@@ -1,13 +1,28 @@
-from digital.models import Category, FavoriteProduct
+from digital.catalog import get_category_tree
+from digital.facets import CHARACTERISTIC_PREFIX
+from digital.images import DERIVATIVE_FORMATS, MIME_TYPES, available_widths, derivative_name
+from digital.utils import get_favorite_ids
 from django import template
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.template.loader import render_to_string
+from django.utils.html import format_html, format_html_join
+from django.utils.safestring import mark_safe
 
 register = template.Library()
 
+PRODUCT_CARD_TEMPLATE = 'digital/components/_cart.html'
+PRODUCT_CARD_TIMEOUT = 60 * 60 * 24
 
-@register.simple_tag()
-def get_categories():
-    categories = Category.objects.filter(parent=None)
-    return categories
+
+@register.simple_tag(takes_context=True)
+def get_categories(context):
+    request = context.get('request')
+    if request is None:
+        return get_category_tree()
+    if not hasattr(request, '_category_tree'):
+        request._category_tree = get_category_tree()
+    return request._category_tree
 
 @register.simple_tag(takes_context=True)
 def query_params(context, **kwargs):
@@ -20,26 +35,71 @@ def query_params(context, **kwargs):
 
         lst = ['model', 'price_to', 'price_from']
         if key == 'cat':
+            lst += [i for i in query if i.startswith(CHARACTERISTIC_PREFIX) and i[len(CHARACTERISTIC_PREFIX):].isdigit()]
             for i in lst:
                 try:
                     del query[i]
                 except:
                     pass
 
+    # Курсор привязан к текущим фильтрам и не совместим с номером страницы
+    if 'cursor' in kwargs:
+        query.pop('page', None)
+    elif 'cursor' in query and any(key != 'page' for key in kwargs):
+        query['cursor'] = ''
 
     return query.urlencode()
 
-@register.simple_tag()
-def get_favorites(user):
-    favorites = FavoriteProduct.objects.filter(user=user)
-    products = [i.product for i in favorites]
-    return products
-
-
-
-
-
+# query_params для параметра с вычисляемым именем (фасеты характеристик)
+@register.simple_tag(takes_context=True)
+def query_param(context, key, value, **kwargs):
+    kwargs[key] = value
+    return query_params(context, **kwargs)
 
 
+# Ключ карточки меняется вместе с товаром (updated_at), наличием и отметкой избранного.
+# Старые карточки не удаляются, а перестают читаться — это работает и для записей из других процессов
+# (админка, воркер, импорт). Поэтому всё, что меняет вид карточки, обязано обновить updated_at
+def product_card_key(product, is_favorite):
+    return f'product_card:{product.pk}:{product.updated_at.timestamp()}:{int(product.quantity > 0)}:{int(is_favorite)}'
 
 
+# Карточки товаров из кэша: один get_many на список, недостающие рендерятся и сохраняются
+@register.simple_tag(takes_context=True)
+def product_cards(context, products):
+    request = context['request']
+    favorite_ids = get_favorite_ids(request)
+    products = list(products)
+    keys = [product_card_key(product, product.pk in favorite_ids) for product in products]
+    cached = cache.get_many(keys)
+
+    missing = {}
+    for key, product in zip(keys, products):
+        if key not in cached:
+            missing[key] = render_to_string(PRODUCT_CARD_TEMPLATE, {'product': product, 'favorite_ids': favorite_ids})
+    if missing:
+        cache.set_many(missing, PRODUCT_CARD_TIMEOUT)
+        cached.update(missing)
+    return mark_safe(''.join(cached[key] for key in keys))
+
+
+# <picture> с уменьшенными копиями картинки (srcset по ширинам, AVIF/WebP с запасным JPEG).
+# Пока копии не нарезаны — обычный <img> с оригиналом
+@register.simple_tag
+def responsive_image(image, sizes='100vw', alt='', css_class=''):
+    if not image:
+        return ''
+    widths = available_widths(image.name)
+    if not widths:
+        return format_html('<img src="{}" alt="{}" class="{}" loading="lazy">', image.url, alt, css_class)
+
+    def srcset(fmt):
+        return ', '.join(f'{default_storage.url(derivative_name(image.name, width, fmt))} {width}w' for width in widths)
+
+    *formats, fallback = DERIVATIVE_FORMATS
+    sources = format_html_join('', '<source type="{}" srcset="{}" sizes="{}">',
+                               ((MIME_TYPES[fmt], srcset(fmt), sizes) for fmt in formats))
+    return format_html('<picture>{}<img src="{}" srcset="{}" sizes="{}" alt="{}" class="{}" loading="lazy" '
+                       'decoding="async"></picture>',
+                       sources, default_storage.url(derivative_name(image.name, widths[-1], fallback)),
+                       srcset(fallback), sizes, alt, css_class)
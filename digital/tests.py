@@ -1,20 +1,1055 @@
-from django.test import TestCase
-
-# Create your tests here.
-def filter_products(request, products):
-    cat = request.GET.get('cat')
-    price_from = request.GET.get('price_from')
-    price_to = request.GET.get('price_to')
-    model = request.GET.get('model')
-
-    if cat:
-        products = products.filter(category__slug=cat)
-    if price_from:
-        products = products.filter(price__gte=price_from)
-    if price_to:
-        products = products.filter(price__lte=price_to)
-    if model:
-        products = products.filter(model__slug=model)
-
-    return products
+import csv
+import json
+import shutil
+import tempfile
+import threading
+import zipfile
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
+from xml.etree import ElementTree
 
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import CommandError, call_command
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, connection, transaction
+from django.db.models.functions import Now
+from django.http import HttpResponse, QueryDict
+from django.test import (LiveServerTestCase, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase,
+                         override_settings)
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+import requests
+
+from . import benchmark, reports
+from .benchmark import BENCHMARK_CACHES
+from .catalog import (SHOWCASE_SIZE, category_products, get_category_tree, get_related_products, get_showcase,
+                      invalidate_category_tree)
+from .catalog_io import RowWriter, export_rows, import_rows, read_rows
+from .facets import ProductFacets
+from .fake_stripe import FakeStripeServer
+from .forms import DeliveryForm
+from .management.commands.benchmark import DEFAULT_BUDGET
+from .management.commands.explain_queries import explain, hot_queries
+from .images import DERIVATIVE_FORMATS, available_widths, derivative_name, generate_derivatives, process_image
+from .middleware import replica_middleware
+from .pagination import encode_cursor
+from .models import (Cart, Category, Characteristic, Customer, Delivery, FavoriteProduct, ModelProduct, Order,
+                     Payment, Product, ProductCart, ProductCharacteristic, Task)
+from .payments import create_payment, finalize_payment, get_gateway
+from .routers import PIN_COOKIE, ReplicaRouter, finish_request, start_request
+from .search import SearchResults
+from .sorting import DEFAULT_SORT, RELEVANCE_SORT, SORT_MODES, get_sort, sort_ordering
+from .taskqueue import enqueue, run_pending, run_task
+from .templatetags.digital_tags import responsive_image
+from .utils import CART_COOKIE, CartForAuthenticatedUser, OutOfStockError
+
+DELIVERY_DATA = {
+    'region': 'Ташкент', 'city': 'Ташкент', 'address': 'ул. Тестовая, 1', 'comment': '',
+    'phone': '+998900000000', 'first_name': 'Test', 'last_name': 'User', 'email': 'test@example.com'
+}
+
+
+# Небольшой каталог и покупатель с корзиной для тестов
+class CatalogMixin:
+    @classmethod
+    def create_catalog(cls):
+        root = Category.objects.create(title='Телефоны', slug='phones')
+        cls.category = Category.objects.create(title='Apple', slug='apple', parent=root)
+        cls.model = ModelProduct.objects.create(title='iPhone', slug='iphone')
+        cls.user = User.objects.create_user('buyer', password='buyer-password')
+        cls.customer = Customer.objects.create(user=cls.user, phone_number='+998900000000')
+        cls.cart = Cart.objects.create(customer=cls.customer)
+
+    @classmethod
+    def create_product(cls, slug, **fields):
+        return Product.objects.create(title=f'Товар {slug}', slug=slug, category=cls.category, model=cls.model,
+                                      **fields)
+
+    def add_line(self, product, quantity):
+        return ProductCart.objects.create(cart=self.cart, product=product, quantity=quantity)
+
+    def user_cart(self):
+        return CartForAuthenticatedUser(None, user=self.user)
+
+    def delivery(self):
+        return Delivery(customer=self.customer, **DELIVERY_DATA)
+
+
+# Кэш — в памяти процесса, не общий рабочий
+@override_settings(CACHES=BENCHMARK_CACHES)
+class CatalogTestCase(CatalogMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.create_catalog()
+
+    def setUp(self):
+        cache.clear()
+
+
+class PlaceOrderTests(CatalogTestCase):
+    def test_order_takes_cart_lines_and_stock(self):
+        phone = self.create_product('phone', price=1000, discount=10, quantity=5)
+        case = self.create_product('case', price=100, quantity=3)
+        self.add_line(phone, 2)
+        self.add_line(case, 1)
+
+        order = self.user_cart().place_order(self.delivery(), completed=True)
+
+        self.assertEqual(order.price, 2 * 900 + 100)
+        self.assertEqual(sorted(order.products.values_list('slug', 'quantity', 'price')),
+                         [('case', 1, 100), ('phone', 2, 900)])
+        phone.refresh_from_db()
+        self.assertEqual((phone.quantity, phone.sales_count), (3, 2))
+        self.assertFalse(ProductCart.objects.filter(cart=self.cart).exists())
+
+    def test_out_of_stock_rolls_back_everything(self):
+        phone = self.create_product('phone', quantity=5)
+        case = self.create_product('case', quantity=1)
+        self.add_line(phone, 2)
+        self.add_line(case, 2)
+
+        with self.assertRaises(OutOfStockError):
+            self.user_cart().place_order(self.delivery())
+
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(Delivery.objects.exists())
+        self.assertEqual(Product.objects.get(pk=phone.pk).quantity, 5)
+        self.assertEqual(ProductCart.objects.filter(cart=self.cart).count(), 2)
+
+    def test_order_is_built_from_fresh_cart(self):
+        phone = self.create_product('phone', price=1000, quantity=5)
+        line = self.add_line(phone, 1)
+        cart = self.user_cart()
+        cart.get_cart_info()
+        ProductCart.objects.filter(pk=line.pk).update(quantity=3)
+
+        order = cart.place_order(self.delivery())
+
+        self.assertEqual(order.price, 3000)
+        self.assertEqual(order.products.get().quantity, 3)
+
+
+class CartLineTests(CatalogTestCase):
+    def test_add_stops_at_stock(self):
+        phone = self.create_product('phone', quantity=2)
+        cart = self.user_cart()
+        self.assertEqual([cart.add_or_delete('phone', 'add') for _ in range(3)], [1, 2, None])
+        self.assertEqual(ProductCart.objects.get(cart=self.cart, product=phone).quantity, 2)
+
+    def test_add_out_of_stock_product(self):
+        self.create_product('phone', quantity=0)
+        self.assertIsNone(self.user_cart().add_or_delete('phone', 'add'))
+        self.assertFalse(ProductCart.objects.exists())
+
+    def test_delete_last_unit_removes_line(self):
+        phone = self.create_product('phone', quantity=5)
+        self.add_line(phone, 2)
+        cart = self.user_cart()
+        self.assertEqual([cart.add_or_delete('phone', 'delete') for _ in range(3)], [1, 0, None])
+        self.assertFalse(ProductCart.objects.exists())
+
+    # Двойной клик «убрать»: второй запрос выполняется между запросами первого
+    def test_concurrent_deletes_do_not_leave_empty_line(self):
+        phone = self.create_product('phone', quantity=5)
+        self.add_line(phone, 2)
+        other = {}
+
+        # Запросы второго удаления тоже проходят через обёртку: отметка ставится до вызова
+        def run_other_request(execute, sql, params, many, context):
+            result = execute(sql, params, many, context)
+            if 'quantity' not in other:
+                other['quantity'] = None
+                other['quantity'] = self.user_cart().add_or_delete('phone', 'delete')
+            return result
+
+        with connection.execute_wrapper(run_other_request):
+            first = self.user_cart().add_or_delete('phone', 'delete')
+
+        self.assertEqual(sorted([first, other['quantity']]), [0, 1])
+        self.assertFalse(ProductCart.objects.exists())
+
+    # Добавление, уменьшение и удаление строки — по одному SQL-запросу, без чтения корзины и товара
+    def test_each_change_is_one_statement(self):
+        phone = self.create_product('phone', quantity=5)
+        cart = self.user_cart()
+        for action, quantity in (('add', 1), ('add', 2), ('delete', 1), ('clear', 0)):
+            with self.subTest(action), self.assertNumQueries(1):
+                self.assertEqual(cart.add_or_delete('phone', action), quantity)
+        self.assertFalse(ProductCart.objects.filter(product=phone).exists())
+
+
+class AnonymousCartTests(CatalogTestCase):
+    def test_guest_cart_lives_in_cookie(self):
+        phone = self.create_product('phone', price=500, quantity=2)
+        for _ in range(3):
+            self.client.get(reverse('action_cart', args=('phone', 'add')))
+
+        self.assertIn(CART_COOKIE, self.client.cookies)
+        self.assertFalse(ProductCart.objects.exists())
+        response = self.client.get(reverse('basket'))
+        self.assertEqual(response.context['cart_quantity'], 2)
+        self.assertEqual(response.context['cart_price'], 1000)
+        self.assertEqual(response.context['products_cart'][0].product, phone)
+
+    def test_tampered_cookie_is_ignored(self):
+        self.create_product('phone', quantity=2)
+        self.client.cookies[CART_COOKIE] = json.dumps({'1': [5, 0]})
+        response = self.client.get(reverse('basket'))
+        self.assertEqual(response.context['cart_quantity'], 0)
+
+    def test_login_merges_guest_cart_capped_by_stock(self):
+        phone = self.create_product('phone', quantity=3)
+        case = self.create_product('case', quantity=5)
+        self.add_line(phone, 2)
+        for slug in ('phone', 'phone', 'case'):
+            self.client.get(reverse('action_cart', args=(slug, 'add')))
+
+        self.client.post(reverse('login'), {'username': 'buyer', 'password': 'buyer-password'})
+
+        lines = dict(ProductCart.objects.filter(cart=self.cart).values_list('product_id', 'quantity'))
+        self.assertEqual(lines, {phone.pk: 3, case.pk: 1})
+        self.assertEqual(self.client.cookies[CART_COOKIE].value, '')
+
+    # Cookie ограничена по числу строк, пустая корзина cookie удаляет
+    def test_cookie_is_capped_and_removed_when_empty(self):
+        self.create_product('phone', quantity=2)
+        self.create_product('case', quantity=2)
+        with mock.patch('digital.utils.CART_COOKIE_MAX_LINES', 1):
+            for slug in ('phone', 'case'):
+                self.client.get(reverse('action_cart', args=(slug, 'add')))
+        self.assertEqual(self.client.get(reverse('basket')).context['cart_quantity'], 1)
+
+        self.client.get(reverse('action_cart', args=('phone', 'delete')))
+        self.assertEqual(self.client.cookies[CART_COOKIE].value, '')
+
+
+class ProductCardTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+
+    def listing(self):
+        return self.client.get(self.category.parent.get_absolute_url()).content.decode()
+
+    # Запись в обход кэша (как из другого процесса): карточка перерисовывается по новому updated_at
+    def test_card_follows_updated_at(self):
+        phone = self.create_product('phone', price=1000)
+        self.assertIn('Товар phone', self.listing())
+        Product.objects.filter(pk=phone.pk).update(title='Новый телефон', updated_at=Now())
+        self.assertIn('Новый телефон', self.listing())
+
+    def test_card_follows_stock(self):
+        phone = self.create_product('phone', quantity=1)
+        self.assertIn('В корзину', self.listing())
+        Product.objects.filter(pk=phone.pk).update(quantity=0)
+        self.assertIn('Нет товара корзине', self.listing())
+
+
+class CursorPaginationTests(CatalogTestCase):
+    def listing(self, **params):
+        return self.client.get(self.category.parent.get_absolute_url(), params)
+
+    def test_cursor_pages(self):
+        for i in range(5):
+            self.create_product(f'phone-{i}', price=100 * (i + 1))
+        first = self.listing(sort='price_asc', cursor='')
+        second = self.listing(sort='price_asc', cursor=first.context['page_obj'].next_cursor)
+        self.assertEqual([p.price for p in second.context['products']], [400, 500])
+
+    def test_cursor_with_wrong_types_is_not_found(self):
+        self.create_product('phone')
+        for sort, values in (('price_asc', ['cheap', 1]), ('new', [12, 1]), ('new', ['2024-13-45', 1]),
+                             ('price_desc', [100, {'id': 1}]), ('price_desc', [100])):
+            with self.subTest(sort=sort, values=values):
+                response = self.listing(sort=sort, cursor=encode_cursor(values, 'n'))
+                self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.listing(cursor='not-base64!').status_code, 404)
+
+    def test_favorites_cursor_is_checked_against_annotation(self):
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(reverse('favs'), {'cursor': encode_cursor(['x', 1], 'n')}).status_code, 404)
+        self.assertEqual(self.client.get(reverse('favs'), {'cursor': ''}).status_code, 200)
+
+
+# Режимы сортировки листинга (?sort=): у каждого свой порядок, равные значения — по pk
+class SortModeTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        now = timezone.now()
+        for i, (price, discount, sales) in enumerate(((300, 0, 5), (100, 30, 0), (200, 10, 9))):
+            product = self.create_product(f'phone-{i}', price=price, discount=discount)
+            Product.objects.filter(pk=product.pk).update(created_at=now - timedelta(days=i), sales_count=sales)
+
+    def listing(self, **params):
+        response = self.client.get(self.category.parent.get_absolute_url(), params)
+        return [p.slug for p in response.context['products']]
+
+    def test_each_mode_orders_listing(self):
+        expected = {
+            'new': ['phone-0', 'phone-1', 'phone-2'],
+            'price_asc': ['phone-1', 'phone-2', 'phone-0'],
+            'price_desc': ['phone-0', 'phone-2', 'phone-1'],
+            'discount': ['phone-1', 'phone-2', 'phone-0'],
+            'popular': ['phone-2', 'phone-0', 'phone-1'],
+        }
+        self.assertEqual(set(expected), set(SORT_MODES))
+        for sort, slugs in expected.items():
+            with self.subTest(sort=sort):
+                self.assertEqual(self.listing(sort=sort), slugs)
+                ordered = category_products(self.category.parent).order_by(*sort_ordering(sort))
+                self.assertEqual([p.slug for p in ordered], slugs)
+
+    def test_ties_are_ordered_by_pk(self):
+        Product.objects.update(discount=0)
+        self.assertEqual(self.listing(sort='discount'), ['phone-2', 'phone-1', 'phone-0'])
+
+    def test_unknown_mode_falls_back_to_default(self):
+        self.assertEqual(get_sort(QueryDict('sort=relevance')), DEFAULT_SORT)
+        self.assertEqual(get_sort(QueryDict('sort=relevance'), default=RELEVANCE_SORT), RELEVANCE_SORT)
+        self.assertEqual(self.listing(sort='-price'), self.listing())
+
+
+# Фасеты листинга: каждый счётчик учитывает все фильтры, кроме своего
+class FacetTests(CatalogTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.root = cls.category.parent
+        cls.android = Category.objects.create(title='Android', slug='android', parent=cls.root)
+        pixel = ModelProduct.objects.create(title='Pixel', slug='pixel')
+        cls.memory = Characteristic.objects.create(name='Память')
+        cls.cheap = cls.create_product('cheap', price=1000, quantity=1)
+        cls.sale = cls.create_product('sale', price=1600, discount=50, quantity=0)
+        cls.pixel = Product.objects.create(title='Pixel', slug='pixel', category=cls.android, model=pixel,
+                                           price=2600, quantity=2)
+        for product, value in ((cls.cheap, '128'), (cls.sale, '256'), (cls.pixel, '128')):
+            ProductCharacteristic.objects.create(product=product, characteristic=cls.memory, value=value)
+
+    def facets(self, query):
+        return ProductFacets(QueryDict(query), category_products(self.root))
+
+    def test_counts_ignore_own_filter(self):
+        facets = self.facets('model=iphone')
+        self.assertEqual(set(facets.queryset), {self.cheap, self.sale})
+        self.assertEqual(facets.subcategory_counts(), {self.category.pk: 2})
+        self.assertEqual([(m['slug'], m['count']) for m in facets.model_counts()], [('pixel', 1), ('iphone', 2)])
+        self.assertEqual(facets.in_stock_count(), 1)
+        self.assertEqual(facets.price_buckets(), [{'price_from': 500, 'price_to': 1000, 'count': 1},
+                                                  {'price_from': 1000, 'price_to': 1500, 'count': 1}])
+        self.assertEqual([(v['value'], v['count']) for v in facets.characteristic_counts()[0]['values']],
+                         [('128', 1), ('256', 1)])
+
+    def test_selected_characteristic_keeps_other_values(self):
+        facets = self.facets(f'ch{self.memory.pk}=128')
+        self.assertEqual(set(facets.queryset), {self.cheap, self.pixel})
+        [memory] = facets.characteristic_counts()
+        self.assertEqual((memory['param'], memory['selected']), (f'ch{self.memory.pk}', '128'))
+        self.assertEqual([(v['value'], v['count']) for v in memory['values']], [('128', 2), ('256', 1)])
+        self.assertEqual([(m['slug'], m['count']) for m in facets.model_counts()], [('pixel', 1), ('iphone', 1)])
+
+    # Фильтр цены — по цене со скидкой, неверные значения параметров игнорируются
+    def test_price_filter_uses_final_price(self):
+        self.assertEqual(list(self.facets('price_to=900').queryset), [self.sale])
+        self.assertEqual(set(self.facets('price_from=abc&in_stock=1').queryset), {self.cheap, self.pixel})
+
+
+# Похожие товары: та же модель, совпавшие характеристики и близость цены, только из того же раздела
+class RelatedProductsTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        other_model = ModelProduct.objects.create(title='Galaxy', slug='galaxy')
+        tablets = Category.objects.create(title='Планшеты', slug='tablets')
+        ipad = Category.objects.create(title='iPad', slug='ipad', parent=tablets)
+        characteristics = {name: Characteristic.objects.create(name=name) for name in ('memory', 'color')}
+
+        def product(slug, price, model=other_model, category=self.category, **values):
+            obj = Product.objects.create(title=slug, slug=slug, price=price, model=model, category=category)
+            for name, value in values.items():
+                ProductCharacteristic.objects.create(product=obj, characteristic=characteristics[name], value=value)
+            return obj
+
+        self.phone = product('phone', 1000, self.model, memory='128', color='black')
+        self.same_model = product('same-model', 5000, self.model)
+        self.shared = product('shared', 1000, memory='128', color='black')
+        self.near_price = product('near-price', 1100)
+        self.far_price = product('far-price', 10000)
+        product('other-section', 1000, self.model, ipad, memory='128')
+
+    def test_ranked_by_model_characteristics_and_price(self):
+        related = get_related_products(Product.objects.get(pk=self.phone.pk))
+        self.assertEqual(related, [self.shared, self.same_model, self.near_price, self.far_price])
+        self.assertEqual(get_related_products(self.phone, limit=2), [self.shared, self.same_model])
+
+    def test_ranking_is_cached_until_product_changes(self):
+        get_related_products(self.phone)
+        with self.assertNumQueries(1):
+            get_related_products(self.phone)
+
+        self.phone.model = ModelProduct.objects.create(title='Pixel', slug='pixel')
+        self.phone.save()
+        self.assertEqual(get_related_products(self.phone),
+                         [self.shared, self.near_price, self.same_model, self.far_price])
+
+
+# Поиск по FTS5: индекс обновляет очередь задач (signals.py), порядок — bm25 с весами колонок
+class SearchTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        ultra = ModelProduct.objects.create(title='Ultra', slug='ultra')
+        self.by_title = Product.objects.create(title='Galaxy Ultra', slug='galaxy-ultra', category=self.category,
+                                               model=self.model, price=3000)
+        self.by_model = Product.objects.create(title='Смартфон', slug='phone', category=self.category, model=ultra,
+                                               price=2000)
+        self.by_characteristic = Product.objects.create(title='Камера', slug='camera', category=self.category,
+                                                        model=self.model, price=1000)
+        ProductCharacteristic.objects.create(product=self.by_characteristic, value='ultra wide',
+                                             characteristic=Characteristic.objects.create(name='Объектив'))
+        run_pending()
+
+    def test_title_outranks_model_and_characteristics(self):
+        results = SearchResults('ultra')
+        self.assertEqual(results.count(), 3)
+        self.assertEqual(list(results[0:3]), [self.by_title, self.by_model, self.by_characteristic])
+
+    def test_words_match_by_prefix(self):
+        self.assertEqual(list(SearchResults('смарт')[0:10]), [self.by_model])
+        self.assertEqual(list(SearchResults('GALAX ult')[0:10]), [self.by_title])
+        self.assertEqual(SearchResults('смарт камера').count(), 0)
+
+    def test_sort_mode_replaces_relevance(self):
+        self.assertEqual(list(SearchResults('ultra', sort='price_asc')[0:3]),
+                         [self.by_characteristic, self.by_model, self.by_title])
+
+    def test_index_follows_changes(self):
+        self.by_model.title = 'Телефон'
+        self.by_model.save()
+        self.by_title.delete()
+        run_pending()
+        self.assertEqual(list(SearchResults('телеф')[0:10]), [self.by_model])
+        self.assertEqual(list(SearchResults('galaxy')[0:10]), [])
+
+
+class FinalizePaymentTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.phone = self.create_product('phone', price=1000, quantity=5)
+        self.add_line(self.phone, 2)
+        form = DeliveryForm(data=DELIVERY_DATA)
+        self.assertTrue(form.is_valid())
+        self.payment = create_payment(self.user_cart().get_cart_info(), form)
+        self.payment.save()
+        Task.objects.all().delete()
+
+    def test_event_before_session_saved_is_retried(self):
+        queued = enqueue(finalize_payment, self.payment.pk, 'cs_test_early', key='finalize_payment:cs_test_early')
+
+        self.assertTrue(run_task(queued.pk))
+        queued.refresh_from_db()
+        self.assertEqual((queued.status, queued.attempts), (Task.QUEUED, 1))
+        self.assertIn('PaymentNotReady', queued.last_error)
+
+        Payment.objects.filter(pk=self.payment.pk).update(session_id='cs_test_early')
+        Task.objects.filter(pk=queued.pk).update(run_after=Now())
+        self.assertEqual(run_pending(), 1)
+        queued.refresh_from_db()
+        self.payment.refresh_from_db()
+        self.assertEqual(queued.status, Task.DONE)
+        self.assertEqual(self.payment.status, Payment.PAID)
+        self.assertIsNotNone(self.payment.order_id)
+
+    def test_paid_payment_is_not_finalized_twice(self):
+        Payment.objects.filter(pk=self.payment.pk).update(session_id='cs_test_paid')
+        self.assertEqual(finalize_payment(self.payment.pk, 'cs_test_paid').status, Payment.PAID)
+        self.assertIsNone(finalize_payment(self.payment.pk, 'cs_test_paid'))
+        self.assertEqual(Order.objects.filter(customer=self.customer).count(), 1)
+
+    # Корзину изменили, пока шла оплата: в заказ попадает оплаченное, новое остаётся в корзине
+    def test_order_is_built_from_paid_lines(self):
+        Payment.objects.filter(pk=self.payment.pk).update(session_id='cs_test_edited')
+        tablet = self.create_product('tablet', price=500, quantity=5)
+        ProductCart.objects.filter(cart=self.cart, product=self.phone).update(quantity=4)
+        self.add_line(tablet, 1)
+        self.phone.price = 1500
+        self.phone.save()
+
+        order = finalize_payment(self.payment.pk, 'cs_test_edited').order
+
+        self.phone.refresh_from_db()
+        self.assertEqual(order.price, 2000)
+        self.assertEqual(list(order.products.values_list('slug', 'quantity', 'price')), [('phone', 2, 1000)])
+        self.assertEqual(self.phone.quantity, 3)
+        self.assertEqual(list(ProductCart.objects.filter(cart=self.cart).values_list('product__slug', 'quantity')),
+                         [('tablet', 1)])
+
+
+# Полный путь оплаты через локальный fake_stripe: сессия оплаты → вебхук → задача очереди → заказ
+WEBHOOK_SECRET = 'whsec_test'
+
+
+@override_settings(CACHES=BENCHMARK_CACHES, ROOT_URLCONF='digital.urls', TASKS_EAGER=False,
+                   STRIPE_SECRET_KEY='sk_test_fake', STRIPE_WEBHOOK_SECRET=WEBHOOK_SECRET)
+class PaymentFlowTests(CatalogMixin, LiveServerTestCase):
+    def setUp(self):
+        self.create_catalog()
+        self.stripe = FakeStripeServer(('127.0.0.1', 0), self.live_server_url + reverse('stripe_webhook'),
+                                       WEBHOOK_SECRET)
+        threading.Thread(target=self.stripe.serve_forever, daemon=True).start()
+        host, port = self.stripe.server_address[:2]
+        settings_override = override_settings(STRIPE_API_BASE=f'http://{host}:{port}')
+        settings_override.enable()
+        get_gateway.cache_clear()
+        self.addCleanup(get_gateway.cache_clear)
+        self.addCleanup(settings_override.disable)
+        self.addCleanup(self.stripe.server_close)
+        self.addCleanup(self.stripe.shutdown)
+
+    def test_webhook_places_order(self):
+        phone = self.create_product('phone', price=1000, quantity=5)
+        self.add_line(phone, 2)
+        Task.objects.all().delete()
+        self.client.force_login(self.user)
+
+        response = self.client.post(reverse('payment'), DELIVERY_DATA)
+        payment = Payment.objects.get(customer=self.customer)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response['Location'], self.stripe.sessions[payment.session_id]['url'])
+
+        paid = requests.get(response['Location'], allow_redirects=False, timeout=10)
+        self.assertEqual(paid.status_code, 302)
+        self.assertEqual(Task.objects.get().idempotency_key, f'finalize_payment:{payment.session_id}')
+        self.assertEqual(run_pending(), 1)
+
+        payment.refresh_from_db()
+        phone.refresh_from_db()
+        self.assertEqual(payment.status, Payment.PAID)
+        self.assertEqual(payment.order.price, 2000)
+        self.assertEqual(phone.quantity, 3)
+        self.assertFalse(ProductCart.objects.filter(cart=self.cart).exists())
+        self.assertEqual(Task.objects.get().status, Task.DONE)
+
+
+@override_settings(DATABASE_REPLICAS=['replica1', 'replica2'], REPLICA_STICKY_SECONDS=5)
+class ReplicaRouterTests(SimpleTestCase):
+    def setUp(self):
+        self.router = ReplicaRouter()
+
+    def read(self, model=Product):
+        return self.router.db_for_read(model) or DEFAULT_DB_ALIAS
+
+    def test_reads_outside_request_use_primary(self):
+        self.assertEqual(self.read(), DEFAULT_DB_ALIAS)
+
+    def test_request_sticks_to_one_replica(self):
+        _, token = start_request()
+        try:
+            replica = self.read()
+            self.assertIn(replica, ('replica1', 'replica2'))
+            self.assertEqual(self.read(Category), replica)
+            self.assertEqual(self.read(Cart), DEFAULT_DB_ALIAS)
+        finally:
+            finish_request(token)
+
+    # Реплики чередуются по запросам; объект, прочитанный с реплики, дочитывает связи оттуда же
+    def test_requests_alternate_replicas(self):
+        replicas = []
+        for _ in range(2):
+            _, token = start_request()
+            try:
+                replicas.append(self.read())
+            finally:
+                finish_request(token)
+        self.assertEqual(sorted(replicas), ['replica1', 'replica2'])
+
+        product = Product()
+        product._state.db = 'replica2'
+        self.assertEqual(self.router.db_for_read(Category, instance=product), 'replica2')
+
+    def test_reads_after_write_use_primary(self):
+        _, token = start_request()
+        try:
+            self.router.db_for_write(ProductCart)
+            self.assertEqual(self.read(), DEFAULT_DB_ALIAS)
+        finally:
+            finish_request(token)
+
+    def test_pinned_request_uses_primary(self):
+        _, token = start_request(pinned=True)
+        try:
+            self.assertEqual(self.read(), DEFAULT_DB_ALIAS)
+        finally:
+            finish_request(token)
+
+    def test_middleware_pins_after_write(self):
+        def write(request):
+            self.router.db_for_write(ProductCart)
+            return HttpResponse()
+
+        request = RequestFactory().get('/')
+        response = replica_middleware(write)(request)
+        self.assertEqual(response.cookies[PIN_COOKIE]['max-age'], 5)
+        response = replica_middleware(lambda request: HttpResponse())(request)
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+
+    def test_replicas_are_not_migrated(self):
+        self.assertFalse(self.router.allow_migrate('replica1', 'digital'))
+        self.assertIsNone(self.router.allow_migrate(DEFAULT_DB_ALIAS, 'digital'))
+
+
+class ImageDerivativeTests(SimpleTestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root, CACHES=BENCHMARK_CACHES)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        cache.clear()
+
+    def save_image(self, name, width, height):
+        buffer = BytesIO()
+        Image.new('RGB', (width, height), 'red').save(buffer, 'PNG')
+        return default_storage.save(name, ContentFile(buffer.getvalue()))
+
+    def test_widths_up_to_original(self):
+        name = self.save_image('products/phone.png', 500, 250)
+        self.assertEqual(generate_derivatives(name), [200, 400])
+        for fmt in DERIVATIVE_FORMATS:
+            with default_storage.open(derivative_name(name, 400, fmt)) as f, Image.open(f) as image:
+                self.assertEqual(image.size, (400, 200))
+        self.assertEqual(available_widths(name), [200, 400])
+
+    def test_small_image_keeps_own_width(self):
+        name = self.save_image('products/icon.png', 120, 120)
+        self.assertEqual(generate_derivatives(name), [120])
+
+    # Готовые копии без force не пересоздаются, с force — пересоздаются
+    def test_existing_copies_are_kept_without_force(self):
+        name = self.save_image('products/phone.png', 500, 250)
+        generate_derivatives(name)
+        copy = derivative_name(name, 200, 'jpeg')
+        default_storage.delete(copy)
+        default_storage.save(copy, ContentFile(b'old'))
+
+        generate_derivatives(name)
+        with default_storage.open(copy) as f:
+            self.assertEqual(f.read(), b'old')
+        generate_derivatives(name, force=True)
+        with default_storage.open(copy) as f, Image.open(f) as image:
+            self.assertEqual(image.size, (200, 100))
+
+    def test_missing_or_broken_file(self):
+        self.assertEqual(generate_derivatives('products/missing.png'), [])
+        name = default_storage.save('products/broken.png', ContentFile(b'not an image'))
+        with self.assertLogs('digital.images', 'WARNING'):
+            self.assertEqual(generate_derivatives(name), [])
+
+    def test_responsive_image_markup(self):
+        name = self.save_image('products/phone.png', 500, 250)
+        image = Product(image=name).image
+        self.assertTrue(responsive_image(image).startswith('<img src='))
+        generate_derivatives(name)
+        markup = responsive_image(image, sizes='360px')
+        self.assertIn('<picture>', markup)
+        self.assertIn(f'{default_storage.url(derivative_name(name, 400, "jpeg"))} 400w', markup)
+
+
+# Нарезка в воркере: карточки и страницы перерисовываются со srcset без сброса кэша в процессе сайта
+class ProductImageRefreshTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_derivatives_reach_cached_cards_and_pages(self):
+        buffer = BytesIO()
+        Image.new('RGB', (500, 250), 'red').save(buffer, 'PNG')
+        name = default_storage.save('products/phone.png', ContentFile(buffer.getvalue()))
+        phone = self.create_product('phone', image=name, quantity=1)
+        listing = self.category.parent.get_absolute_url()
+        self.assertNotIn('<picture>', self.client.get(listing).content.decode())
+
+        process_image('digital.Product', phone.pk, 'image')
+
+        self.assertIn('<picture>', self.client.get(listing).content.decode())
+        self.assertIn('<picture>', self.client.get(phone.get_absolute_url()).content.decode())
+        self.assertGreater(Product.objects.get(pk=phone.pk).updated_at, phone.updated_at)
+
+
+class TaskKeyTests(CatalogTestCase):
+    def test_failed_task_is_enqueued_again(self):
+        phone = self.create_product('phone', image='products/phone.png')
+        queued = Task.objects.get(idempotency_key='image:products/phone.png')
+        phone.save()
+        self.assertEqual(Task.objects.filter(name=queued.name).count(), 1)
+
+        Task.objects.filter(pk=queued.pk).update(status=Task.FAILED, attempts=3, last_error='OSError')
+        phone.save()
+        queued.refresh_from_db()
+        self.assertEqual((queued.status, queued.attempts, queued.last_error), (Task.QUEUED, 0, ''))
+
+    def test_done_task_is_not_repeated(self):
+        phone = self.create_product('phone', image='products/phone.png')
+        Task.objects.filter(idempotency_key='image:products/phone.png').update(status=Task.DONE)
+        phone.save()
+        self.assertEqual(Task.objects.get(idempotency_key='image:products/phone.png').status, Task.DONE)
+
+
+# Группы ключей кэша с версией (дерево категорий, витрина)
+class CatalogCacheTests(CatalogTestCase):
+    def test_category_tree_is_one_query_and_cached(self):
+        with self.assertNumQueries(1):
+            tree = get_category_tree()
+        self.assertEqual([(root.slug, [child.slug for child in root.children]) for root in tree],
+                         [('phones', ['apple'])])
+        with self.assertNumQueries(0):
+            get_category_tree()
+
+    def test_category_changes_refresh_menu(self):
+        get_category_tree()
+        self.category.title = 'iPhone'
+        self.category.save()
+        self.assertEqual(get_category_tree()[0].children[0].title, 'iPhone')
+
+        self.category.delete()
+        self.assertEqual(get_category_tree()[0].children, [])
+
+    # Вытесненный ключ версии не возвращает к жизни записи старых версий
+    def test_evicted_version_does_not_revive_old_entries(self):
+        get_category_tree()
+        invalidate_category_tree()
+        get_category_tree()
+        cache.delete('category_tree:version')
+
+        Category.objects.create(title='Планшеты', slug='tablets')
+        self.assertIn('tablets', [category.slug for category in get_category_tree()])
+
+
+# Витрина главной: последние SHOWCASE_SIZE товаров каждой подкатегории одним запросом, из кэша
+class ShowcaseTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.android = Category.objects.create(title='Android', slug='android', parent=self.category.parent)
+        self.phones = [self.create_product(f'phone-{i}') for i in range(SHOWCASE_SIZE + 2)]
+        self.pixel = Product.objects.create(title='Pixel', slug='pixel', category=self.android, model=self.model)
+
+    def test_latest_products_of_each_subcategory(self):
+        with self.assertNumQueries(1):
+            showcase = get_showcase()
+        self.assertEqual([p.slug for p in showcase],
+                         [p.slug for p in reversed(self.phones[-SHOWCASE_SIZE:])] + ['pixel'])
+        with self.assertNumQueries(0):
+            get_showcase()
+
+    def test_product_changes_refresh_showcase(self):
+        get_showcase()
+        phone = self.create_product('phone-new')
+        self.assertEqual(get_showcase()[0], phone)
+
+        phone.delete()
+        self.pixel.title = 'Pixel 9'
+        self.pixel.save()
+        showcase = get_showcase()
+        self.assertNotIn(phone.slug, [p.slug for p in showcase])
+        self.assertEqual(showcase[-1].title, 'Pixel 9')
+
+    def test_main_page_is_served_from_showcase(self):
+        self.assertContains(self.client.get(reverse('main')), self.phones[-1].title)
+        self.create_product('phone-new')
+        self.assertContains(self.client.get(reverse('main')), 'Товар phone-new')
+
+
+# Кэш страниц для анонимных посетителей: сброс по версиям меток, ETag вместе с ключом
+class AnonymousPageCacheTests(CatalogTestCase):
+    def listing(self, **headers):
+        return self.client.get(self.category.parent.get_absolute_url(), headers=headers)
+
+    def test_order_resets_cached_stock(self):
+        phone = self.create_product('phone', quantity=1)
+        self.assertIn('В корзину', self.listing().content.decode())
+        self.add_line(phone, 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user_cart().place_order(self.delivery(), completed=True)
+
+        self.assertIn('Нет товара корзине', self.listing().content.decode())
+
+    def test_etag_follows_invalidation(self):
+        phone = self.create_product('phone')
+        etag = self.listing()['ETag']
+        self.assertEqual(self.listing(if_none_match=etag).status_code, 304)
+
+        phone.title = 'Новый телефон'
+        phone.save()
+        response = self.listing(if_none_match=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertIn('Новый телефон', response.content.decode())
+
+    # Страница товара зависит и от похожих товаров, показанных на ней
+    def test_product_page_follows_related_products(self):
+        phone = self.create_product('phone')
+        other = self.create_product('other')
+        self.assertIn('Товар other', self.client.get(phone.get_absolute_url()).content.decode())
+
+        other.title = 'Другой телефон'
+        other.save()
+        self.assertIn('Другой телефон', self.client.get(phone.get_absolute_url()).content.decode())
+
+    def test_evicted_dependency_version_is_a_miss(self):
+        phone = self.create_product('phone')
+        other = self.create_product('other')
+        self.client.get(phone.get_absolute_url())
+
+        Product.objects.filter(pk=other.pk).update(title='Другой телефон', updated_at=Now())
+        cache.delete('page_product:other:version')
+        self.assertIn('Другой телефон', self.client.get(phone.get_absolute_url()).content.decode())
+
+
+# Индексы под горячие запросы: избранное и строки корзины ищутся по уникальной паре
+class StorefrontIndexTests(CatalogTestCase):
+    def test_favorite_and_cart_pairs_are_unique(self):
+        phone = self.create_product('phone', quantity=1)
+        FavoriteProduct.objects.create(user=self.user, product=phone)
+        self.add_line(phone, 1)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            FavoriteProduct.objects.create(user=self.user, product=phone)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            self.add_line(phone, 1)
+
+    def test_pair_lookups_are_index_seeks(self):
+        self.create_product('phone')
+        queries = hot_queries()
+        for name, table in (('favorite_toggle', 'digital_favoriteproduct'),
+                            ('cart_line_lookup', 'digital_productcart'),
+                            ('product_by_slug', 'digital_product')):
+            with self.subTest(name):
+                self.assertTrue(any(f'SEARCH {table} USING' in line for line in explain(queries[name])))
+
+    def test_unknown_query_name_is_rejected(self):
+        with self.assertRaisesMessage(CommandError, 'cart_scan'):
+            call_command('explain_queries', 'cart_scan', stdout=StringIO())
+
+
+# Хранимые цены со скидкой и в месяц: считаются в save(), после записи в обход save() — recompute_prices
+class StoredPriceTests(CatalogTestCase):
+    def test_save_keeps_prices_in_sync(self):
+        phone = self.create_product('phone', price=999, discount=15)
+        self.assertEqual((phone.final_price, phone.monthly_price), (850, 70))
+        phone.discount = 0
+        phone.save(update_fields=['discount'])
+        self.assertEqual(Product.objects.values_list('final_price', 'monthly_price').get(pk=phone.pk), (999, 83))
+
+    def test_recompute_prices_fixes_bulk_updates(self):
+        phone = self.create_product('phone', price=999, discount=15)
+        case = self.create_product('case', price=100)
+        Product.objects.filter(pk=phone.pk).update(price=1999)
+
+        self.assertEqual(Product.objects.recompute_prices(), 1)
+        self.assertEqual(Product.objects.recompute_prices(), 0)
+        phone.refresh_from_db()
+        expected = Product(price=1999, discount=15)
+        expected.compute_prices()
+        self.assertEqual((phone.final_price, phone.monthly_price), (expected.final_price, expected.monthly_price))
+        self.assertEqual(Product.objects.get(pk=case.pk).final_price, 100)
+
+    def test_command_resets_cached_pages(self):
+        phone = self.create_product('phone', price=500)
+        self.assertContains(self.client.get(phone.get_absolute_url()), '500$')
+        Product.objects.filter(pk=phone.pk).update(price=700)
+
+        out = StringIO()
+        call_command('recompute_prices', stdout=out)
+        self.assertIn('Исправлено товаров: 1', out.getvalue())
+        self.assertContains(self.client.get(phone.get_absolute_url()), '700$')
+
+    def test_cart_totals_use_discounted_price(self):
+        phone = self.create_product('phone', price=1000, discount=20, quantity=5)
+        self.add_line(phone, 2)
+        self.assertEqual(self.user_cart().get_cart_info()['cart_price'], 1600)
+
+
+# Раздел каталога товара (root_category) — копия родителя подкатегории, по ней строится листинг
+class RootCategoryTests(CatalogTestCase):
+    def test_follows_category_and_its_parent(self):
+        phone = self.create_product('phone')
+        self.assertEqual(phone.root_category, self.category.parent)
+
+        tablets = Category.objects.create(title='Планшеты', slug='tablets')
+        ipad = Category.objects.create(title='iPad', slug='ipad', parent=tablets)
+        phone.category = ipad
+        phone.save(update_fields=['category'])
+        self.assertEqual(Product.objects.get(pk=phone.pk).root_category, tablets)
+
+        ipad.parent = self.category.parent
+        ipad.save()
+        self.assertEqual(Product.objects.get(pk=phone.pk).root_category, self.category.parent)
+        self.assertEqual([p.slug for p in category_products(self.category.parent)], ['phone'])
+
+    def test_import_moves_products_with_category(self):
+        self.create_product('phone')
+        rows = [{'type': 'category', 'slug': 'tablets', 'title': 'Планшеты'},
+                {'type': 'category', 'slug': 'apple', 'title': 'Apple', 'parent': 'tablets'},
+                {'type': 'product', 'slug': 'ipad', 'title': 'iPad', 'category': 'apple', 'model': 'iphone'}]
+        import_rows(rows, reindex=False)
+        self.assertEqual(set(Product.objects.values_list('slug', 'root_category__slug')),
+                         {('phone', 'tablets'), ('ipad', 'tablets')})
+
+    def test_hot_queries_do_not_scan_tables(self):
+        for i in range(3):
+            self.create_product(f'phone-{i}')
+        call_command('explain_queries', '--fail-on-scan', stdout=StringIO())
+
+
+class CatalogImportTests(CatalogTestCase):
+    def test_broken_jsonl_lines_are_reported(self):
+        lines = [
+            '{"type": "model", "slug": "galaxy", "title": "Galaxy"}',
+            '{"type": "model", "slug": "pixel", ',
+            '[1, 2]',
+            '"model"',
+            '{"type": "product", "slug": "s24", "title": "S24", "category": "apple", "model": "galaxy", "price": "900"}',
+        ]
+        importer = import_rows(read_rows(StringIO('\n'.join(lines)), 'jsonl'), reindex=False)
+
+        self.assertEqual((importer.counts['model'], importer.counts['product']), (1, 1))
+        self.assertEqual([error.split(':')[0] for error in importer.errors], ['строка 2', 'строка 3', 'строка 4'])
+        self.assertIn('неверный JSON', importer.errors[0])
+        self.assertEqual(Product.objects.get(slug='s24').model.slug, 'galaxy')
+
+    # Выгрузка, загруженная обратно, возвращает каталог к выгруженному состоянию
+    def test_export_import_round_trip(self):
+        phone = self.create_product('phone', price=1000, discount=10, quantity=3, guarantee=12,
+                                    color_name='Чёрный', color_code='#000000', image='products/phone.png')
+        self.create_product('case', price=50)
+        characteristic = Characteristic.objects.create(name='Память')
+        ProductCharacteristic.objects.create(product=phone, characteristic=characteristic, value='128 ГБ')
+        exported = list(export_rows())
+
+        for fmt in ('csv', 'jsonl'):
+            with self.subTest(fmt):
+                f = StringIO()
+                writer = RowWriter(f, fmt)
+                for row in exported:
+                    writer.write(row)
+                Product.objects.update(title='Старое', price=1, discount=0, quantity=0, color_name='Белый', image='')
+                ProductCharacteristic.objects.update(value='64 ГБ')
+
+                f.seek(0)
+                importer = import_rows(read_rows(f, fmt), reindex=False)
+                self.assertEqual(importer.errors, [])
+                self.assertEqual(list(export_rows()), exported)
+                self.assertEqual(Product.objects.get(slug='phone').final_price, 900)
+
+    # Строка с частью колонок меняет только их, цена со скидкой считается от сохранённой скидки
+    def test_missing_columns_keep_stored_values(self):
+        self.create_product('phone', price=1000, discount=10, quantity=3, color_name='Чёрный')
+        import_rows([{'type': 'product', 'slug': 'phone', 'title': 'Телефон', 'category': 'apple', 'model': 'iphone',
+                      'price': '2000'}], reindex=False)
+        phone = Product.objects.get(slug='phone')
+        self.assertEqual((phone.title, phone.price, phone.discount, phone.quantity, phone.color_name),
+                         ('Телефон', 2000, 10, 3, 'Чёрный'))
+        self.assertEqual(phone.final_price, 1800)
+
+    def test_new_images_are_queued_for_derivatives(self):
+        self.create_product('phone', image='products/phone.png')
+        Task.objects.all().delete()
+        rows = [{'type': 'product', 'slug': slug, 'title': slug, 'category': 'apple', 'model': 'iphone',
+                 'image': f'products/{image}.png'} for slug, image in (('phone', 'phone'), ('case', 'case'))]
+        import_rows(rows, reindex=False)
+        self.assertEqual(list(Task.objects.values_list('idempotency_key', flat=True)), ['image:products/case.png'])
+
+
+# Отчёты по заказам: данные покупателей не становятся формулами, итоги считает SQL
+class ReportTests(CatalogTestCase):
+    XLSX_NS = {'x': 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'}
+
+    def setUp(self):
+        super().setUp()
+        phone = self.create_product('phone', price=1000, quantity=10)
+        Product.objects.filter(pk=phone.pk).update(title='=HYPERLINK("http://example.com")')
+        for quantity in (2, 1):
+            self.add_line(phone, quantity)
+            delivery = self.delivery()
+            delivery.address = '@SUM(A1)'
+            self.user_cart().place_order(delivery, completed=True)
+
+    def test_csv_escapes_formulas(self):
+        content = ''.join(reports.report_chunks(*reports.order_lines(), 'csv'))
+        self.assertTrue(content.startswith('\ufeff'))
+        header, *rows = csv.reader(StringIO(content[1:]))
+        self.assertEqual(header, [title for _, title in reports.ORDER_LINE_FIELDS])
+        line = dict(zip(header, rows[0]))
+        self.assertEqual(line['Товар'], '\'=HYPERLINK("http://example.com")')
+        self.assertEqual(line['Адрес'], "'@SUM(A1)")
+        self.assertEqual((line['Количество'], line['Сумма']), ('2', '2000'))
+        self.assertEqual(len(rows), 2)
+
+    def test_xlsx_opens_with_text_and_numbers(self):
+        data = b''.join(reports.report_chunks(*reports.order_lines(), 'xlsx'))
+        with zipfile.ZipFile(BytesIO(data)) as archive:
+            self.assertIsNone(archive.testzip())
+            sheet = ElementTree.fromstring(archive.read('xl/worksheets/sheet1.xml'))
+        rows = [[cell.findtext('x:is/x:t', namespaces=self.XLSX_NS) or cell.findtext('x:v', namespaces=self.XLSX_NS)
+                 for cell in row] for row in sheet.iterfind('x:sheetData/x:row', self.XLSX_NS)]
+        line = dict(zip(rows[0], rows[1]))
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(line['Товар'], '\'=HYPERLINK("http://example.com")')
+        self.assertEqual(line['Адрес'], "'@SUM(A1)")
+        self.assertEqual((line['Количество'], line['Сумма']), ('2', '2000'))
+
+    def test_totals_are_grouped_in_sql(self):
+        header, rows = reports.daily_revenue()
+        with self.assertNumQueries(1):
+            days = list(rows)
+        self.assertEqual(header, ['День', 'Заказов', 'Выручка'])
+        self.assertEqual([day[1:] for day in days], [[2, 3000]])
+
+        header, rows = reports.product_units()
+        with self.assertNumQueries(1):
+            self.assertEqual(list(rows), [('phone', '=HYPERLINK("http://example.com")', 2, 3, 3000)])
+
+
+# Профиль SQLite из settings.py: прагмы на каждом соединении, соединения переживают запрос
+class DatabaseProfileTests(TestCase):
+    def test_sqlite_pragmas_are_applied(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('профиль SQLite')
+        with connection.cursor() as cursor:
+            values = {}
+            for pragma in ('synchronous', 'cache_size', 'temp_store'):
+                cursor.execute(f'PRAGMA {pragma}')
+                values[pragma] = cursor.fetchone()[0]
+        self.assertEqual(values, {'synchronous': 1, 'cache_size': -65536, 'temp_store': 2})
+        self.assertEqual(connection.settings_dict['OPTIONS']['transaction_mode'], 'IMMEDIATE')
+        self.assertGreater(connection.settings_dict['CONN_MAX_AGE'], 0)
+
+
+# Нагрузочный замер корзины (benchmark --cart-load) в минимальном объёме: оба профиля пишут без ошибок
+@override_settings(CACHES=BENCHMARK_CACHES)
+class CartWriteLoadTests(TransactionTestCase):
+    def test_profiles_write_without_errors(self):
+        benchmark.seed_catalog(products=20)
+        results = benchmark.cart_write_load(threads=(1,), operations=3)
+        self.assertEqual([(r.name.split()[1], r.requests, r.errors) for r in results],
+                         [('baseline', 6, 0), ('configured', 6, 0)])
+
+
+# Бюджет SQL-запросов страниц (benchmark_budget.json) — тот же замер, что manage.py benchmark --queries-only.
+# Бюджет записан для синхронных страниц (digital/urls.py), даже если включены ASYNC_VIEWS.
+# TransactionTestCase: в обёртке TestCase вложенные atomic добавили бы в замер запросы SAVEPOINT
+@override_settings(CACHES=BENCHMARK_CACHES, ROOT_URLCONF='digital.urls')
+class QueryBudgetTests(TransactionTestCase):
+    def test_pages_fit_query_budget(self):
+        results = benchmark.run_scenarios(benchmark.seed_catalog(products=200))
+        budget = benchmark.load_budget(DEFAULT_BUDGET)
+        for result in results:
+            with self.subTest(result.name):
+                self.assertIn(result.name, budget)
+                self.assertLess(result.status, 400)
+                self.assertEqual(benchmark.check_budget([result], budget, ('queries',)), [])
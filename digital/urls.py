@@ -18,6 +18,7 @@ urlpatterns = [
     path('checkout/', checkout_view, name='checkout'),
     path('payment/', create_checkout_session, name='payment'),
     path('success/', success_payment, name='success'),
+    path('stripe/webhook/', stripe_webhook, name='stripe_webhook'),
     path('profile/', profile_customer_view, name='profile'),
     path('edit_profile/', edit_profile_view, name='edit_profile'),
     path('search/', search_products, name='search'),
@@ -1,83 +1,327 @@
-from .models import Cart, ProductCart, Product, Customer, Order, ProductOrder
+import json
+import time
+from collections import defaultdict
+from datetime import datetime, timezone as dt_timezone
+from types import SimpleNamespace
+
+from django.core.signing import BadSignature
+
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Cart, ProductCart, Product, Customer, Order, ProductOrder, FavoriteProduct
+from .pagecache import invalidate_stock_pages
+
+
+def cart_summary(cart, products_cart):
+    return {
+        'cart': cart,
+        'products_cart': products_cart,
+        'cart_price': sum(i.total_price for i in products_cart),
+        'cart_quantity': sum(i.quantity for i in products_cart),
+        'customer': cart.customer if cart else None
+    }
+
+
+class OutOfStockError(Exception):
+    def __init__(self, product_id):
+        super().__init__(f'Недостаточно товара на складе: {product_id}')
+        self.product_id = product_id
+
+
+# Строка оплаченной корзины (Payment.lines): цена — та, что была при оплате
+class PaidCartLine:
+    def __init__(self, product, quantity, unit_price):
+        self.product = product
+        self.product_id = product.pk
+        self.quantity = quantity
+        self.unit_price = unit_price
+        self.total_price = unit_price * quantity
 
 
 class CartForAuthenticatedUser:
-    def __init__(self, request, slug=None, action=None):
-        self.user = request.user
+    # Без запроса (вебхук оплаты) нужен user, сводка корзины тогда кэшируется на самом объекте
+    def __init__(self, request, slug=None, action=None, user=None):
+        self.request = request if request is not None else SimpleNamespace()
+        self.user = user or request.user
         if action:
             self.add_or_delete(slug, action)
 
+    # Сводка корзины: строки с ценами и итоги за один запрос, кэшируется на время запроса
     def get_cart_info(self):
-        customer = Customer.objects.get(user=self.user)
-        cart = Cart.objects.get(customer=customer)
-        products_cart = cart.productcart_set.all()
-        return {
-            'cart': cart,
-            'products_cart': products_cart,
-            'cart_price': cart.cart_total_price,
-            'cart_quantity': cart.cart_total_quantity,
-            'customer': customer
-        }
+        if not hasattr(self.request, '_cart_info'):
+            cart = Cart.objects.select_related('customer').get(customer__user=self.user)
+            products_cart = list(cart.productcart_set.with_prices().select_related('product').order_by('pk'))
+            self.request._cart_info = cart_summary(cart, products_cart)
+        return self.request._cart_info
 
-    def add_or_delete(self, slug, action):
-        cart = self.get_cart_info()['cart']
+    async def aget_cart_info(self):
+        if not hasattr(self.request, '_cart_info'):
+            cart = await Cart.objects.select_related('customer').aget(customer__user=self.user)
+            products_cart = [i async for i in cart.productcart_set.with_prices().select_related('product')
+                             .order_by('pk')]
+            self.request._cart_info = cart_summary(cart, products_cart)
+        return self.request._cart_info
 
-        if action == 'clear' and slug is None:
-            cart.productcart_set.all().delete()
-            return
+    def reset_cart_info(self):
+        self.request.__dict__.pop('_cart_info', None)
 
-        product = Product.objects.get(slug=slug)
-        product_cart, created = ProductCart.objects.get_or_create(cart=cart, product=product)
+    # Сводка по строкам, сохранённым при оплате (Payment.lines): количество и цена — оплаченные,
+    # корзина — только для привязки заказа. Удалённый с тех пор товар оформить нельзя
+    def paid_cart_info(self, lines):
+        cart = Cart.objects.select_related('customer').get(customer__user=self.user)
+        products = Product.objects.in_bulk([line['product'] for line in lines])
+        products_cart = []
+        for line in lines:
+            if line['product'] not in products:
+                raise OutOfStockError(line['product'])
+            products_cart.append(PaidCartLine(products[line['product']], line['quantity'], line['price']))
+        return cart_summary(cart, products_cart)
 
-        if action == 'add' and product.quantity > 0 and product_cart.quantity < product.quantity:
-            product_cart.quantity += 1
-        elif action == 'delete':
-            product_cart.quantity -= 1
-        elif action == 'clear':
-            product_cart.quantity = 0
+    # Изменение строки корзины одним условным SQL-запросом (без чтения корзины и товара).
+    # Возвращает новое количество товара в корзине, 0 — строка удалена, None — ничего не изменилось
+    # (нет товара на складе, достигнут остаток или строки не было)
+    def add_or_delete(self, slug, action):
+        if action == 'clear' and slug is None:
+            ProductCart.objects.filter(cart__customer__user=self.user).delete()
+            self.reset_cart_info()
+            self.line_quantity = 0
+            return self.line_quantity
 
-        product_cart.save()
+        product_cart = ProductCart._meta.db_table
+        product = Product._meta.db_table
+        cart_sql = f'SELECT c.id FROM {Cart._meta.db_table} c ' \
+                   f'JOIN {Customer._meta.db_table} cu ON cu.id = c.customer_id WHERE cu.user_id = %s'
+        line_sql = f'cart_id = ({cart_sql}) AND product_id = (SELECT id FROM {product} WHERE slug = %s)'
+        now = connection.ops.adapt_datetimefield_value(timezone.now())
 
-        if product_cart.quantity <= 0:
-            product_cart.delete()
+        with connection.cursor() as cursor:
+            if action == 'add':
+                # Вставка первой строки или +1, пока в корзине меньше, чем на складе
+                cursor.execute(
+                    f'INSERT INTO {product_cart} (cart_id, product_id, quantity, added_at, updated_at) '
+                    f'SELECT ({cart_sql}), p.id, 1, %s, %s FROM {product} p WHERE p.slug = %s AND p.quantity > 0 '
+                    f'ON CONFLICT (cart_id, product_id) DO UPDATE '
+                    f'SET quantity = {product_cart}.quantity + 1, updated_at = excluded.updated_at '
+                    f'WHERE {product_cart}.quantity < (SELECT quantity FROM {product} WHERE id = excluded.product_id) '
+                    f'RETURNING quantity',
+                    [self.user.pk, now, now, slug]
+                )
+                row = cursor.fetchone()
+            elif action == 'delete':
+                # -1, пока единиц больше одной, иначе удаляем строку. Оба запроса условные: при двух
+                # одновременных удалениях с количеством 2 второй UPDATE уже не пройдёт и удалит строку,
+                # строка с нулевым количеством не остаётся
+                cursor.execute(f'UPDATE {product_cart} SET quantity = quantity - 1, updated_at = %s '
+                               f'WHERE {line_sql} AND quantity > 1 RETURNING quantity',
+                               [now, self.user.pk, slug])
+                row = cursor.fetchone()
+                if row is None:
+                    cursor.execute(f'DELETE FROM {product_cart} WHERE {line_sql} AND quantity <= 1 RETURNING 0',
+                                   [self.user.pk, slug])
+                    row = cursor.fetchone()
+            elif action == 'clear':
+                cursor.execute(f'DELETE FROM {product_cart} WHERE {line_sql} RETURNING 0', [self.user.pk, slug])
+                row = cursor.fetchone()
+            else:
+                row = None
 
-    def save_order(self, delivery):
-        """✅ ДОБАВЛЕН СВЕТ!"""
-        data = self.get_cart_info()
-        order = Order.objects.create(
-            customer=data['customer'],
-            delivery=delivery,
-            price=data['cart_price'],
-            cart=data['cart']
-        )
-        order.save()
+        self.reset_cart_info()
+        self.line_quantity = row[0] if row else None
+        return self.line_quantity
 
+    # Заказ, строки заказа и списание остатков одной транзакцией. data — сводка корзины
+    # (get_cart_info или paid_cart_info), по умолчанию текущая
+    def save_order(self, delivery, completed=False, data=None):
+        if data is None:
+            data = self.get_cart_info()
+        quantities = defaultdict(int)
         for p_cart in data['products_cart']:
-            ProductOrder.objects.create(
-                order=order,
-                name=p_cart.product.title,
-                slug=p_cart.product.slug,
-                price=p_cart.product.get_price(),
-                photo=p_cart.product.image,
-                color_name=p_cart.product.color_name,
-                quantity=p_cart.quantity,
-                total_price=p_cart.quantity * p_cart.product.get_price()
+            quantities[p_cart.product_id] += p_cart.quantity
+
+        # updated_at меняется вместе с остатком: от него считается Last-Modified страниц каталога.
+        # Кэш страниц с этими товарами сбрасывается после коммита, иначе его успеет заполнить старый остаток
+        with transaction.atomic():
+            for product_id in sorted(quantities):
+                updated = Product.objects.filter(pk=product_id, quantity__gte=quantities[product_id]) \
+                    .update(quantity=F('quantity') - quantities[product_id],
+                            sales_count=F('sales_count') + quantities[product_id], updated_at=timezone.now())
+                if not updated:
+                    raise OutOfStockError(product_id)
+            transaction.on_commit(lambda: invalidate_stock_pages(list(quantities)))
+
+            order = Order.objects.create(
+                customer=data['customer'],
+                delivery=delivery,
+                price=data['cart_price'],
+                cart=data['cart'],
+                completed=completed
             )
+            ProductOrder.objects.bulk_create([
+                ProductOrder(
+                    order=order,
+                    name=p_cart.product.title,
+                    slug=p_cart.product.slug,
+                    price=p_cart.unit_price,
+                    photo=p_cart.product.image,
+                    color_name=p_cart.product.color_name,
+                    quantity=p_cart.quantity,
+                    total_price=p_cart.total_price
+                ) for p_cart in data['products_cart']
+            ])
         return order
 
-    def clear_cart(self):
-        cart = self.get_cart_info()['cart']
-        products_cart = cart.productcart_set.all()
-        for p_cart in products_cart:
-            product = p_cart.product
-            product.quantity -= p_cart.quantity
-            product.save()
-            p_cart.delete()
-        cart.save()
+    # Без data — вся корзина. С data (оплаченные строки) — только оплаченные товары:
+    # добавленное в корзину после оплаты остаётся в ней
+    def clear_cart(self, data=None):
+        if data is None:
+            ProductCart.objects.filter(cart=self.get_cart_info()['cart']).delete()
+        else:
+            ProductCart.objects.filter(cart=data['cart'],
+                                       product_id__in=[line.product_id for line in data['products_cart']]).delete()
+        self.reset_cart_info()
 
+    # Оформление заказа целиком: либо всё, либо ничего. Сводка корзины читается заново:
+    # закэшированная раньше в этом запросе могла устареть. data — как в save_order
+    def place_order(self, delivery, completed=False, data=None):
+        self.reset_cart_info()
+        with transaction.atomic():
+            delivery.save()
+            order = self.save_order(delivery, completed, data)
+            self.clear_cart(data)
+        return order
 
-def cart_info(request):
+
+# Корзина гостя хранится в подписанной cookie: {id товара: [количество, время добавления]}.
+# До входа в аккаунт в БД ничего не пишется
+CART_COOKIE = 'cart'
+CART_COOKIE_SALT = 'digital.cart'
+CART_COOKIE_MAX_AGE = 60 * 60 * 24 * 30
+CART_COOKIE_MAX_LINES = 50
+
+
+class AnonymousCartLine:
+    def __init__(self, product, quantity, added_at):
+        self.product = product
+        self.product_id = product.pk
+        self.quantity = quantity
+        self.added_at = added_at
+        self.unit_price = product.final_price
+        self.total_price = self.unit_price * quantity
+
+
+class CartForAnonymousUser:
+    def __init__(self, request, slug=None, action=None):
+        self.request = request
+        self.lines = self.load()
+        self.changed = False
+        self.line_quantity = None
+        if action:
+            self.add_or_delete(slug, action)
+
+    def load(self):
+        try:
+            data = json.loads(self.request.get_signed_cookie(CART_COOKIE, salt=CART_COOKIE_SALT))
+            return {int(product_id): [int(quantity), int(added_at)] for product_id, (quantity, added_at) in data.items()}
+        except (KeyError, ValueError, TypeError, AttributeError, BadSignature):
+            return {}
+
+    def save(self, response):
+        if not self.changed:
+            return
+        if self.lines:
+            response.set_signed_cookie(CART_COOKIE, json.dumps(self.lines), salt=CART_COOKIE_SALT,
+                                       max_age=CART_COOKIE_MAX_AGE, httponly=True, samesite='Lax')
+        else:
+            response.delete_cookie(CART_COOKIE)
+
+    def add_or_delete(self, slug, action):
+        self.changed = True
+        if action == 'clear' and slug is None:
+            self.lines = {}
+            self.line_quantity = 0
+            return self.line_quantity
+
+        product = Product.objects.filter(slug=slug).values('pk', 'quantity').first()
+        if product is None:
+            return self.line_quantity
+        quantity, added_at = self.lines.get(product['pk'], [0, int(time.time())])
+
+        if action == 'add':
+            if quantity >= product['quantity'] or (not quantity and len(self.lines) >= CART_COOKIE_MAX_LINES):
+                return self.line_quantity
+            quantity += 1
+        elif action == 'delete' and quantity:
+            quantity -= 1
+        elif action == 'clear':
+            quantity = 0
+
+        if quantity > 0:
+            self.lines[product['pk']] = [quantity, added_at]
+        else:
+            self.lines.pop(product['pk'], None)
+        self.request.__dict__.pop('_cart_info', None)
+        self.line_quantity = quantity
+        return self.line_quantity
+
+    def get_cart_info(self):
+        if not hasattr(self.request, '_cart_info'):
+            products = Product.objects.in_bulk(list(self.lines))
+            self.request._cart_info = cart_summary(None, self._lines(products))
+        return self.request._cart_info
+
+    async def aget_cart_info(self):
+        if not hasattr(self.request, '_cart_info'):
+            products = await Product.objects.ain_bulk(list(self.lines))
+            self.request._cart_info = cart_summary(None, self._lines(products))
+        return self.request._cart_info
+
+    def _lines(self, products):
+        return [AnonymousCartLine(products[product_id], quantity, datetime.fromtimestamp(added_at, tz=dt_timezone.utc))
+                for product_id, (quantity, added_at) in self.lines.items() if product_id in products]
+
+
+# Перенос корзины гостя в корзину пользователя после входа: одна пакетная вставка с обновлением
+def merge_anonymous_cart(request, response):
+    anonymous = CartForAnonymousUser(request)
+    if not anonymous.lines:
+        return
+    cart = Cart.objects.filter(customer__user=request.user).first()
+    if cart is not None:
+        ids = list(anonymous.lines)
+        stock = dict(Product.objects.filter(pk__in=ids).values_list('pk', 'quantity'))
+        in_cart = dict(ProductCart.objects.filter(cart=cart, product_id__in=ids).values_list('product_id', 'quantity'))
+        lines = [ProductCart(cart=cart, product_id=product_id,
+                             quantity=min(in_cart.get(product_id, 0) + quantity, stock[product_id]))
+                 for product_id, (quantity, _) in anonymous.lines.items() if stock.get(product_id, 0) > 0]
+        ProductCart.objects.bulk_create(lines, update_conflicts=True, unique_fields=['cart', 'product'],
+                                        update_fields=['quantity', 'updated_at'])
+    response.delete_cookie(CART_COOKIE)
+
+
+def get_cart(request, slug=None, action=None):
     if request.user.is_authenticated:
-        cart = CartForAuthenticatedUser(request)
-        return cart.get_cart_info()
-    return {'cart_price': 0, 'cart_quantity': 0, 'products_cart': []}
+        return CartForAuthenticatedUser(request, slug, action)
+    return CartForAnonymousUser(request, slug, action)
+
+
+def cart_info(request):
+    return get_cart(request).get_cart_info()
+
+
+async def acart_info(request):
+    user = await request.auser()
+    if user.is_authenticated:
+        return await CartForAuthenticatedUser(request, user=user).aget_cart_info()
+    return await CartForAnonymousUser(request).aget_cart_info()
+
+
+# Множество id избранных товаров, загружается один раз за запрос
+def get_favorite_ids(request):
+    if not request.user.is_authenticated:
+        return set()
+    if not hasattr(request, '_favorite_ids'):
+        request._favorite_ids = set(FavoriteProduct.objects.filter(user=request.user)
+                                    .values_list('product_id', flat=True))
+    return request._favorite_ids
@@ -1,42 +1,64 @@
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.forms import PasswordChangeForm
+from django.core.paginator import Paginator
+from django.db.models import F, Prefetch
+from django.http import HttpResponse
 from django.shortcuts import redirect, render
+from django.utils.decorators import method_decorator
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 from django.views.generic import ListView, DetailView
 from .models import *
 from .forms import LoginForm, RegisterForm, DeliveryForm, EditAccountForm, EditCustomerForm
 from django.contrib.auth import login, logout
 from django.contrib import messages
 
-from .tests import filter_products
+from .facets import ProductFacets
 from django.contrib.auth.mixins import LoginRequiredMixin
-from .utils import CartForAuthenticatedUser, cart_info
+from .catalog import category_products, get_related_products, get_showcase
+from .pagecache import category_page_cache, main_page_cache, product_page_cache
+from .pagination import CursorPaginationMixin
+from .payments import checkout_params, create_payment, get_gateway, handle_event
+from .search import SearchResults
+from .sorting import RELEVANCE_SORT, get_sort, sort_choices, sort_ordering
+from .utils import cart_info, get_cart, get_favorite_ids, merge_anonymous_cart
 import stripe
-from store.settings import STRIPE_SECRET_KEY
+
+SEARCH_PAGE_SIZE = 12
+SAME_MODELS_LIMIT = 20
 
 
 # Главная страница
+@method_decorator(main_page_cache, name='dispatch')
 class MainPage(ListView):
-    model = Category
-    context_object_name = 'categories'
+    model = Product
+    context_object_name = 'products'
     template_name = 'digital/index.html'
     extra_context = {'title': 'Digital Market'}
 
     def get_queryset(self):
-        categories = Category.objects.filter(parent=None)
-        return categories
+        products = get_showcase()
+        return products
 
 
 # Страница 	карточки товара
+@method_decorator(product_page_cache, name='dispatch')
 class ProductDetail(DetailView):
     model = Product
     context_object_name = 'product'
 
+    def get_queryset(self):
+        characteristics = ProductCharacteristic.objects.select_related('characteristic')
+        return Product.objects.select_related('category__parent', 'model') \
+            .prefetch_related(Prefetch('product_characteristics', queryset=characteristics))
+
     def get_context_data(self, **kwargs):
         context = super(ProductDetail, self).get_context_data()
         product = context['product']
         context['title'] = product.title
-        context['same_models'] = Product.objects.filter(model=product.model)
-        context['same_products'] = Product.objects.filter(category__parent=product.category.parent).exclude(pk=product.pk)
+        context['same_models'] = Product.objects.filter(model=product.model_id) \
+            .only('slug', 'color_code').order_by('pk')[:SAME_MODELS_LIMIT]
+        context['same_products'] = get_related_products(product)
         return context
 
 
@@ -84,7 +106,9 @@ def login_user_view(request):
                 if user:
                     login(request, user)
                     messages.success(request, 'Авторизация прошла успешно')
-                    return redirect('main')
+                    response = redirect('main')
+                    merge_anonymous_cart(request, response)
+                    return response
             messages.error(request, 'Не верный логин или пароль')
             return redirect('auth')
     else:
@@ -120,34 +144,38 @@ def register_user_view(request):
             else:
                 for err in form.errors:
                     messages.error(request, form.errors[err].as_text())
-        return redirect('auth')
+        response = redirect('auth')
+        if request.user.is_authenticated:
+            merge_anonymous_cart(request, response)
+        return response
     else:
         return redirect('main')
 
 
 
 # Страница товаров в категорие
-class ProductByCategory(ListView):
+@method_decorator(category_page_cache, name='dispatch')
+class ProductByCategory(CursorPaginationMixin, ListView):
     model = Product
     context_object_name = 'products'
     template_name = 'digital/category.html'
     paginate_by = 3
 
     def get_queryset(self):
-        category = Category.objects.get(slug=self.kwargs['slug'])
-        products = Product.objects.filter(category__in=category.subcategories.all())
-        products = filter_products(self.request, products)
-        return products
+        self.category = Category.objects.get(slug=self.kwargs['slug'])
+        self.facets = ProductFacets(self.request.GET, category_products(self.category))
+        self.sort = get_sort(self.request.GET)
+        return self.facets.queryset.order_by(*sort_ordering(self.sort))
+
+    def get_cursor_ordering(self):
+        return sort_ordering(self.sort)
 
     def get_context_data(self, *, object_list=None, **kwargs):
         context = super(ProductByCategory, self).get_context_data()
-        category = Category.objects.get(slug=self.kwargs['slug'])
-        context['title'] = category.title
-        context['subcats'] = category.subcategories.all()
-        context['prices'] = [i for i in range(500, 100001, 500)]
-        products = Product.objects.filter(category__slug=self.request.GET.get('cat'))
-        context['models'] = set([i.model for i in products])
-
+        context['title'] = self.category.title
+        context['sort'] = self.sort
+        context['sort_choices'] = sort_choices()
+        context.update(self.facets.sidebar_context(self.category))
         return context
 
 
@@ -156,14 +184,15 @@ class ProductByCategory(ListView):
 def save_favorite_product(request, slug):
     user = request.user
     product = Product.objects.get(slug=slug)
-    favorites = FavoriteProduct.objects.filter(user=user)
+    favorite_ids = get_favorite_ids(request)
 
-    if product in [i.product for i in favorites]:
-        fav = FavoriteProduct.objects.get(user=user, product=product)
-        fav.delete()
+    if product.pk in favorite_ids:
+        FavoriteProduct.objects.filter(user=user, product=product).delete()
+        favorite_ids.discard(product.pk)
         messages.success(request, 'Товар удалён из избранного')
     else:
         FavoriteProduct.objects.create(user=user, product=product)
+        favorite_ids.add(product.pk)
         messages.success(request, 'Товар добавлен в избранное')
 
     next_page = request.META.get('HTTP_REFERER', 'main')
@@ -171,38 +200,40 @@ def save_favorite_product(request, slug):
 
 
 # Список избранного
-class FavoriteList(LoginRequiredMixin, ListView):
+class FavoriteList(LoginRequiredMixin, CursorPaginationMixin, ListView):
     model = FavoriteProduct
     context_object_name = 'products'
     template_name = 'digital/product_list.html'
     extra_context = {'title': 'Избранные товары'}
     paginate_by = 3
     login_url = 'auth'
+    cursor_ordering = ('favorited_at', 'pk')
 
     def get_queryset(self):
-        products = FavoriteProduct.objects.filter(user=self.request.user)
-        products = [i.product for i in products]
+        products = Product.objects.filter(favoriteproduct__user=self.request.user) \
+            .annotate(favorited_at=F('favoriteproduct__created_at')).order_by('favorited_at', 'pk')
         return products
 
 
 # Страница добавление и удаление товара в корзину
-@login_required(login_url='auth')
 def add_or_delete_view(request, slug, action):
-    result = CartForAuthenticatedUser(request, slug, action)
+    result = get_cart(request, slug, action)
 
-    if action == 'add':
-        product = Product.objects.get(slug=slug)
+    if action == 'add' and result.line_quantity is None:
+        messages.error(request, 'Товара нет в нужном количестве')
+    elif action == 'add':
         messages.success(request, 'Продукт добавлен в корзину')
     elif action == 'delete':
-        product = Product.objects.get(slug=slug)
         messages.success(request, 'Продукт удалён из корзины')
 
     next_page = request.META.get('HTTP_REFERER', 'main')
-    return redirect(next_page)
+    response = redirect(next_page)
+    if not request.user.is_authenticated:
+        result.save(response)
+    return response
 
 
 # Страница корзины
-@login_required(login_url='auth')
 def my_cart_view(request):
     cart = cart_info(request)
     context = {
@@ -215,12 +246,14 @@ def my_cart_view(request):
 
 
 # Очистка корзины
-@login_required(login_url='auth')
 def clear_cart_view(request):
-    CartForAuthenticatedUser(request, slug=None, action='clear')
+    cart = get_cart(request, slug=None, action='clear')
     messages.success(request, 'Корзина успешно очищена')
     next_page = request.META.get('HTTP_REFERER', 'basket')
-    return redirect(next_page)
+    response = redirect(next_page)
+    if not request.user.is_authenticated:
+        cart.save(response)
+    return response
 
 
 # Страница формы доставки
@@ -231,6 +264,7 @@ def checkout_view(request):
         context = {
             'products_cart': cart['products_cart'],
             'cart': cart['cart'],
+            'cart_price': cart['cart_price'],
             'title': 'Оформление заказа',
             'form': DeliveryForm()
         }
@@ -240,63 +274,58 @@ def checkout_view(request):
         return redirect('main')
 
 
-# Страница оплаты
+# Страница оплаты: оплата сохраняется до перехода в Stripe, заказ оформит вебхук
 @login_required(login_url='auth')
 def create_checkout_session(request):
-    stripe.api_key = STRIPE_SECRET_KEY
-    if request.method == 'POST':
-        cart = cart_info(request)
-        price = cart['cart_price']
-        session = stripe.checkout.Session.create(
-            payment_method_types=['card'],
-            line_items=[{
-                'price_data': {
-                    'currency': 'usd',
-                    'product_data': {'name': ',\n'.join(i.product.title for i in cart['products_cart'])},
-                    'unit_amount': int(price) * 100
-                },
-                'quantity': 1
-            }],
-            mode='payment',
-            success_url=request.build_absolute_uri(reverse('success')),
-            cancel_url=request.build_absolute_uri(reverse('checkout'))
-        )
-
-        request.session[f'form_{request.user.pk}'] = request.POST
-        return redirect(session.url)
-
-
-# Страница сохранение оплаты
-@login_required(login_url='auth')
-def success_payment(request):
+    if request.method != 'POST':
+        return redirect('checkout')
     cart = cart_info(request)
-
+    form = DeliveryForm(data=request.POST)
+    if not cart['products_cart'] or not form.is_valid():
+        messages.error(request, 'Ошибка: корзина пуста или неверные данные доставки')
+        return redirect('basket')
+
+    payment = create_payment(cart, form)
+    payment.save()
+    params = checkout_params(cart, payment, request.build_absolute_uri(reverse('success')),
+                             request.build_absolute_uri(reverse('basket')))
     try:
-        form_data = request.session.get(f'form_{request.user.pk}')
-        request.session.pop(f'form_{request.user.pk}')
-    except:
-        form_data = None
+        session = get_gateway().create_checkout_session(params)
+    except stripe.StripeError:
+        Payment.objects.filter(pk=payment.pk).update(status=Payment.FAILED)
+        messages.error(request, 'Платёжный сервис недоступен, попробуйте позже')
+        return redirect('basket')
 
-    if not cart['products_cart'] or not form_data:
-        messages.error(request, 'Ошибка: корзина пуста или данные формы утеряны')
-        return redirect('main')
+    payment.session_id = session.id
+    payment.save(update_fields=['session_id', 'updated_at'])
+    return redirect(session.url)
 
-    ship_form = DeliveryForm(data=form_data)
-    if ship_form.is_valid():
-        delivery = ship_form.save(commit=False)
-        delivery.customer = Customer.objects.get(user=request.user)
-        delivery.save()
 
-        cart_user = CartForAuthenticatedUser(request)
-        cart_user.save_order(delivery)
-        cart_user.clear_cart()
+# Вебхук Stripe: подпись проверяется, заказ оформляется вне перехода покупателя
+@csrf_exempt
+@require_POST
+def stripe_webhook(request):
+    try:
+        event = get_gateway().construct_event(request.body, request.headers.get('Stripe-Signature'))
+    except (ValueError, stripe.SignatureVerificationError):
+        return HttpResponse(status=400)
+    handle_event(event)
+    return HttpResponse(status=200)
 
-        messages.success(request, f'Заказ успешно оплачен и оформлен')
-        context = {'title': 'Успешная оплата', 'order_id': delivery.id}
-        return render(request, 'digital/success.html', context)
-    else:
-        messages.error(request, 'Ошибка в данных доставки. Вернитесь к оформлению')
-        return redirect('checkout')
+
+# Страница после оплаты: показывает состояние оплаты, заказ к этому моменту может ещё оформляться
+@login_required(login_url='auth')
+def success_payment(request):
+    payment = Payment.objects.filter(customer__user=request.user, session_id=request.GET.get('session_id')).first()
+    if payment is None:
+        messages.error(request, 'Ошибка: оплата не найдена')
+        return redirect('main')
+    if payment.status == Payment.FAILED:
+        messages.error(request, 'Ошибка: заказ не оформлен, свяжитесь с нами для возврата оплаты')
+        return redirect('basket')
+
+    context = {'title': 'Успешная оплата', 'payment': payment, 'order_id': payment.order_id}
+    return render(request, 'digital/success.html', context)
 
 
 # Страница профеля покупателя
@@ -343,12 +372,17 @@ def edit_profile_view(request):
 # Страница поиска
 def search_products(request):
     query = request.GET.get('q', '')
-    products = Product.objects.filter(title__icontains=query)
+    sort = get_sort(request.GET, default=RELEVANCE_SORT)
+    paginator = Paginator(SearchResults(query, sort), SEARCH_PAGE_SIZE)
+    page_obj = paginator.get_page(request.GET.get('page'))
 
     context = {
         'title': f'Поиск: {query}',
-        'products': products,
-        'query': query
+        'products': page_obj.object_list,
+        'page_obj': page_obj,
+        'query': query,
+        'sort': sort,
+        'sort_choices': sort_choices([(RELEVANCE_SORT, 'По релевантности')])
     }
     return render(request, 'digital/search.html', context)
 
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -68,6 +69,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'digital.context_processors.favorites',
             ],
         },
     },
@@ -75,15 +77,118 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'store.wsgi.application'
 
+# Stripe: ключи из окружения, STRIPE_API_BASE можно направить на локальный fake_stripe
+STRIPE_SECRET_KEY = os.environ.get('STRIPE_SECRET_KEY', '')
+STRIPE_WEBHOOK_SECRET = os.environ.get('STRIPE_WEBHOOK_SECRET', '')
+STRIPE_API_BASE = os.environ.get('STRIPE_API_BASE', 'https://api.stripe.com')
+STRIPE_TIMEOUT = 10
+STRIPE_MAX_RETRIES = 2
+
+# Фоновые задачи выполняются сразу после коммита, без воркера (разработка, замеры)
+TASKS_EAGER = os.environ.get('TASKS_EAGER') == '1'
+
+# Асинхронные страницы каталога (digital/async_urls.py); store/asgi.py включает их по умолчанию
+ASYNC_VIEWS = os.environ.get('DJANGO_ASYNC_VIEWS') == '1'
+
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# Профиль БД из окружения: DB_ENGINE=sqlite (по умолчанию) или postgres.
+# Соединения живут DB_CONN_MAX_AGE секунд между запросами, а не открываются на каждый запрос
+DB_ENGINE = os.environ.get('DB_ENGINE', 'sqlite')
+DB_CONN_MAX_AGE = int(os.environ.get('DB_CONN_MAX_AGE', 60))
+DB_POOL = os.environ.get('DB_POOL') == '1'
+
+# WAL: чтение не ждёт записи; synchronous=NORMAL в режиме WAL безопасен при падении процесса.
+# mmap и кэш страниц (cache_size в КиБ, со знаком минус) — чтение без лишних системных вызовов
+SQLITE_PRAGMAS = (
+    'PRAGMA journal_mode = WAL; '
+    'PRAGMA synchronous = NORMAL; '
+    'PRAGMA mmap_size = 268435456; '
+    'PRAGMA cache_size = -65536; '
+    'PRAGMA temp_store = MEMORY'
+)
+
+if DB_ENGINE == 'postgres':
+    # Пул соединений Django 5.1+ (нужен psycopg[pool]); с пулом CONN_MAX_AGE должен быть 0 —
+    # соединение возвращается в пул в конце запроса
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DB_NAME', 'store'),
+            'USER': os.environ.get('DB_USER', 'postgres'),
+            'PASSWORD': os.environ.get('DB_PASSWORD', ''),
+            'HOST': os.environ.get('DB_HOST', 'localhost'),
+            'PORT': os.environ.get('DB_PORT', '5432'),
+            'CONN_MAX_AGE': 0 if DB_POOL else DB_CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                'pool': {
+                    'min_size': int(os.environ.get('DB_POOL_MIN_SIZE', 2)),
+                    'max_size': int(os.environ.get('DB_POOL_MAX_SIZE', 10)),
+                    'timeout': 10,
+                },
+            } if DB_POOL else {},
+        }
     }
-}
+else:
+    # timeout — сколько секунд ждать занятую БД (busy timeout). IMMEDIATE: транзакция берёт блокировку
+    # записи сразу, иначе два читателя, начавшие писать, получают "database is locked" без ожидания
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('DB_NAME', BASE_DIR / 'db.sqlite3'),
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+            'OPTIONS': {
+                'timeout': 20,
+                'transaction_mode': 'IMMEDIATE',
+                'init_command': SQLITE_PRAGMAS,
+            },
+        }
+    }
+
+# Реплики для чтения каталога (digital/routers.py): DB_REPLICAS — через запятую файлы SQLite
+# (копии основной БД, обновляются командой sync_replicas) или хосты PostgreSQL с потоковой репликацией
+DATABASE_REPLICAS = []
+for number, replica in enumerate(filter(None, os.environ.get('DB_REPLICAS', '').split(',')), start=1):
+    alias = f'replica{number}'
+    DATABASES[alias] = {**DATABASES['default'], 'TEST': {'MIRROR': 'default'}}
+    if DB_ENGINE == 'postgres':
+        DATABASES[alias]['HOST'] = replica
+    else:
+        DATABASES[alias]['NAME'] = replica
+        DATABASES[alias]['OPTIONS'] = {**DATABASES[alias]['OPTIONS'],
+                                       'init_command': SQLITE_PRAGMAS + '; PRAGMA query_only = ON'}
+    DATABASE_REPLICAS.append(alias)
+
+# Сколько секунд после своей записи пользователь читает только с основной БД (запас на отставание реплик)
+REPLICA_STICKY_SECONDS = int(os.environ.get('REPLICA_STICKY_SECONDS', 5))
+
+if DATABASE_REPLICAS:
+    DATABASE_ROUTERS = ['digital.routers.ReplicaRouter']
+    MIDDLEWARE.insert(MIDDLEWARE.index('django.contrib.auth.middleware.AuthenticationMiddleware') + 1,
+                      'digital.middleware.replica_middleware')
+
+# Кэш (меню категорий, витрина, карточки, страницы каталога) сбрасывается сменой версий ключей —
+# из админки, воркера очереди (run_worker), import_catalog, recompute_prices. Поэтому кэш должен быть
+# общим для всех процессов: память процесса (LocMemCache) для этого не годится.
+# CACHE_BACKEND=file (по умолчанию) — файлы в CACHE_LOCATION, общие для процессов одного сервера;
+# redis (REDIS_URL, нужен пакет redis) или memcached (MEMCACHED_LOCATION, нужен pymemcache) —
+# для нескольких серверов; db — таблица в основной БД, перед запуском: manage.py createcachetable
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'file')
+if CACHE_BACKEND == 'redis':
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+                          'LOCATION': os.environ.get('REDIS_URL', 'redis://127.0.0.1:6379/1')}}
+elif CACHE_BACKEND == 'memcached':
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.memcached.PyMemcacheCache',
+                          'LOCATION': os.environ.get('MEMCACHED_LOCATION', '127.0.0.1:11211')}}
+elif CACHE_BACKEND == 'db':
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+                          'LOCATION': 'django_cache', 'OPTIONS': {'MAX_ENTRIES': 50000}}}
+else:
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                          'LOCATION': os.environ.get('CACHE_LOCATION', BASE_DIR / 'cache'),
+                          'OPTIONS': {'MAX_ENTRIES': 50000}}}
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -21,7 +21,7 @@ from django.conf.urls.static import static
 
 urlpatterns = [
     path('admin/', admin.site.urls),
-    path('', include('digital.urls'))
+    path('', include('digital.async_urls' if settings.ASYNC_VIEWS else 'digital.urls'))
 ]
 
 